@@ -1,5 +1,6 @@
 import os
 import re
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
@@ -86,7 +87,11 @@ def generate_heatmap(data, metric_index, title, output_file):
         return None
 
     grids, layers = create_2d_grid(data, metric_index)
+    show_layer_heatmaps(grids, title)
 
+
+def show_layer_heatmaps(grids, title):
+    """Shows one heatmap per layer of {layer: flipped 2D grid}, as built by create_2d_grid."""
     for layer, grid in grids.items():
         # Flatten grid and remove NaNs for scaling
         valid_values = grid[~np.isnan(grid)].flatten()
@@ -113,6 +118,29 @@ def generate_heatmap(data, metric_index, title, output_file):
         fig.show()
 
 
+def load_tile_count_grids(tile_counts_file):
+    """Reads the inter_die_tiles_*.npz written by make_rr_graph.py into {name: {layer: grid}}.
+
+    The arrays are indexed [layer, x, y]; each layer is flipped like create_2d_grid does.
+    """
+    tile_counts = np.load(tile_counts_file)
+    before = tile_counts["before"]
+    after = tile_counts["after"]
+    metrics = {"Inter-Die Connections Before": before,
+               "Inter-Die Connections After": after,
+               "Removed Inter-Die Connections": before - after}
+    return {name: {layer: np.flipud(counts[layer].astype(float)) for layer in range(counts.shape[0])}
+            for name, counts in metrics.items()}
+
+
+def process_tile_counts(tile_counts_files):
+    """Generates heatmaps from the per-tile counts of the pruning pass, without the rr_graph or its report."""
+    for tile_counts_file in tile_counts_files:
+        print(f"Processing {tile_counts_file}")
+        name = os.path.splitext(os.path.basename(tile_counts_file))[0]
+        for metric, grids in load_tile_count_grids(tile_counts_file).items():
+            show_layer_heatmaps(grids, f"{metric} - {name}")
+
 def process_directory(base_dir):
     """Processes each run directory and generates heatmaps for inter-die connections, fan-in, and fan-out."""
     files = find_rr_graph_analysis_files(base_dir)
@@ -126,6 +154,15 @@ def process_directory(base_dir):
             generate_heatmap(data, 2, f"Average Fan-Out - {run_dir_name}", f"{run_dir_name}_average_fan_out")
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tile_counts", nargs="+", default=None,
+                        help="inter_die_tiles_*.npz files written by make_rr_graph.py; "
+                             "when given, rr_graph_analysis.rpt is not read")
+    args = parser.parse_args()
+
+    if args.tile_counts:
+        process_tile_counts(args.tile_counts)
+        return
     base_directory = "/home/mohagh18/vtr-verilog-to-routing/vtr_flow/tasks/regression_tests/vtr_reg_nightly_test7/3d_sb_titan_quick_qor_auto_bb"
     process_directory(base_directory)
 
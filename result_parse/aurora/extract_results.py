@@ -3,7 +3,7 @@ import re
 import argparse
 from collections import defaultdict
 from multiprocessing import Pool, cpu_count
-from functools import partial
+from functools import lru_cache, partial
 
 try:
     from openpyxl import Workbook
@@ -13,6 +13,9 @@ except ImportError as e:
     raise SystemExit("This script requires 'openpyxl'. Install it with: pip install openpyxl") from e
 
 
+READ_BUFFER_SIZE = 1024 * 1024
+
+
 def parse_config_file(config_filename):
     """Reads the config file and returns:
       - config_entries: dict {output_file: [(metric_name, regex_pattern)]}
@@ -40,70 +43,113 @@ def parse_config_file(config_filename):
     return config_entries, colorscale_metrics
 
 
+# Compiled once per process; every circuit of a run uses the same config
+compile_pattern = lru_cache(maxsize=None)(re.compile)
+
+
+@lru_cache(maxsize=None)
+def compile_any(patterns):
+    """One regex that matches a line wherever any of patterns (a tuple) does, or None without patterns.
+
+    Several metrics can match the same line, so a match only says that the line
+    is worth checking against the patterns one by one.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+def split_metric_patterns(metric_patterns):
+    """Returns (regular [(metric_name, regex)], {context_regex: [(metric_name, value_regex)]}).
+
+    Context patterns are written CONTEXT:context_pattern>>>value_pattern. The
+    context regexes are ordered by specificity (longer patterns first).
+    """
+    regular_patterns = []
+    context_groups = {}
+    for metric_name, regex_pattern in metric_patterns:
+        if regex_pattern.startswith("CONTEXT:"):
+            context_part = regex_pattern[8:]  # Remove "CONTEXT:"
+            if ">>>" in context_part:
+                context_regex, value_regex = context_part.split(">>>", 1)
+                context_groups.setdefault(context_regex.strip(), []).append(
+                    (metric_name, compile_pattern(value_regex.strip())))
+        else:
+            regular_patterns.append((metric_name, compile_pattern(regex_pattern)))
+
+    sorted_contexts = sorted(context_groups.keys(), key=len, reverse=True)
+    return regular_patterns, {compile_pattern(context_regex): context_groups[context_regex]
+                              for context_regex in sorted_contexts}
+
+
+def compile_pending(patterns, pending):
+    return compile_any(tuple(regex.pattern for metric_name, regex in patterns if metric_name in pending))
+
+
+def match_pending(patterns, pending, s, metrics_map):
+    """Record the first match of every pending metric of patterns on line s; returns whether any matched."""
+    matched = False
+    for metric_name, regex in patterns:
+        if metric_name not in pending:
+            continue
+        m = regex.search(s)
+        if m:
+            metrics_map[metric_name] = m.group(1).strip()
+            pending.discard(metric_name)
+            matched = True
+    return matched
+
+
 def extract_metrics(config_entries, circuit_dir, metrics_map):
-    """Extracts metrics from files in circuit_dir into metrics_map."""
+    """Extracts metrics from files in circuit_dir into metrics_map.
+
+    Every file is read once. A line is only checked against the individual
+    patterns when the combined regex of the metrics still missing matches it,
+    and reading stops once every metric of the file is found.
+    """
     for _, metric_patterns in config_entries.items():
         for metric_name, _ in metric_patterns:
             metrics_map.setdefault(metric_name, None)
 
     for output_file, metric_patterns in config_entries.items():
         path = os.path.join(circuit_dir, output_file)
-        
-        # Separate context-aware patterns from regular patterns
-        regular_patterns = []
-        context_patterns = []  # List of (metric_name, context_regex, value_regex)
-        
-        for metric_name, regex_pattern in metric_patterns:
-            if regex_pattern.startswith("CONTEXT:"):
-                # Parse: CONTEXT:context_pattern>>>value_pattern
-                context_part = regex_pattern[8:]  # Remove "CONTEXT:"
-                if ">>>" in context_part:
-                    context_regex, value_regex = context_part.split(">>>", 1)
-                    context_patterns.append((metric_name, context_regex.strip(), value_regex.strip()))
-            else:
-                regular_patterns.append((metric_name, regex_pattern))
-        
-        # Group context patterns by their context_regex
-        # {context_regex: [(metric_name, value_regex), ...]}
-        context_groups = {}
-        for metric_name, context_regex, value_regex in context_patterns:
-            if context_regex not in context_groups:
-                context_groups[context_regex] = []
-            context_groups[context_regex].append((metric_name, value_regex))
-        
-        # Sort context patterns by specificity (longer patterns first)
-        sorted_contexts = sorted(context_groups.keys(), key=len, reverse=True)
-        
+        regular_patterns, context_groups = split_metric_patterns(metric_patterns)
+        pending = {metric_name for metric_name, _ in metric_patterns
+                   if metrics_map.get(metric_name) in (None, -1)}
+
         try:
-            with open(path, "r") as f:
+            with open(path, "r", buffering=READ_BUFFER_SIZE) as f:
+                any_context = compile_any(tuple(context_regex.pattern for context_regex in context_groups))
+                any_regular = compile_pending(regular_patterns, pending)
                 current_context = None  # The active context_regex
-                
+                any_context_value = None
+
                 for line in f:
+                    if not pending:
+                        break
                     s = line.strip()
-                    
+
                     # Check for context changes (most specific first)
-                    for context_regex in sorted_contexts:
-                        if re.search(context_regex, s):
-                            current_context = context_regex
-                            break
-                    
+                    if any_context is not None and any_context.search(s):
+                        for context_regex in context_groups:
+                            if context_regex.search(s):
+                                current_context = context_regex
+                                any_context_value = compile_pending(context_groups[current_context], pending)
+                                break
+
                     # If in a context, try to match value patterns for that context
-                    if current_context and current_context in context_groups:
-                        for metric_name, value_regex in context_groups[current_context]:
-                            if metrics_map.get(metric_name) not in (None, -1):
-                                continue
-                            m = re.search(value_regex, s)
-                            if m:
-                                metrics_map[metric_name] = m.group(1).strip()
-                    
+                    if any_context_value is not None and any_context_value.search(s):
+                        if match_pending(context_groups[current_context], pending, s, metrics_map):
+                            any_context_value = compile_pending(context_groups[current_context], pending)
+                            any_regular = compile_pending(regular_patterns, pending)
+
                     # Standard regex matching for regular patterns
-                    for metric_name, regex_pattern in regular_patterns:
-                        if metrics_map.get(metric_name) not in (None, -1):
-                            continue
-                        m = re.search(regex_pattern, s)
-                        if m:
-                            metrics_map[metric_name] = m.group(1).strip()
-                            
+                    if any_regular is not None and any_regular.search(s):
+                        if match_pending(regular_patterns, pending, s, metrics_map):
+                            any_regular = compile_pending(regular_patterns, pending)
+                            if current_context is not None:
+                                any_context_value = compile_pending(context_groups[current_context], pending)
+
         except FileNotFoundError:
             print(f"Warning: File '{path}' not found. Marking related metrics as None.")
             for metric_name, _ in metric_patterns:
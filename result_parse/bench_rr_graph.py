@@ -0,0 +1,301 @@
+"""Benchmark the rr_graph scripts on synthetic multi-layer rr_graphs.
+
+A synthetic rr_graph has the sections VPR writes, on a grid of identical tiles
+stacked in layers. Every tile holds channel_width CHANX and CHANY wires
+(alternating L1 and L4 segments), pins_per_tile OPINs and IPINs and one SOURCE
+and SINK. OPINs and wires drive wires of the tile where they end, wires drive
+IPINs, and a fraction of the wires and OPINs also drive a wire or an IPIN of the
+same tile on the neighbouring layers, which makes the inter-die edges.
+
+Each benchmark runs one configuration of make_rr_graph.py or wire_driver_size.py
+as a child process on every generated graph. The wall time, CPU time and peak
+RSS of the child (the largest of it and its pool workers) and the size of its
+output are appended to bench_results.csv, tagged with --label, so runs of
+different engines or versions of the scripts can be compared offline.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EDGE_REMOVAL_RATES = ["0.5", "0.65", "0.8"]
+SEGMENT_LENGTHS = (1, 4)
+RESULTS_CSV_NAME = "bench_results.csv"
+
+# name: (script, arguments besides the input/output directories)
+BENCHMARKS = {
+    "make_rr_graph_etree": ("make_rr_graph.py", ["--engine", "etree"]),
+    "make_rr_graph_stream": ("make_rr_graph.py", ["--engine", "stream"]),
+    "make_rr_graph_stream_shm": ("make_rr_graph.py", ["--engine", "stream", "--shared_memory"]),
+    "wire_driver_size": ("wire_driver_size.py", []),
+    "wire_driver_size_shm": ("wire_driver_size.py", ["--shared_memory"]),
+}
+
+
+@dataclass(frozen=True)
+class SyntheticArch:
+    grid_size: int
+    num_layers: int
+    channel_width: int
+    pins_per_tile: int = 8
+    inter_die_fraction: float = 0.3
+
+    @property
+    def name(self) -> str:
+        return f"syn_{self.grid_size}x{self.grid_size}_l{self.num_layers}_cw{self.channel_width}"
+
+    @property
+    def nodes_per_tile(self) -> int:
+        return 2 * self.channel_width + 2 * self.pins_per_tile + 2
+
+
+@dataclass
+class GraphSize:
+    num_nodes: int = 0
+    num_edges: int = 0
+
+
+def write_synthetic_rr_graph(rr_graph_file_dir: str, arch: SyntheticArch, seed: int) -> GraphSize:
+    """Write the synthetic rr_graph of arch; the same seed writes the same file."""
+    rng = random.Random(seed)
+    size = arch.grid_size
+    width = arch.channel_width
+    pins = arch.pins_per_tile
+    tiles = list(itertools.product(range(arch.num_layers), range(size), range(size)))
+    graph_size = GraphSize()
+
+    # Node ids of a tile: CHANX, CHANY, OPIN, IPIN, SOURCE, SINK
+    def tile_base(layer, x, y):
+        return ((layer * size + x) * size + y) * arch.nodes_per_tile
+
+    def wire_end(x, y, track, is_chany):
+        length = SEGMENT_LENGTHS[track % len(SEGMENT_LENGTHS)]
+        if is_chany:
+            return x, min(y + length - 1, size - 1)
+        return min(x + length - 1, size - 1), y
+
+    def random_wires(layer, x, y, count):
+        base = tile_base(layer, x, y)
+        return [base + track for track in rng.sample(range(2 * width), min(count, 2 * width))]
+
+    with open(rr_graph_file_dir, "w") as f:
+        f.write(f'<rr_graph tool_name="vpr" tool_version="synthetic" tool_comment="{arch.name}">\n')
+        f.write(f' <channels>\n  <channel chan_width_max="{width}" x_min="{width}" y_min="{width}" '
+                f'x_max="{width}" y_max="{width}"/>\n')
+        for x in range(size):
+            f.write(f'  <x_list index="{x}" info="{width}"/>\n')
+        for y in range(size):
+            f.write(f'  <y_list index="{y}" info="{width}"/>\n')
+        f.write(' </channels>\n <switches>\n')
+        for switch_id, name in enumerate(("__vpr_delayless_switch__", "mux", "inter_die")):
+            f.write(f'  <switch id="{switch_id}" type="mux" name="{name}">\n'
+                    f'   <timing R="0" Cin="0" Cout="0" Tdel="0"/>\n'
+                    f'   <sizing mux_trans_size="0" buf_size="0"/>\n  </switch>\n')
+        f.write(' </switches>\n <segments>\n')
+        for segment_id, length in enumerate(SEGMENT_LENGTHS):
+            f.write(f'  <segment id="{segment_id}" name="L{length}" length="{length}" res_type="GENERAL">\n'
+                    f'   <timing R_per_meter="0" C_per_meter="0"/>\n  </segment>\n')
+        f.write(' </segments>\n <block_types>\n'
+                '  <block_type id="0" name="EMPTY" width="1" height="1"/>\n'
+                '  <block_type id="1" name="clb" width="1" height="1"/>\n </block_types>\n <grid>\n')
+        for layer, x, y in tiles:
+            f.write(f'  <grid_loc layer="{layer}" x="{x}" y="{y}" block_type_id="1" '
+                    f'width_offset="0" height_offset="0"/>\n')
+        f.write(' </grid>\n <rr_nodes>\n')
+
+        for layer, x, y in tiles:
+            node_id = tile_base(layer, x, y)
+            lines = []
+            for is_chany in (False, True):
+                for track in range(width):
+                    xhigh, yhigh = wire_end(x, y, track, is_chany)
+                    direction = "INC_DIR" if track % 2 == 0 else "DEC_DIR"
+                    lines.append(f'  <node id="{node_id}" type="{"CHANY" if is_chany else "CHANX"}" '
+                                 f'direction="{direction}" capacity="1">\n'
+                                 f'   <loc layer="{layer}" xlow="{x}" ylow="{y}" xhigh="{xhigh}" yhigh="{yhigh}" '
+                                 f'ptc="{track}"/>\n   <timing R="0" C="0"/>\n'
+                                 f'   <segment segment_id="{track % len(SEGMENT_LENGTHS)}"/>\n  </node>\n')
+                    node_id += 1
+            for node_type in ("OPIN", "IPIN"):
+                for pin in range(pins):
+                    lines.append(f'  <node id="{node_id}" type="{node_type}" capacity="1">\n'
+                                 f'   <loc layer="{layer}" xlow="{x}" ylow="{y}" xhigh="{x}" yhigh="{y}" '
+                                 f'side="TOP" ptc="{pin}"/>\n   <timing R="0" C="0"/>\n  </node>\n')
+                    node_id += 1
+            for node_type in ("SOURCE", "SINK"):
+                lines.append(f'  <node id="{node_id}" type="{node_type}" capacity="{pins}">\n'
+                             f'   <loc layer="{layer}" xlow="{x}" ylow="{y}" xhigh="{x}" yhigh="{y}" ptc="0"/>\n'
+                             f'   <timing R="0" C="0"/>\n  </node>\n')
+                node_id += 1
+            f.write("".join(lines))
+            graph_size.num_nodes += len(lines)
+
+        f.write(' </rr_nodes>\n <rr_edges>\n')
+        fan_out = max(2, width // 8)
+        for layer, x, y in tiles:
+            base = tile_base(layer, x, y)
+            opins = range(base + 2 * width, base + 2 * width + pins)
+            ipins = range(base + 2 * width + pins, base + 2 * width + 2 * pins)
+            source = base + 2 * width + 2 * pins
+            other_layers = [other for other in (layer - 1, layer + 1) if 0 <= other < arch.num_layers]
+            edges = []
+            for track in range(2 * width):
+                end_x, end_y = wire_end(x, y, track % width, track >= width)
+                for sink in random_wires(layer, end_x, end_y, fan_out):
+                    edges.append((base + track, sink, 1))
+                edges.append((base + track, rng.choice(ipins), 1))
+                if other_layers and rng.random() < arch.inter_die_fraction:
+                    edges.append((base + track, random_wires(rng.choice(other_layers), x, y, 1)[0], 2))
+            for opin in opins:
+                for sink in random_wires(layer, x, y, fan_out):
+                    edges.append((opin, sink, 1))
+                if other_layers and rng.random() < arch.inter_die_fraction:
+                    other_base = tile_base(rng.choice(other_layers), x, y)
+                    edges.append((opin, other_base + 2 * width + pins + rng.randrange(pins), 2))
+            edges.extend((source, opin, 0) for opin in opins)
+            edges.extend((ipin, source + 1, 0) for ipin in ipins)
+            f.write("".join(f'  <edge src_node="{src}" sink_node="{sink}" switch="{switch}"/>\n'
+                            for src, sink, switch in edges))
+            graph_size.num_edges += len(edges)
+        f.write(' </rr_edges>\n</rr_graph>\n')
+    return graph_size
+
+
+def get_dir_size(dir_path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, _, file_names in os.walk(dir_path) for file_name in file_names)
+
+
+def run_measured(command, log_file_dir: str) -> tuple[float, float, float]:
+    """Run command as a child process; returns (wall time, CPU time, peak RSS in MiB).
+
+    The rusage of a waited-for child includes the children it waited for, so the
+    peak RSS is that of the largest process among the script and its pool workers.
+    """
+    with open(log_file_dir, "w") as log_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=SCRIPT_DIR)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with exit code {process.returncode}, see {log_file_dir}")
+    return wall_time, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss / 1024
+
+
+def get_benchmark_command(benchmark: str, vtr_run_dir: str, resource_dir: str, output_dir: str,
+                          num_workers: int, seed: int) -> list:
+    script, extra_args = BENCHMARKS[benchmark]
+    command = [sys.executable, os.path.join(SCRIPT_DIR, script), "--vtr_run_dir", vtr_run_dir,
+               "--output_dir", output_dir, "-j", str(num_workers), "--seed", str(seed), *extra_args]
+    if script == "make_rr_graph.py":
+        command += ["--removal_rates", *EDGE_REMOVAL_RATES]
+    else:
+        command += ["--rr_graph_resource_dir", resource_dir]
+    return command
+
+
+def prepare_graph(bench_dir: str, arch: SyntheticArch, seed: int) -> tuple[str, GraphSize]:
+    """Generate the VTR run directory of arch (once) and the inputs of wire_driver_size.py."""
+    graph_dir = os.path.join(bench_dir, arch.name)
+    rr_graph_dir = os.path.join(graph_dir, "vtr_run", f"{arch.name}.blif", "common", "rr_graph.xml")
+    resource_dir = os.path.join(graph_dir, "resources")
+    graph_size_file_dir = os.path.join(graph_dir, f"graph_size_{seed}.json")
+    if not os.path.isfile(graph_size_file_dir):
+        os.makedirs(os.path.dirname(rr_graph_dir), exist_ok=True)
+        print(f"Generating {rr_graph_dir}...")
+        graph_size = write_synthetic_rr_graph(rr_graph_dir, arch, seed)
+        shutil.rmtree(resource_dir, ignore_errors=True)
+        # Written last, so an interrupted generation is redone
+        with open(graph_size_file_dir, "w") as f:
+            json.dump(asdict(graph_size), f)
+    else:
+        with open(graph_size_file_dir) as f:
+            graph_size = GraphSize(**json.load(f))
+
+    if not os.path.isdir(resource_dir):
+        os.makedirs(resource_dir)
+        run_measured(get_benchmark_command("make_rr_graph_stream", os.path.join(graph_dir, "vtr_run"), "",
+                                           resource_dir, 1, seed), os.path.join(graph_dir, "resources.log"))
+    return graph_dir, graph_size
+
+
+def append_results(results_csv_dir: str, rows) -> None:
+    write_header = not os.path.isfile(results_csv_dir)
+    with open(results_csv_dir, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def getArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench_dir", required=True,
+                        help="Directory of the generated rr_graphs, the benchmark outputs and bench_results.csv")
+    parser.add_argument("--grid_sizes", nargs="+", type=int, default=[10, 20])
+    parser.add_argument("--num_layers", nargs="+", type=int, default=[2])
+    parser.add_argument("--channel_widths", nargs="+", type=int, default=[40])
+    parser.add_argument("--pins_per_tile", type=int, default=8)
+    parser.add_argument("--inter_die_fraction", type=float, default=0.3,
+                        help="Fraction of the wires and OPINs that also drive a node on a neighbouring layer")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("-j", type=int, default=4, help="Number of threads given to the scripts")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of every benchmark on every graph")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated graphs and of the scripts")
+    parser.add_argument("--label", default="",
+                        help="Tag of the rows of this run in bench_results.csv, e.g. a commit or machine name")
+    parser.add_argument("--keep_outputs", action="store_true",
+                        help="Keep the rr_graphs written by the benchmarks instead of deleting them after measuring")
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    bench_dir = os.path.abspath(args.bench_dir)
+    os.makedirs(bench_dir, exist_ok=True)
+    results_csv_dir = os.path.join(bench_dir, RESULTS_CSV_NAME)
+
+    for grid_size, num_layers, channel_width in itertools.product(args.grid_sizes, args.num_layers,
+                                                                   args.channel_widths):
+        arch = SyntheticArch(grid_size, num_layers, channel_width, args.pins_per_tile, args.inter_die_fraction)
+        graph_dir, graph_size = prepare_graph(bench_dir, arch, args.seed)
+        rr_graph_dir = os.path.join(graph_dir, "vtr_run", f"{arch.name}.blif", "common", "rr_graph.xml")
+
+        rows = []
+        for benchmark, repeat in itertools.product(args.benchmarks, range(args.repeat)):
+            output_dir = os.path.join(graph_dir, benchmark)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.makedirs(output_dir)
+            command = get_benchmark_command(benchmark, os.path.join(graph_dir, "vtr_run"),
+                                            os.path.join(graph_dir, "resources"), output_dir, args.j, args.seed)
+            wall_time, cpu_time, peak_rss_mb = run_measured(command, os.path.join(graph_dir, f"{benchmark}.log"))
+            output_mb = get_dir_size(output_dir) / 1024**2
+            print(f"\t{arch.name} {benchmark} #{repeat}: {wall_time:.2f} seconds, "
+                  f"{cpu_time:.2f} CPU seconds, {peak_rss_mb:.1f} MiB peak RSS, {output_mb:.1f} MiB written")
+            rows.append({"label": args.label, "graph": arch.name, **asdict(arch),
+                         "rr_graph_mb": f"{os.path.getsize(rr_graph_dir) / 1024**2:.2f}", **asdict(graph_size),
+                         "benchmark": benchmark, "repeat": repeat, "num_workers": args.j,
+                         "wall_time": f"{wall_time:.3f}", "cpu_time": f"{cpu_time:.3f}",
+                         "peak_rss_mb": f"{peak_rss_mb:.1f}", "output_mb": f"{output_mb:.2f}"})
+            if not args.keep_outputs:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        append_results(results_csv_dir, rows)
+
+    print(f"Benchmark results are appended to {results_csv_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,143 @@
 import os
-import re
+import argparse
+import csv
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool
 
-def get_total_inter_die_conn(vpr_out_file):
-    with open(vpr_out_file, 'r') as file:
-        content = file.read()
+import numpy as np
 
-    pattern = r'Netlist\n\s+(\d+)\s+blocks of type: (\w+)'
-    matches = re.findall(pattern, content)
-    block_counts = {}
-    for count, block_type in matches:
-        block_counts[block_type] = int(count)
+from route_file import count_layer_pairs, crossing_layer_pairs, iter_route_nets
 
-    total_num_conn = 0
-    for block_type in block_counts:
-        count = block_counts[block_type]
-        if block_type == "io":
-            total_num_conn += (count * 4)
-        elif block_type == "clb":
-            total_num_conn += (count * 20)
-        elif block_type == "dsp_top":
-            total_num_conn += (count * 74)
-        elif block_type == "memory":
-            total_num_conn += (count * 40)
-        else:
-            assert block_type == "tsv_hole"
 
-    return total_num_conn
+# Placeholder blocks that make no connections, whatever ports the architecture gives them
+NO_CONNECTION_BLOCK_TYPES = ("tsv_hole",)
 
 
+def get_output_pins_per_block_type(arch_file):
+    """{block type: number of output pins} of the top-level pb_types of an architecture file.
 
+    Each output pin of a block drives at most one net, so the output pins of the
+    placed blocks bound the number of inter-die connections. The blocks of
+    NO_CONNECTION_BLOCK_TYPES count as 0.
+    """
+    output_pins = {}
+    for pb_type_tag in ET.parse(arch_file).getroot().find("complexblocklist").findall("pb_type"):
+        output_pins[pb_type_tag.get("name")] = sum(int(output_tag.get("num_pins"))
+                                                   for output_tag in pb_type_tag.findall("output"))
+    for block_type in NO_CONNECTION_BLOCK_TYPES:
+        output_pins[block_type] = 0
+    return output_pins
 
-def get_layer_counts(route_file):
-    layer_count = 0
-    previous_layer = -1
 
-    with open(route_file, 'r') as file:
+def get_block_counts(vpr_out_file):
+    """{block type: number of blocks} of the "Netlist" part of VPR's resource usage report."""
+    block_counts = {}
+    after_netlist = False
+    with open(vpr_out_file, 'r') as file:
         for line in file:
-            if line.startswith("Net"):
-                previous_layer = -1
-                continue  # Skip until the "Net" section
-            elif line.startswith("Node"):
+            if after_netlist:
                 elements = line.split()
-                assert len(elements) > 5
-                node_type = elements[2]
-                coordinate = elements[3].strip('()').split(',')
-                current_layer = int(coordinate[0])
-                if node_type == "SINK":
-                    previous_layer = -1
-                elif previous_layer == -1:
-                    previous_layer = current_layer
-                elif current_layer != previous_layer:
-                    layer_count += 1
-                    previous_layer = current_layer
+                if len(elements) == 5 and elements[1:4] == ["blocks", "of", "type:"]:
+                    block_counts[elements[4]] = int(elements[0])
+            after_netlist = line.strip() == "Netlist"
+    return block_counts
+
+
+def get_total_inter_die_conn(vpr_out_file, output_pins):
+    total_num_conn = 0
+    for block_type, count in get_block_counts(vpr_out_file).items():
+        if block_type not in output_pins:
+            raise ValueError(f"{vpr_out_file}: block type {block_type} is not in the architecture")
+        total_num_conn += count * output_pins[block_type]
+    return total_num_conn
+
 
+def get_layer_counts(route_file, net_csv_file=None):
+    """Inter-die crossings of a .route file: (total, {(from layer, to layer): count}, nets with a crossing).
 
-    return layer_count
+    With net_csv_file, the crossings of every net are also written there.
+    """
+    num_crossing_nets = 0
+    layer_pairs = []
+    net_rows = []
+    for net in iter_route_nets(route_file):
+        net_layer_pairs = crossing_layer_pairs(net)
+        if len(net_layer_pairs):
+            num_crossing_nets += 1
+            layer_pairs.append(net_layer_pairs)
+        if net_csv_file is not None:
+            net_rows.append([net.net_id, net.name, net.num_nodes, len(net_layer_pairs)])
 
-def main(directory):
-    subdirs = [subdir for subdir in os.listdir(directory) if os.path.isdir(os.path.join(directory, subdir))]
+    if net_csv_file is not None:
+        with open(net_csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["net_id", "net", "num_nodes", "inter_die_crossings"])
+            writer.writerows(net_rows)
 
+    layer_pairs = np.concatenate(layer_pairs) if layer_pairs else np.zeros((0, 2), dtype=np.int8)
+    return len(layer_pairs), count_layer_pairs(layer_pairs), num_crossing_nets
+
+
+def get_circuit_inter_die_conn(thread_arg):
+    """thread_arg is [circuit directory, architecture file, per-net CSV directory or None]."""
+    circuit_dir = thread_arg[0]
+    arch_file = thread_arg[1]
+    net_csv_dir = thread_arg[2]
+
+    subdir = os.path.basename(circuit_dir)
+    route_file = os.path.join(circuit_dir, "common", subdir[:-2] + ".pre-vpr" + ".route")
+    if not os.path.exists(route_file):
+        print(f"{route_file} doesn't exist")
+        return None
+
+    total_con = get_total_inter_die_conn(os.path.join(circuit_dir, "common", "vpr.out"),
+                                         get_output_pins_per_block_type(arch_file))
+    net_csv_file = os.path.join(net_csv_dir, f"{subdir}_net_crossings.csv") if net_csv_dir is not None else None
+    layer_count, layer_pair_counts, num_crossing_nets = get_layer_counts(route_file, net_csv_file)
+    print(f"{subdir}\t{layer_count}({(layer_count/total_con)*100:.2f}%)")
+    return {"circuit": subdir, "inter_die_conn": layer_count, "total_conn": total_con,
+            "percentage": f"{(layer_count/total_con)*100:.2f}", "crossing_nets": num_crossing_nets,
+            **{f"layer_{from_layer}_to_{to_layer}": count
+               for (from_layer, to_layer), count in sorted(layer_pair_counts.items())}}
+
+
+def getArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task_dir", default="/home/amin/wintermute_mount/run_koios/run001/aman_3d_coffe.xml",
+                        help="VTR task run directory of one architecture, with one subdirectory per circuit")
+    parser.add_argument("--arch_file", default=None,
+                        help="Architecture file giving the output pins of every block type "
+                             "(default: the copy VTR leaves in the common directory of each circuit)")
+    parser.add_argument("-j", type=int, default=1, help="Number of circuits processed in parallel")
+    parser.add_argument("--output_csv", default=None, help="Write one row per circuit here")
+    parser.add_argument("--net_csv_dir", default=None,
+                        help="Write the inter-die crossings of every net to <circuit>_net_crossings.csv here")
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    directory = args.task_dir
+    subdirs = sorted(subdir for subdir in os.listdir(directory) if os.path.isdir(os.path.join(directory, subdir)))
+    if args.net_csv_dir is not None:
+        os.makedirs(args.net_csv_dir, exist_ok=True)
+
+    thread_args = []
     for subdir in subdirs:
-        total_con = get_total_inter_die_conn(os.path.join(directory, subdir, "common", "vpr.out"))
-        route_file = os.path.join(directory, subdir, "common", subdir[:-2] + ".pre-vpr" + ".route")
-        if os.path.exists(route_file):
-            layer_count = get_layer_counts(route_file)
-            print(f"{subdir}\t{layer_count}({(layer_count/total_con)*100:.2f}%)")
-        else:
-            print(f"{route_file} doesn't exist")
+        arch_file = args.arch_file
+        if arch_file is None:
+            arch_file = os.path.join(directory, subdir, "common", os.path.basename(os.path.normpath(directory)))
+        thread_args.append([os.path.join(directory, subdir), arch_file, args.net_csv_dir])
+
+    with Pool(args.j) as pool:
+        rows = [row for row in pool.map(get_circuit_inter_die_conn, thread_args, chunksize=1) if row is not None]
+
+    if args.output_csv is not None and rows:
+        fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+        with open(args.output_csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames, restval=0)
+            writer.writeheader()
+            writer.writerows(rows)
 
 if __name__ == "__main__":
-    directory = "/home/amin/wintermute_mount/run_koios/run001/aman_3d_coffe.xml"
-    main(directory)
+    main()
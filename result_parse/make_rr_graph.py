@@ -1,122 +1,223 @@
 import xml.etree.ElementTree as ET
-import random
 import os
 import argparse
 from multiprocessing import Pool
-import time
-
-
-def get_grid_loc(root_tag):
-    grid_tag = root_tag.find("grid")
-    max_x = 0
-    max_y = 0
-    max_layer = 0
-    for grid_loc_tag in grid_tag:
-        loc_x = int(grid_loc_tag.get("x"))
-        loc_y = int(grid_loc_tag.get("y"))
-        loc_layer = int(grid_loc_tag.get("layer"))
-        if loc_x > max_x:
-            max_x = loc_x
-        if loc_y > max_y:
-            max_y = loc_y
-        if loc_layer > max_layer:
-            max_layer = loc_layer
-    return max_x, max_y, max_layer
+import zlib
+import numpy as np
+
+from memory_scheduler import run_with_memory_budget
+from rr_graph_mmap import read_edge_offsets, write_rr_graph_variants
+from rr_graph_shm import SharedRRGraph, get_write_job_name, write_shared_rr_graph_variant
+from rr_graph_cache import read_rr_graph_cached
+from rr_graph_timing import JobTimer, clear_timing_records, write_timing_csv
+from rr_graph_table import rr_graph_from_root, rank_within_groups, removal_threshold
+
+# Rough peak RSS per byte of rr_graph XML of one job of each engine, refined while running
+RSS_PER_INPUT_BYTE = {"etree": 13.0, "stream": 2.0}
+
+
+def get_rr_graph_name(circuit, edge_removal_rate, output_format="xml"):
+    return f"rr_graph_{circuit}_{int(edge_removal_rate*100)}.{output_format}"
+
+def get_job_name(circuit):
+    return f"make_rr_graph_{circuit}"
+
+def get_circuit_rng(seed, circuit):
+    """Random generator of one circuit, independent of the order in which the Pool runs the jobs."""
+    return np.random.default_rng([seed, zlib.crc32(circuit.encode())])
+
+def get_inter_die_keep_masks(rr_graph, edge_removal_rates, nested, rng):
+    """Sample each removal rate of the inter-die edges of every tile.
+
+    Inter-die edges are grouped by the (x, y, layer) high location of their src
+    node and shuffled inside their tile, and a rate removes the first
+    int(tile size * rate) edges of each tile. With nested sampling all
+    rates share one set of keys, so a higher rate removes a superset of the
+    edges of a lower one; otherwise every rate draws its own keys. Returns
+    {rate: boolean mask over all edges that is False for the removed edges}.
+    """
+    inter_die_edges = rr_graph.inter_die_edges()
+    tile_key = rr_graph.tile_of_nodes(rr_graph.edges.src[inter_die_edges])
+
+    edge_keep_masks = {}
+    random_key = rng.random(len(inter_die_edges))
+    for edge_removal_rate in edge_removal_rates:
+        if not nested and edge_keep_masks:
+            random_key = rng.random(len(inter_die_edges))
+        rank_in_tile, tile_size = rank_within_groups(tile_key, random_key)
+        removed_edges = inter_die_edges[rank_in_tile < removal_threshold(tile_size, edge_removal_rate)]
+
+        edge_keep_mask = np.ones(rr_graph.edges.num_edges, dtype=bool)
+        edge_keep_mask[removed_edges] = False
+        edge_keep_masks[edge_removal_rate] = edge_keep_mask
+    return edge_keep_masks
+
+def get_tile_counts_name(circuit, edge_removal_rate):
+    return f"inter_die_tiles_{circuit}_{int(edge_removal_rate*100)}.npz"
+
+def count_inter_die_edges_per_tile(rr_graph, edges):
+    """Number of the given inter-die edges per (layer, x, y) tile of their src node."""
+    tile_key = rr_graph.tile_of_nodes(rr_graph.edges.src[edges])
+    return np.bincount(tile_key, minlength=int(np.prod(rr_graph.grid_shape))).reshape(rr_graph.grid_shape)
+
+def write_inter_die_tile_counts(output_dir, circuit, rr_graph, edge_keep_masks):
+    """Save the per-tile inter-die edge counts before and after every removal rate.
+
+    inter_die_tiles_<circuit>_<rate>.npz holds "before" and "after" arrays
+    indexed [layer, x, y], the same tiles the edges are sampled in.
+    """
+    inter_die_edges = rr_graph.inter_die_edges()
+    before = count_inter_die_edges_per_tile(rr_graph, inter_die_edges)
+    for edge_removal_rate, edge_keep_mask in edge_keep_masks.items():
+        after = count_inter_die_edges_per_tile(rr_graph, inter_die_edges[edge_keep_mask[inter_die_edges]])
+        np.savez(os.path.join(output_dir, get_tile_counts_name(circuit, edge_removal_rate)),
+                 before=before.astype(np.int32), after=after.astype(np.int32))
 
 def remove_inter_die_edge(thread_arg):
     rr_graph_file_dir = thread_arg[0]
-    edge_removal_rate = thread_arg[1]
+    edge_removal_rates = thread_arg[1]
     circuit = thread_arg[2]
     output_dir = thread_arg[3]
+    nested = thread_arg[4]
+    seed = thread_arg[5]
+    timing_dir = thread_arg[10]
 
-    rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}.xml"
+    print(f"Start working on {circuit} with removal rates {edge_removal_rates}...")
+    timer = JobTimer(get_job_name(circuit))
 
-    print(f"Start working on {rr_graph_name}...")
-
-    start_time = time.perf_counter()
-    tree = ET.parse(rr_graph_file_dir)
-    end_time = time.perf_counter()
-    execution_time = end_time - start_time
-    print(f"\tParsing {rr_graph_name} is done ({execution_time:.6f} seconds)!")
+    with timer.phase("parse") as phase:
+        tree = ET.parse(rr_graph_file_dir)
+    print(f"\tParsing {rr_graph_file_dir} is done ({phase.wall_time:.6f} seconds)!")
     root = tree.getroot()
-    rr_node_tag = root.find("rr_nodes")
     rr_edge_tag = root.find("rr_edges")
+    original_edges = list(rr_edge_tag)
 
-    nodes = {}
-
-    max_x, max_y, max_layer = get_grid_loc(root)
-    print(f"\t{circuit} FPGA size: {max_x} {max_y} {max_layer}")
-
-    for node_tag in rr_node_tag:
-        node_id = int(node_tag.get("id"))
-        loc_tag = node_tag.find("loc")
-        loc_high = (int(loc_tag.get("xhigh")), int(loc_tag.get("yhigh")), int(loc_tag.get("layer")))
-        loc_low = (int(loc_tag.get("xlow")), int(loc_tag.get("ylow")), int(loc_tag.get("layer")))
-        type = node_tag.get("type")
-        nodes[node_id] = {"high_location": loc_high, "low_location": loc_low, "type": type, "length": None}
-        if type == "CHANX" or type == "CHANY":
-            seg_tag = node_tag.find("segment")
-            seg_id = int(seg_tag.get("segment_id"))
-            if seg_id == 0:
-                nodes[node_id]["length"] = 4
-            else:
-                assert seg_id == 1
-                nodes[node_id]["length"] = 16
-
-    grid_3d_edge_tag = []
-
-    for x in range(max_x+1):
-        grid_3d_edge_tag.append([])
-        for y in range(max_y+1):
-            grid_3d_edge_tag[-1].append([])
-            for l in range(max_layer+1):
-                # grid[-1].append({"total": 0, "L4->L4": 0, "L4->L16": 0, "L16->L16": 0})
-                grid_3d_edge_tag[-1][-1].append([])
-
-    for edge_tag in rr_edge_tag:
-        src_node = int(edge_tag.get("src_node"))
-        sink_node = int(edge_tag.get("sink_node"))
-        src_x = nodes[src_node]["high_location"][0]
-        src_y = nodes[src_node]["high_location"][1]
-        src_layer = nodes[src_node]["high_location"][2]
-
-        sink_layer = nodes[sink_node]["high_location"][2]
-        if src_layer != sink_layer:
-            grid_3d_edge_tag[src_x][src_y][src_layer].append(edge_tag)
-
-    edges_to_remove = []
-    for x in range(max_x+1):
-        for y in range(max_y+1):
-            for l in range(max_layer+1):
-                num_elem = int(len(grid_3d_edge_tag[x][y][l]) * edge_removal_rate)
-                edges_to_remove.extend(random.sample(grid_3d_edge_tag[x][y][l], num_elem))
-
-    print(f"\tStart removing {len(edges_to_remove)} number of edges from {rr_graph_name}!")
-    start_time = time.perf_counter()
-    set_edges_to_remove = set(edges_to_remove)
-    remaining_edgs = [edge for edge in list(rr_edge_tag) if edge not in set_edges_to_remove]
-    rr_edge_tag[:] = remaining_edgs
-    end_time = time.perf_counter()
-    execution_time = end_time - start_time
-    print(f"\tDone removing {len(edges_to_remove)} number of edges from {rr_graph_name} ({execution_time:.6f} seconds)!")
-
-    print(f"\tStart writing {rr_graph_name}")
-    start_time = time.perf_counter()
-    tree.write(os.path.join(output_dir, rr_graph_name), encoding='utf-8', xml_declaration=False)
-    end_time = time.perf_counter()
-    execution_time = end_time - start_time
-    print(f"\tDone writing {rr_graph_name} ({execution_time:.6f} seconds)!")
-
-    print(f"Writing {rr_graph_name} is complete!")
-    
-def get_remaining_rr_graph(output_dir, circuits, removal_rates):
-    remaning_circuits_removal_rate = []
+    with timer.phase("build"):
+        rr_graph = rr_graph_from_root(root)
+    timer.set_graph_size(rr_graph)
+    print(f"\t{circuit} FPGA size: {rr_graph.max_x} {rr_graph.max_y} {rr_graph.max_layer}")
+
+    with timer.phase("sample"):
+        edge_keep_masks = get_inter_die_keep_masks(rr_graph, edge_removal_rates, nested, get_circuit_rng(seed, circuit))
+        write_inter_die_tile_counts(output_dir, circuit, rr_graph, edge_keep_masks)
+    for edge_removal_rate, edge_keep_mask in edge_keep_masks.items():
+        rr_graph_name = get_rr_graph_name(circuit, edge_removal_rate)
+        num_removed = int(np.count_nonzero(~edge_keep_mask))
+
+        print(f"\tStart removing {num_removed} number of edges from {rr_graph_name}!")
+        with timer.phase(f"remove_{int(edge_removal_rate*100)}") as phase:
+            rr_edge_tag[:] = [original_edges[edge_idx] for edge_idx in np.flatnonzero(edge_keep_mask)]
+        print(f"\tDone removing {num_removed} number of edges from {rr_graph_name} ({phase.wall_time:.6f} seconds)!")
+
+        print(f"\tStart writing {rr_graph_name}")
+        with timer.phase(f"write_{int(edge_removal_rate*100)}", num_edges=len(rr_edge_tag)) as phase:
+            tree.write(os.path.join(output_dir, rr_graph_name), encoding='utf-8', xml_declaration=False)
+        print(f"\tDone writing {rr_graph_name} ({phase.wall_time:.6f} seconds)!")
+
+        print(f"Writing {rr_graph_name} is complete!")
+    timer.write(timing_dir)
+
+def remove_inter_die_edge_streaming(thread_arg):
+    rr_graph_file_dir = thread_arg[0]
+    edge_removal_rates = thread_arg[1]
+    circuit = thread_arg[2]
+    output_dir = thread_arg[3]
+    nested = thread_arg[4]
+    seed = thread_arg[5]
+    output_format = thread_arg[6]
+    capnp_schema = thread_arg[7]
+    cache_dir = thread_arg[8]
+    max_cache_bytes = thread_arg[9]
+    timing_dir = thread_arg[10]
+
+    print(f"Start working on {circuit} with removal rates {edge_removal_rates} (streaming)...")
+    timer = JobTimer(get_job_name(circuit))
+
+    with timer.phase("parse") as phase:
+        rr_graph = read_rr_graph_cached(rr_graph_file_dir, cache_dir, max_cache_bytes)
+    timer.set_graph_size(rr_graph)
+    print(f"\tParsing {rr_graph_file_dir} is done ({phase.wall_time:.6f} seconds)!")
+    print(f"\t{circuit} FPGA size: {rr_graph.max_x} {rr_graph.max_y} {rr_graph.max_layer}")
+    print(f"\t{circuit} segment lengths: {rr_graph.nodes.segment_lengths()}")
+
+    with timer.phase("sample"):
+        edge_keep_masks = get_inter_die_keep_masks(rr_graph, edge_removal_rates, nested, get_circuit_rng(seed, circuit))
+        write_inter_die_tile_counts(output_dir, circuit, rr_graph, edge_keep_masks)
+    output_edge_keep_masks = {}
+    for edge_removal_rate, edge_keep_mask in edge_keep_masks.items():
+        rr_graph_name = get_rr_graph_name(circuit, edge_removal_rate, output_format)
+        print(f"\tRemoving {np.count_nonzero(~edge_keep_mask)} number of edges from {rr_graph_name}!")
+        output_edge_keep_masks[os.path.join(output_dir, rr_graph_name)] = edge_keep_mask
+
+    print(f"\tStart writing {len(output_edge_keep_masks)} rr_graphs of {circuit}")
+    num_written_edges = sum(int(np.count_nonzero(edge_keep_mask)) for edge_keep_mask in edge_keep_masks.values())
+    with timer.phase("write", num_edges=num_written_edges) as phase:
+        if output_format == "bin":
+            from rr_graph_capnp import write_rr_graph_binary_variants
+            write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph, output_edge_keep_masks, capnp_schema)
+        else:
+            write_rr_graph_variants(rr_graph_file_dir, output_edge_keep_masks)
+    print(f"\tDone writing {len(output_edge_keep_masks)} rr_graphs of {circuit} ({phase.wall_time:.6f} seconds)!")
+
+    print(f"Writing rr_graphs of {circuit} is complete!")
+    timer.write(timing_dir)
+
+def remove_inter_die_edge_shared(pool, thread_arg):
+    """Parse one circuit in this process and write its removal rates in parallel on pool.
+
+    The graph (and the byte offsets of its edges) is placed in shared memory once;
+    every pool task attaches to it and receives only the keep mask of its rate.
+    """
+    rr_graph_file_dir = thread_arg[0]
+    edge_removal_rates = thread_arg[1]
+    circuit = thread_arg[2]
+    output_dir = thread_arg[3]
+    nested = thread_arg[4]
+    seed = thread_arg[5]
+    output_format = thread_arg[6]
+    capnp_schema = thread_arg[7]
+    cache_dir = thread_arg[8]
+    max_cache_bytes = thread_arg[9]
+    timing_dir = thread_arg[10]
+
+    print(f"Start working on {circuit} with removal rates {edge_removal_rates} (shared memory)...")
+    timer = JobTimer(get_job_name(circuit))
+
+    with timer.phase("parse") as phase:
+        # The pool is idle while the graph is parsed, so it reads the edges
+        rr_graph = read_rr_graph_cached(rr_graph_file_dir, cache_dir, max_cache_bytes, pool)
+        edge_offsets = read_edge_offsets(rr_graph_file_dir) if output_format == "xml" else None
+    timer.set_graph_size(rr_graph)
+    print(f"\tParsing {rr_graph_file_dir} is done ({phase.wall_time:.6f} seconds)!")
+    print(f"\t{circuit} FPGA size: {rr_graph.max_x} {rr_graph.max_y} {rr_graph.max_layer}")
+
+    with timer.phase("sample"):
+        edge_keep_masks = get_inter_die_keep_masks(rr_graph, edge_removal_rates, nested, get_circuit_rng(seed, circuit))
+        write_inter_die_tile_counts(output_dir, circuit, rr_graph, edge_keep_masks)
+
+    with SharedRRGraph(rr_graph, edge_offsets) as shared_rr_graph:
+        print(f"\t{circuit} is shared with the workers ({shared_rr_graph.nbytes / 1024**2:.1f} MiB)")
+        num_written_edges = sum(int(np.count_nonzero(edge_keep_mask)) for edge_keep_mask in edge_keep_masks.values())
+        with timer.phase("write", num_edges=num_written_edges):
+            pool.map(write_shared_rr_graph_variant,
+                     [[shared_rr_graph.handle, rr_graph_file_dir,
+                       os.path.join(output_dir, get_rr_graph_name(circuit, edge_removal_rate, output_format)),
+                       edge_keep_mask, output_format, capnp_schema, timing_dir]
+                      for edge_removal_rate, edge_keep_mask in edge_keep_masks.items()],
+                     chunksize=1)
+
+    print(f"Writing rr_graphs of {circuit} is complete!")
+    timer.write(timing_dir)
+
+def get_remaining_rr_graph(output_dir, circuits, removal_rates, output_format="xml"):
+    """Return {circuit: [removal rates whose rr_graph is not in output_dir yet]}."""
+    remaning_circuits_removal_rate = {}
     for circuit in circuits:
         for removal_rate in removal_rates:
-            rr_graph_name = f"rr_graph_{circuit}_{int(removal_rate*100)}.xml"
+            rr_graph_name = get_rr_graph_name(circuit, removal_rate, output_format)
             rr_graph_path = os.path.join(output_dir, rr_graph_name)
             if not os.path.exists(rr_graph_path):
-                remaning_circuits_removal_rate.append([circuit, removal_rate])
+                remaning_circuits_removal_rate.setdefault(circuit, []).append(removal_rate)
             else:
                 print(f"{rr_graph_name} already exists!")
     return remaning_circuits_removal_rate
@@ -126,9 +227,51 @@ def getArgs():
     parser.add_argument("--vtr_run_dir", required=True, help="VTR task run directory")
     parser.add_argument("--output_dir", required=True, help="Output direcotry to dump new RR Graph files")
     parser.add_argument("-j", required=True, help="Number of available threads")
+    parser.add_argument("--engine", choices=["etree", "stream"], default="etree",
+                        help="etree: load the whole rr_graph with ElementTree, "
+                             "stream: read nodes/edges into arrays with iterparse and splice the kept edges out of the input file")
+    parser.add_argument("--removal_rates", nargs="+", type=float,
+                        default=[0.05, 0.10, 0.30, 0.50, 0.65, 0.80, 0.90, 0.95, 0.98],
+                        help="Inter-die edge removal rates; all rates of a circuit are produced from one parse")
+    parser.add_argument("--nested", action="store_true",
+                        help="Draw nested samples, so that each rate removes a superset of the edges of lower rates")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the edge sampling; the same seed reproduces the same rr_graphs (default: random)")
+    parser.add_argument("--output_format", choices=["xml", "bin"], default="xml",
+                        help="xml: rr_graph_<circuit>_<rate>.xml, bin: VPR's binary rr_graph_<circuit>_<rate>.bin "
+                             "(stream engine only, requires pycapnp and --capnp_schema)")
+    parser.add_argument("--capnp_schema", default=None,
+                        help="rr_graph_uxsdcxx.capnp of the VTR tree (libs/librrgraph/src/io) used for --output_format bin")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Cache the parsed node/edge arrays of the input rr_graphs here and reuse them while the file is unchanged")
+    parser.add_argument("--cache_max_gb", type=float, default=50,
+                        help="Size bound of --cache_dir; least recently used entries are evicted beyond it")
+    parser.add_argument("--shared_memory", action="store_true",
+                        help="Parse one circuit at a time in the main process (the workers read its edges), share it with them "
+                             "and write its removal rates in parallel (stream engine only)")
+    parser.add_argument("--timing_dir", default=None,
+                        help="Write per-phase wall/CPU time, peak RSS and graph size of every job here "
+                             "(<job>.json, gathered into timing.csv)")
+    parser.add_argument("--mem_budget", type=float, default=None,
+                        help="Memory budget in GB: start the largest circuits first and only while the estimated "
+                             "peak RSS of the running jobs fits, with at most -j jobs at once")
 
 
     args = parser.parse_args()
+    if args.shared_memory and args.engine != "stream":
+        parser.error("--shared_memory requires --engine stream")
+    if args.shared_memory and args.mem_budget is not None:
+        parser.error("--shared_memory and --mem_budget cannot be combined")
+    if args.output_format == "bin":
+        if args.engine != "stream":
+            parser.error("--output_format bin requires --engine stream")
+        if args.capnp_schema is None:
+            parser.error("--output_format bin requires --capnp_schema")
+        # Checked here, as the workers only import it while writing
+        try:
+            import capnp  # noqa: F401
+        except ImportError:
+            parser.error("--output_format bin requires 'pycapnp'. Install it with: pip install pycapnp")
     return args
 
 def main():
@@ -138,21 +281,43 @@ def main():
     circuits = [circuit.split(".")[0] for circuit in circuit_dirs]
 
     number_of_threads = int(args.j)
-    removal_rates = [0.05, 0.10, 0.30, 0.50, 0.65, 0.80, 0.90, 0.95, 0.98]
-    remaining_circuits_removal_rate = get_remaining_rr_graph(args.output_dir, circuits, removal_rates)
+    max_cache_bytes = int(args.cache_max_gb * 1024**3)
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % (2**32))
+    print(f"Edge sampling seed: {seed}")
+    remaining_circuits_removal_rate = get_remaining_rr_graph(args.output_dir, circuits, args.removal_rates, args.output_format)
     print(f"Remaining circuits and removal rates: {remaining_circuits_removal_rate}")
 
     thread_args = []
-    for circuit, removal_rate in remaining_circuits_removal_rate:
-        print(f"{circuit} {removal_rate}")
+    for circuit, removal_rates in remaining_circuits_removal_rate.items():
+        print(f"{circuit} {removal_rates}")
         rr_graph_dir = os.path.join(rr_graph_resource_dir, f"{circuit}.blif", "common", "rr_graph.xml")
         assert os.path.isfile(rr_graph_dir), rr_graph_dir
-        thread_args.append([rr_graph_dir, removal_rate, circuit, args.output_dir])
+        thread_args.append([rr_graph_dir, removal_rates, circuit, args.output_dir, args.nested, seed,
+                            args.output_format, args.capnp_schema, args.cache_dir, max_cache_bytes, args.timing_dir])
+
 
+    timing_jobs = [get_job_name(circuit) for circuit in remaining_circuits_removal_rate]
+    if args.shared_memory:
+        timing_jobs += [get_write_job_name(get_rr_graph_name(circuit, removal_rate, args.output_format))
+                        for circuit, removal_rates in remaining_circuits_removal_rate.items()
+                        for removal_rate in removal_rates]
+    if args.timing_dir is not None:
+        clear_timing_records(args.timing_dir, timing_jobs)
 
-    pool = Pool(number_of_threads)
-    pool.map(remove_inter_die_edge, thread_args)
-    pool.close()
+    engine = remove_inter_die_edge_streaming if args.engine == "stream" else remove_inter_die_edge
+    if args.mem_budget is not None:
+        run_with_memory_budget(engine, thread_args, [os.path.getsize(thread_arg[0]) for thread_arg in thread_args],
+                               number_of_threads, int(args.mem_budget * 1024**3), RSS_PER_INPUT_BYTE[args.engine])
+    else:
+        pool = Pool(number_of_threads)
+        if args.shared_memory:
+            for thread_arg in thread_args:
+                remove_inter_die_edge_shared(pool, thread_arg)
+        else:
+            pool.map(engine, thread_args)
+        pool.close()
+    if args.timing_dir is not None:
+        write_timing_csv(args.timing_dir, timing_jobs)
 
     print(f"Done with writing all RR Graphs!")
 
@@ -0,0 +1,101 @@
+"""Run Pool jobs under a memory budget instead of a fixed number of workers.
+
+The peak RSS of a job is estimated from the size of its input file as
+base RSS + input size * RSS per input byte. Jobs are started largest first,
+and a job is only started while the estimates of the running jobs plus its own
+fit in the budget. Every job runs in a fresh worker process, so its measured
+peak RSS is its own. The given RSS per input byte is only used until the first
+job finishes; from then on it is the largest value measured so far plus a
+margin, so later estimates follow what the jobs actually use, up or down.
+"""
+
+from __future__ import annotations
+
+import queue
+import resource
+from multiprocessing import Pool
+from typing import Callable, List, Sequence
+
+
+# Headroom over the largest measured RSS per input byte
+RSS_MARGIN = 0.1
+
+def get_peak_rss_bytes() -> int:
+    """Peak RSS of this process (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _run_measured(func, thread_arg):
+    result = func(thread_arg)
+    return result, get_peak_rss_bytes()
+
+
+class MemoryModel:
+    """Peak RSS estimate of a job as a function of its input size, refined by measurements."""
+
+    def __init__(self, rss_per_input_byte: float, base_rss_bytes: int) -> None:
+        self.rss_per_input_byte = rss_per_input_byte
+        self.base_rss_bytes = base_rss_bytes
+        self.max_measured: float | None = None
+
+    def estimate(self, input_bytes: int) -> int:
+        return int(self.base_rss_bytes + input_bytes * self.rss_per_input_byte)
+
+    def update(self, input_bytes: int, peak_rss_bytes: int) -> None:
+        if input_bytes > 0:
+            measured = max(peak_rss_bytes - self.base_rss_bytes, 0) / input_bytes
+            self.max_measured = measured if self.max_measured is None else max(self.max_measured, measured)
+            self.rss_per_input_byte = self.max_measured * (1 + RSS_MARGIN)
+
+
+def run_with_memory_budget(func: Callable, thread_args: Sequence, input_bytes: Sequence[int],
+                           num_workers: int, mem_budget_bytes: int, rss_per_input_byte: float) -> List:
+    """pool.map(func, thread_args) that keeps the estimated RSS of the running jobs within mem_budget_bytes.
+
+    input_bytes[i] is the input size of thread_args[i]. At most num_workers jobs
+    run at once. A job whose estimate alone exceeds the budget is run by itself.
+    Results are returned in the order of thread_args.
+    """
+    model = MemoryModel(rss_per_input_byte, get_peak_rss_bytes())
+    pending = sorted(range(len(thread_args)), key=lambda job: input_bytes[job], reverse=True)
+    results = [None] * len(thread_args)
+    running = {}
+    done = queue.Queue()
+
+    pool = Pool(num_workers, maxtasksperchild=1)
+    try:
+        while pending or running:
+            reserved = sum(running.values())
+            admitted = []
+            for job in pending:
+                if len(running) + len(admitted) >= num_workers:
+                    break
+                estimate = model.estimate(input_bytes[job])
+                if reserved + estimate <= mem_budget_bytes or (not running and not admitted):
+                    if estimate > mem_budget_bytes:
+                        print(f"Warning: job {job} is estimated at {estimate / 1024**3:.2f} GiB, "
+                              f"more than the {mem_budget_bytes / 1024**3:.2f} GiB budget; running it alone")
+                    admitted.append(job)
+                    reserved += estimate
+            for job in admitted:
+                pending.remove(job)
+                running[job] = model.estimate(input_bytes[job])
+                print(f"Starting job {job} (estimated {running[job] / 1024**3:.2f} GiB, "
+                      f"{sum(running.values()) / 1024**3:.2f} of {mem_budget_bytes / 1024**3:.2f} GiB reserved)")
+                pool.apply_async(_run_measured, (func, thread_args[job]),
+                                 callback=lambda result, job=job: done.put((job, result, None)),
+                                 error_callback=lambda error, job=job: done.put((job, None, error)))
+
+            job, result, error = done.get()
+            del running[job]
+            if error is not None:
+                raise error
+            results[job], peak_rss_bytes = result
+            model.update(input_bytes[job], peak_rss_bytes)
+            print(f"Job {job} is done (peak RSS {peak_rss_bytes / 1024**3:.2f} GiB, "
+                  f"now estimating {model.rss_per_input_byte:.2f} bytes of RSS per input byte)")
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
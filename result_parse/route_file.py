@@ -0,0 +1,100 @@
+"""Streaming reader of VPR .route files.
+
+The nets of a .route file are read one at a time, line by line, and every net
+is returned with its routing nodes as NumPy columns (node type, layer, x, y) in
+the order VPR prints its route tree. Inter-die crossings are counted on those
+columns: a crossing is a pair of consecutive nodes of a branch on different
+layers, where a branch ends at a SINK and the next node restarts from a node
+already in the tree.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator
+
+import numpy as np
+
+from rr_graph_table import NODE_TYPE_CODE, node_type_code
+
+
+SINK = NODE_TYPE_CODE["SINK"]
+# Node:	<id>	<type> (<layer>,<x>,<y>) ...; wires continue with "to (<layer>,<x>,<y>)"
+NODE_LINE_PATTERN = re.compile(r"Node:\s+(\d+)\s+(\w+)\s+\((\d+),(\d+),(\d+)")
+NET_LINE_PATTERN = re.compile(r"Net\s+(\d+)\s+\((.*)\)")
+
+
+@dataclass(frozen=True)
+class RouteNet:
+    net_id: int
+    name: str
+    node_id: np.ndarray
+    type: np.ndarray
+    layer: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_id)
+
+    def inter_die_crossings(self) -> np.ndarray:
+        """Boolean mask of the nodes reached from the previous node of their branch on another layer."""
+        crossings = np.zeros(self.num_nodes, dtype=bool)
+        crossings[1:] = (self.type[:-1] != SINK) & (self.type[1:] != SINK) & (self.layer[1:] != self.layer[:-1])
+        return crossings
+
+
+class _NetBuilder:
+    def __init__(self, net_id: int, name: str) -> None:
+        self.net_id = net_id
+        self.name = name
+        self.columns = [[] for _ in range(5)]
+
+    def add(self, node_match: re.Match) -> None:
+        node_id, node_type, layer, x, y = node_match.groups()
+        for column, value in zip(self.columns, (int(node_id), node_type_code(node_type),
+                                                int(layer), int(x), int(y))):
+            column.append(value)
+
+    def build(self) -> RouteNet:
+        dtypes = (np.int32, np.int8, np.int8, np.int16, np.int16)
+        return RouteNet(self.net_id, self.name,
+                        *(np.array(column, dtype=dtype) for column, dtype in zip(self.columns, dtypes)))
+
+
+def iter_route_lines(lines) -> Iterator[RouteNet]:
+    """RouteNets of the lines of a .route file, in file order; global nets have no nodes."""
+    net = None
+    for line in lines:
+        if line.startswith("Node"):
+            node_match = NODE_LINE_PATTERN.match(line)
+            if node_match is None:
+                raise ValueError(f"Unexpected node line: {line.rstrip()}")
+            net.add(node_match)
+        elif line.startswith("Net"):
+            if net is not None:
+                yield net.build()
+            net_match = NET_LINE_PATTERN.match(line)
+            net = _NetBuilder(int(net_match.group(1)), net_match.group(2)) if net_match else _NetBuilder(-1, "")
+    if net is not None:
+        yield net.build()
+
+
+def iter_route_nets(route_file_dir: str) -> Iterator[RouteNet]:
+    """Stream the nets of a .route file; only one net is held in memory at a time."""
+    with open(route_file_dir, "r") as f:
+        yield from iter_route_lines(f)
+
+
+def crossing_layer_pairs(net: RouteNet) -> np.ndarray:
+    """(from layer, to layer) rows of the crossings of net."""
+    crossings = np.flatnonzero(net.inter_die_crossings())
+    return np.stack((net.layer[crossings - 1], net.layer[crossings]), axis=1)
+
+
+def count_layer_pairs(layer_pairs: np.ndarray) -> Dict[tuple[int, int], int]:
+    """{(from layer, to layer): count} of crossing_layer_pairs rows."""
+    pairs, counts = np.unique(layer_pairs.reshape(-1, 2), axis=0, return_counts=True)
+    return {(int(from_layer), int(to_layer)): int(count) for (from_layer, to_layer), count in zip(pairs, counts)}
@@ -0,0 +1,202 @@
+"""Random access to the nets of a .route file through a sidecar index.
+
+The index of <file>.route is written once to <file>.route.index.npz. It holds
+the byte offset of every "Net" header, the net ids and names, and the layer
+pairs each net crosses. The size and mtime of the .route file are recorded too,
+so the index is rebuilt when the file changes. An IndexedRouteFile then parses
+only the bytes of the nets asked for, out of a memory map of the file.
+
+Run as a script to print the nodes of some nets, or the nets crossing a layer
+pair.
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator
+
+import numpy as np
+
+from route_file import RouteNet, crossing_layer_pairs, iter_route_lines
+from rr_graph_table import NODE_TYPES
+
+
+# Bump when the index layout changes, so old sidecar files are rebuilt
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.npz"
+NET_HEADER_PATTERN = re.compile(rb"^Net\s+(\d+)\s+\((.*)\)", re.M)
+
+
+@dataclass(frozen=True)
+class RouteIndex:
+    """Net i spans bytes offsets[i]:offsets[i + 1] of the .route file.
+
+    The names are UTF-8 and concatenated, name i being name_bytes[name_offsets[i]:name_offsets[i + 1]];
+    the (from layer, to layer) pairs net i crosses are rows pair_offsets[i]:pair_offsets[i + 1] of layer_pairs.
+    """
+
+    file_size: int
+    file_mtime_ns: int
+    net_ids: np.ndarray
+    offsets: np.ndarray
+    name_bytes: np.ndarray
+    name_offsets: np.ndarray
+    layer_pairs: np.ndarray
+    pair_offsets: np.ndarray
+
+    @property
+    def num_nets(self) -> int:
+        return len(self.net_ids)
+
+    def name_of(self, net_index: int) -> str:
+        return self.name_bytes[self.name_offsets[net_index]:self.name_offsets[net_index + 1]].tobytes().decode()
+
+    def layer_pairs_of(self, net_index: int) -> np.ndarray:
+        return self.layer_pairs[self.pair_offsets[net_index]:self.pair_offsets[net_index + 1]]
+
+
+def get_index_file_dir(route_file_dir: str) -> str:
+    return route_file_dir + INDEX_SUFFIX
+
+
+def build_route_index(route_file_dir: str) -> RouteIndex:
+    """Scan the file once for the net headers and parse every net for its crossed layer pairs."""
+    stat = os.stat(route_file_dir)
+    net_ids = []
+    offsets = []
+    names = []
+    layer_pairs = []
+    pair_offsets = [0]
+    with open(route_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for header in NET_HEADER_PATTERN.finditer(mm):
+            net_ids.append(int(header.group(1)))
+            offsets.append(header.start())
+            names.append(header.group(2))
+        offsets.append(len(mm))
+
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            net, = iter_route_lines(mm[start:end].decode().splitlines(keepends=True))
+            net_layer_pairs = np.unique(crossing_layer_pairs(net), axis=0)
+            layer_pairs.append(net_layer_pairs)
+            pair_offsets.append(pair_offsets[-1] + len(net_layer_pairs))
+
+    name_lengths = np.array([len(name) for name in names], dtype=np.int64)
+    return RouteIndex(
+        file_size=stat.st_size, file_mtime_ns=stat.st_mtime_ns,
+        net_ids=np.array(net_ids, dtype=np.int64), offsets=np.array(offsets, dtype=np.int64),
+        name_bytes=np.frombuffer(b"".join(names), dtype=np.uint8),
+        name_offsets=np.concatenate(([0], np.cumsum(name_lengths))),
+        layer_pairs=np.concatenate(layer_pairs) if layer_pairs else np.zeros((0, 2), dtype=np.int8),
+        pair_offsets=np.array(pair_offsets, dtype=np.int64))
+
+
+def save_route_index(route_index: RouteIndex, index_file_dir: str) -> None:
+    tmp_index_file_dir = index_file_dir + ".tmp.npz"
+    np.savez(tmp_index_file_dir, version=INDEX_VERSION,
+             **{name: getattr(route_index, name) for name in RouteIndex.__dataclass_fields__})
+    os.replace(tmp_index_file_dir, index_file_dir)
+
+
+def load_route_index(route_file_dir: str) -> RouteIndex:
+    """Index of the file from its sidecar, built (and saved) first when missing or stale."""
+    index_file_dir = get_index_file_dir(route_file_dir)
+    stat = os.stat(route_file_dir)
+    try:
+        with np.load(index_file_dir) as index_file:
+            if int(index_file["version"]) == INDEX_VERSION and int(index_file["file_size"]) == stat.st_size \
+                    and int(index_file["file_mtime_ns"]) == stat.st_mtime_ns:
+                return RouteIndex(**{name: index_file[name] for name in RouteIndex.__dataclass_fields__})
+    except (OSError, KeyError, ValueError):
+        pass
+
+    print(f"Indexing {route_file_dir}...")
+    route_index = build_route_index(route_file_dir)
+    save_route_index(route_index, index_file_dir)
+    return route_index
+
+
+class IndexedRouteFile:
+    """Memory-mapped .route file whose nets are looked up by id or name through its index."""
+
+    def __init__(self, route_file_dir: str) -> None:
+        self.route_file_dir = route_file_dir
+        self.index = load_route_index(route_file_dir)
+        self._file = open(route_file_dir, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index_of_id = {int(net_id): net_index for net_index, net_id in enumerate(self.index.net_ids)}
+        self._index_of_name: Dict[str, int] | None = None
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> IndexedRouteFile:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def net_index(self, net: int | str) -> int:
+        """Position in the file of the net with this id (an int) or name (a str)."""
+        if isinstance(net, str):
+            if self._index_of_name is None:
+                self._index_of_name = {self.index.name_of(net_index): net_index
+                                       for net_index in range(self.index.num_nets)}
+            return self._index_of_name[net]
+        return self._index_of_id[net]
+
+    def read_net(self, net_index: int) -> RouteNet:
+        start = int(self.index.offsets[net_index])
+        end = int(self.index.offsets[net_index + 1])
+        net, = iter_route_lines(self._mm[start:end].decode().splitlines(keepends=True))
+        return net
+
+    def net(self, net: int | str) -> RouteNet:
+        """Nodes of one net, given by id or name; raises KeyError for an unknown net."""
+        return self.read_net(self.net_index(net))
+
+    def nets_crossing(self, layer_a: int, layer_b: int) -> Iterator[RouteNet]:
+        """Nets with a crossing between layer_a and layer_b, in either direction, in file order."""
+        pairs = self.index.layer_pairs
+        is_match = ((pairs[:, 0] == layer_a) & (pairs[:, 1] == layer_b)) | \
+                   ((pairs[:, 0] == layer_b) & (pairs[:, 1] == layer_a))
+        net_indices = np.unique(np.searchsorted(self.index.pair_offsets, np.flatnonzero(is_match), side="right") - 1)
+        for net_index in net_indices:
+            yield self.read_net(int(net_index))
+
+
+def print_net(net: RouteNet) -> None:
+    print(f"Net {net.net_id} ({net.name}): {net.num_nodes} nodes, "
+          f"{int(np.count_nonzero(net.inter_die_crossings()))} inter-die crossings")
+    for node_id, node_type, layer, x, y, is_crossing in zip(net.node_id, net.type, net.layer, net.x, net.y,
+                                                            net.inter_die_crossings()):
+        print(f"\t{node_id}\t{NODE_TYPES[node_type]:>6} ({layer},{x},{y}){' crossing' if is_crossing else ''}")
+
+
+def getArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--route_file", required=True, help="VPR .route file; its index is built on first use")
+    parser.add_argument("--nets", nargs="+", default=[], help="Ids or names of the nets to print")
+    parser.add_argument("--layer_pair", nargs=2, type=int, default=None,
+                        help="Print the nets crossing between these two layers")
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    with IndexedRouteFile(args.route_file) as route_file:
+        print(f"{args.route_file}: {route_file.index.num_nets} nets")
+        for net in args.nets:
+            print_net(route_file.net(int(net) if net.isdigit() else net))
+        if args.layer_pair is not None:
+            for net in route_file.nets_crossing(*args.layer_pair):
+                print_net(net)
+
+
+if __name__ == "__main__":
+    main()
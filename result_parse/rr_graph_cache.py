@@ -0,0 +1,150 @@
+"""On-disk cache of parsed rr_graphs.
+
+The RRGraph columns of an rr_graph file are saved as .npy files in a directory
+named after a digest of the file contents, so a later run (or another script)
+memory-maps them instead of parsing the XML again. The digest of a file is
+remembered together with its size and mtime, so an unchanged file is not read
+to be hashed twice; a file that changes gets a new digest and is parsed again.
+Entries are evicted least recently used first once the cache grows past its
+size bound.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from dataclasses import fields
+
+import numpy as np
+
+from rr_graph_table import RREdgeTable, RRGraph, RRNodeTable, read_rr_graph
+
+
+# Bump when RRGraph or the way it is read changes, so stale entries are not reused
+CACHE_VERSION = 2
+DEFAULT_MAX_CACHE_BYTES = 50 * 1024**3
+HASH_CHUNK_SIZE = 64 * 1024 * 1024
+STAT_DIR_NAME = "stat"
+GRAPH_FILE_NAME = "graph.json"
+
+
+def file_digest(file_dir: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"rr_graph_cache v{CACHE_VERSION}".encode())
+    with open(file_dir, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for chunk_start in range(0, len(mm), HASH_CHUNK_SIZE):
+                    digest.update(mm[chunk_start:chunk_start + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def _write_atomically(file_dir: str, text: str) -> None:
+    fd, tmp_file_dir = tempfile.mkstemp(dir=os.path.dirname(file_dir))
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp_file_dir, file_dir)
+
+
+def get_cache_key(rr_graph_file_dir: str, cache_dir: str) -> str:
+    """Digest of the file, rehashed only when its size or mtime differ from the recorded ones."""
+    rr_graph_file_dir = os.path.abspath(rr_graph_file_dir)
+    stat = os.stat(rr_graph_file_dir)
+    path_key = hashlib.blake2b(rr_graph_file_dir.encode(), digest_size=20).hexdigest()
+    stat_file_dir = os.path.join(cache_dir, STAT_DIR_NAME, f"{path_key}.json")
+    try:
+        with open(stat_file_dir) as f:
+            record = json.load(f)
+        if record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns \
+                and record["version"] == CACHE_VERSION:
+            return record["digest"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = file_digest(rr_graph_file_dir)
+    os.makedirs(os.path.dirname(stat_file_dir), exist_ok=True)
+    _write_atomically(stat_file_dir, json.dumps({"path": rr_graph_file_dir, "size": stat.st_size,
+                                                 "mtime_ns": stat.st_mtime_ns, "version": CACHE_VERSION,
+                                                 "digest": digest}))
+    return digest
+
+
+def save_rr_graph(rr_graph: RRGraph, entry_dir: str) -> None:
+    """Write the columns of rr_graph as <entry_dir>/{nodes,edges}_<column>.npy plus graph.json."""
+    parent_dir = os.path.dirname(entry_dir)
+    tmp_entry_dir = tempfile.mkdtemp(dir=parent_dir)
+    for prefix, table in (("nodes", rr_graph.nodes), ("edges", rr_graph.edges)):
+        for field in fields(table):
+            np.save(os.path.join(tmp_entry_dir, f"{prefix}_{field.name}.npy"), getattr(table, field.name))
+    with open(os.path.join(tmp_entry_dir, GRAPH_FILE_NAME), "w") as f:
+        json.dump({"max_x": rr_graph.max_x, "max_y": rr_graph.max_y, "max_layer": rr_graph.max_layer}, f)
+    try:
+        os.rename(tmp_entry_dir, entry_dir)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+
+
+def load_rr_graph(entry_dir: str) -> RRGraph:
+    """Memory-map the columns saved by save_rr_graph."""
+    def load_table(table_type, prefix):
+        return table_type(**{field.name: np.load(os.path.join(entry_dir, f"{prefix}_{field.name}.npy"), mmap_mode="r")
+                             for field in fields(table_type)})
+
+    with open(os.path.join(entry_dir, GRAPH_FILE_NAME)) as f:
+        grid = json.load(f)
+    return RRGraph(max_x=grid["max_x"], max_y=grid["max_y"], max_layer=grid["max_layer"],
+                   nodes=load_table(RRNodeTable, "nodes"), edges=load_table(RREdgeTable, "edges"))
+
+
+def _entry_size(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def evict_cache_entries(cache_dir: str, max_cache_bytes: int, keep_entry_dir: str | None = None) -> None:
+    """Remove the least recently used entries until the cache holds at most max_cache_bytes."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        graph_file_dir = os.path.join(entry.path, GRAPH_FILE_NAME)
+        if entry.is_dir() and entry.name != STAT_DIR_NAME and os.path.isfile(graph_file_dir):
+            entries.append((os.stat(graph_file_dir).st_mtime, entry.path, _entry_size(entry.path)))
+    total_size = sum(size for _, _, size in entries)
+    for _, entry_dir, size in sorted(entries):
+        if total_size <= max_cache_bytes:
+            break
+        if entry_dir == keep_entry_dir:
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+
+def read_rr_graph_cached(rr_graph_file_dir: str, cache_dir: str | None,
+                         max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES, pool=None) -> RRGraph:
+    """read_rr_graph through the cache in cache_dir; without a cache_dir the file is just parsed.
+
+    Cached columns are read-only memory maps. pool is passed on to read_rr_graph
+    when the file has to be parsed.
+    """
+    if cache_dir is None:
+        return read_rr_graph(rr_graph_file_dir, pool)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, get_cache_key(rr_graph_file_dir, cache_dir))
+
+    if os.path.isfile(os.path.join(entry_dir, GRAPH_FILE_NAME)):
+        try:
+            rr_graph = load_rr_graph(entry_dir)
+            # The mtime of graph.json is the last use of the entry
+            os.utime(os.path.join(entry_dir, GRAPH_FILE_NAME))
+            return rr_graph
+        except (OSError, ValueError, KeyError):
+            # Evicted by another process while loading, or a broken entry: parse again
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+    rr_graph = read_rr_graph(rr_graph_file_dir, pool)
+    save_rr_graph(rr_graph, entry_dir)
+    evict_cache_entries(cache_dir, max_cache_bytes, keep_entry_dir=entry_dir)
+    return rr_graph
@@ -0,0 +1,338 @@
+"""Write edited rr_graphs in VPR's binary (Cap'n Proto) rr_graph format.
+
+VPR reads an rr_graph whose file name ends in .bin with the schema in
+libs/librrgraph/src/io/rr_graph_uxsdcxx.capnp of the VTR tree. That schema is
+generated from the XML one, so XML elements and attributes are mapped onto it
+by name: an element or attribute "a_b_c" is the field "aBC", repeated children
+"x" fill the list field "xs" (or "xes"), element text goes to "value", and enum
+values such as INC_DIR become incDir.
+
+Everything outside <rr_edges> is converted from the source file; the edges are
+written from the RREdgeTable columns and a keep mask, like the XML writer in
+rr_graph_mmap. Edges with <metadata> are parsed separately, only when the
+<rr_edges> section has any.
+
+Run as a script to convert an rr_graph to .bin and check the result against
+the XML it came from; tests/test_rr_graph_capnp.py checks the round trip on a
+small synthetic rr_graph.
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from rr_graph_mmap import EDGE_PATTERN, find_rr_edges_section, iter_events_outside_rr_edges
+from rr_graph_table import RRGraph, read_rr_graph
+
+try:
+    import capnp
+except ImportError as e:
+    raise ImportError("Binary rr_graph output requires 'pycapnp'. Install it with: pip install pycapnp") from e
+
+
+# Attributes whose schema field name does not follow the naming rule
+RENAMED_FIELDS = {"switch": "switchId"}
+INT_TYPES = {"int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64"}
+FLOAT_TYPES = {"float32", "float64"}
+SKIPPED_SECTIONS = ("rr_nodes", "rr_edges")
+
+
+def load_rr_graph_schema(schema_file_dir: str):
+    """Load rr_graph_uxsdcxx.capnp; its /capnp/c++.capnp import is resolved from pycapnp."""
+    return capnp.load(schema_file_dir, imports=[os.path.dirname(os.path.dirname(capnp.__file__))])
+
+
+def capnp_name(xml_name: str) -> str:
+    first, *rest = xml_name.split("_")
+    return first.lower() + "".join(part.capitalize() for part in rest)
+
+
+def _field_type(struct, field_name: str) -> str:
+    return struct.schema.fields[field_name].proto.slot.type.which()
+
+
+def _attribute_field(struct, elem: ET.Element, name: str) -> str:
+    field_name = RENAMED_FIELDS.get(name, capnp_name(name))
+    if field_name not in struct.schema.fields:
+        raise ValueError(f"<{elem.tag}> attribute '{name}' has no field in the rr_graph schema")
+    return field_name
+
+
+def _child_field(struct, elem: ET.Element, tag: str) -> str:
+    field_name = capnp_name(tag)
+    for candidate in (field_name, field_name + "s", field_name + "es"):
+        if candidate in struct.schema.fields:
+            return candidate
+    raise ValueError(f"<{elem.tag}> child <{tag}> has no field in the rr_graph schema")
+
+
+def _field_value(field_type: str, text: str):
+    if field_type in INT_TYPES:
+        return int(text)
+    if field_type in FLOAT_TYPES:
+        return float(text)
+    if field_type == "bool":
+        return text in ("true", "1")
+    if field_type == "enum":
+        return capnp_name(text)
+    return text
+
+
+def _children_by_tag(elem: ET.Element) -> Dict[str, list]:
+    children = {}
+    for child in elem:
+        children.setdefault(child.tag, []).append(child)
+    return children
+
+
+def fill_struct(struct, elem: ET.Element) -> None:
+    """Copy the attributes, text and children of elem into the struct builder."""
+    for name, text in elem.attrib.items():
+        field_name = _attribute_field(struct, elem, name)
+        setattr(struct, field_name, _field_value(_field_type(struct, field_name), text))
+    if elem.text and elem.text.strip():
+        struct.value = _field_value(_field_type(struct, "value"), elem.text.strip())
+    for tag, children in _children_by_tag(elem).items():
+        field_name = _child_field(struct, elem, tag)
+        if _field_type(struct, field_name) == "list":
+            for child_struct, child in zip(struct.init(field_name, len(children)), children):
+                fill_struct(child_struct, child)
+        else:
+            fill_struct(struct.init(field_name), children[-1])
+
+
+def _same_value(field_type: str, value, text: str) -> bool:
+    if field_type in FLOAT_TYPES:
+        return value == float(np.float32(text)) or value == float(text)
+    if field_type == "enum":
+        return str(value) == capnp_name(text)
+    return value == _field_value(field_type, text)
+
+
+def check_struct(struct, elem: ET.Element) -> None:
+    """Raise ValueError if the struct reader does not hold what fill_struct copies from elem."""
+    for name, text in elem.attrib.items():
+        field_name = _attribute_field(struct, elem, name)
+        value = getattr(struct, field_name)
+        if not _same_value(_field_type(struct, field_name), value, text):
+            raise ValueError(f"<{elem.tag}> {name}: {text} in XML, {value} in the binary rr_graph")
+    for tag, children in _children_by_tag(elem).items():
+        field_name = _child_field(struct, elem, tag)
+        if _field_type(struct, field_name) == "list":
+            child_structs = getattr(struct, field_name)
+            if len(child_structs) != len(children):
+                raise ValueError(f"<{elem.tag}> has {len(children)} <{tag}>, "
+                                 f"the binary rr_graph has {len(child_structs)}")
+            for child_struct, child in zip(child_structs, children):
+                check_struct(child_struct, child)
+        else:
+            check_struct(getattr(struct, field_name), children[-1])
+
+
+def _walk_rr_graph(rr_graph_file_dir: str, on_root, on_section, on_node) -> int:
+    """Call on_root(<rr_graph>), on_section(top-level element) and on_node(index, <node>)
+    while streaming the file; returns the number of nodes."""
+    depth = 0
+    section = None
+    num_nodes = 0
+    for event, elem in iter_events_outside_rr_edges(rr_graph_file_dir):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = elem
+                on_root(elem)
+            elif depth == 2:
+                section = elem
+            continue
+        depth -= 1
+        if depth == 2 and section.tag == "rr_nodes":
+            on_node(num_nodes, elem)
+            num_nodes += 1
+            section.clear()
+        elif depth == 1:
+            if elem.tag not in SKIPPED_SECTIONS:
+                on_section(elem)
+            root.clear()
+    return num_nodes
+
+
+def build_message_without_edges(rr_graph_schema, rr_graph_file_dir: str, num_nodes: int):
+    """Convert everything but the edges of an rr_graph file into an RrGraph message builder."""
+    message = rr_graph_schema.RrGraph.new_message()
+    nodes = message.init("rrNodes").init("nodes", num_nodes)
+
+    def on_root(root_tag):
+        for name, text in root_tag.attrib.items():
+            setattr(message, _attribute_field(message, root_tag, name), text)
+
+    def on_section(section_tag):
+        fill_struct(message.init(capnp_name(section_tag.tag)), section_tag)
+
+    def on_node(node_idx, node_tag):
+        fill_struct(nodes[node_idx], node_tag)
+
+    num_read_nodes = _walk_rr_graph(rr_graph_file_dir, on_root, on_section, on_node)
+    if num_read_nodes != num_nodes:
+        raise ValueError(f"{rr_graph_file_dir} has {num_read_nodes} nodes, expected {num_nodes}")
+    return message
+
+
+def read_edge_metadata(rr_graph_file_dir: str) -> Dict[int, ET.Element]:
+    """{edge index: <metadata>} of the edges that have one, in file order.
+
+    The edges are only matched one by one when <rr_edges> contains <metadata>;
+    otherwise this is a single search of the section.
+    """
+    edge_metadata = {}
+    with open(rr_graph_file_dir, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        section_start, section_end = find_rr_edges_section(mm)
+        if mm.find(b"<metadata", section_start, section_end) < 0:
+            return edge_metadata
+        for edge_idx, match in enumerate(EDGE_PATTERN.finditer(mm, section_start, section_end)):
+            if mm.find(b"<metadata", match.start(), match.end()) >= 0:
+                edge_metadata[edge_idx] = ET.fromstring(match.group()).find("metadata")
+    return edge_metadata
+
+
+@dataclass(frozen=True)
+class BinaryBase:
+    """What every binary variant of one source rr_graph shares."""
+    message: object
+    edge_metadata: Dict[int, ET.Element]
+
+
+def build_binary_base(rr_graph_file_dir: str, rr_graph: RRGraph, schema_file_dir: str) -> BinaryBase:
+    rr_graph_schema = load_rr_graph_schema(schema_file_dir)
+    return BinaryBase(build_message_without_edges(rr_graph_schema, rr_graph_file_dir, rr_graph.nodes.num_nodes),
+                      read_edge_metadata(rr_graph_file_dir))
+
+
+def _fill_edges(message, rr_graph: RRGraph, edge_keep_mask: np.ndarray,
+                edge_metadata: Dict[int, ET.Element]) -> None:
+    kept_edges = np.flatnonzero(edge_keep_mask)
+    edges = message.init("rrEdges").init("edges", len(kept_edges))
+    for edge, src, sink, switch in zip(edges,
+                                       rr_graph.edges.src[kept_edges].tolist(),
+                                       rr_graph.edges.sink[kept_edges].tolist(),
+                                       rr_graph.edges.switch[kept_edges].tolist()):
+        edge.srcNode = src
+        edge.sinkNode = sink
+        edge.switchId = switch
+    for edge_idx, metadata in edge_metadata.items():
+        if edge_keep_mask[edge_idx]:
+            fill_struct(edges[int(np.searchsorted(kept_edges, edge_idx))].init("metadata"), metadata)
+
+
+def write_rr_graph_binary_variants(rr_graph_file_dir: str, rr_graph: RRGraph,
+                                   output_edge_keep_masks: Dict[str, np.ndarray],
+                                   schema_file_dir: str, base: BinaryBase | None = None) -> BinaryBase:
+    """Binary counterpart of rr_graph_mmap.write_rr_graph_variants.
+
+    The non-edge sections and the edge metadata are read once; every output
+    file gets a copy of them plus the edges set in its mask. base can be passed
+    in when the same source is written several times; the one used is returned.
+    """
+    if base is None:
+        base = build_binary_base(rr_graph_file_dir, rr_graph, schema_file_dir)
+    for output_file_dir, edge_keep_mask in output_edge_keep_masks.items():
+        if len(edge_keep_mask) != rr_graph.edges.num_edges:
+            raise ValueError(f"{output_file_dir}: keep mask has {len(edge_keep_mask)} entries, "
+                             f"{rr_graph_file_dir} has {rr_graph.edges.num_edges} edges")
+        message = base.message.copy()
+        _fill_edges(message, rr_graph, edge_keep_mask, base.edge_metadata)
+        with open(output_file_dir, "wb") as out_file:
+            message.write(out_file)
+
+    return base
+
+
+def read_rr_graph_binary(rr_graph_schema, binary_file_dir: str):
+    with open(binary_file_dir, "rb") as f:
+        return rr_graph_schema.RrGraph.read(f, traversal_limit_in_words=2**63 - 1)
+
+
+def verify_rr_graph_binary(rr_graph_file_dir: str, rr_graph: RRGraph, edge_keep_mask: np.ndarray,
+                           binary_file_dir: str, schema_file_dir: str) -> None:
+    """Check that binary_file_dir holds rr_graph_file_dir with the edges of edge_keep_mask.
+
+    Every element outside <rr_edges> and every edge <metadata> is compared
+    attribute by attribute, and the edges are compared against the kept entries
+    of the edge columns, in order.
+    Raises ValueError on the first difference.
+    """
+    rr_graph_schema = load_rr_graph_schema(schema_file_dir)
+    message = read_rr_graph_binary(rr_graph_schema, binary_file_dir)
+    nodes = message.rrNodes.nodes
+
+    def on_root(root_tag):
+        check_struct(message, ET.Element(root_tag.tag, root_tag.attrib))
+
+    def on_section(section_tag):
+        check_struct(getattr(message, capnp_name(section_tag.tag)), section_tag)
+
+    def on_node(node_idx, node_tag):
+        check_struct(nodes[node_idx], node_tag)
+
+    num_nodes = _walk_rr_graph(rr_graph_file_dir, on_root, on_section, on_node)
+    if num_nodes != len(nodes):
+        raise ValueError(f"{rr_graph_file_dir} has {num_nodes} nodes, the binary rr_graph has {len(nodes)}")
+
+    edges = message.rrEdges.edges
+    kept_edges = np.flatnonzero(edge_keep_mask)
+    if len(edges) != len(kept_edges):
+        raise ValueError(f"expected {len(kept_edges)} edges, the binary rr_graph has {len(edges)}")
+    binary_edges = np.array([(edge.srcNode, edge.sinkNode, edge.switchId) for edge in edges],
+                            dtype=np.int64).reshape(-1, 3)
+    expected_edges = np.stack((rr_graph.edges.src[kept_edges], rr_graph.edges.sink[kept_edges],
+                               rr_graph.edges.switch[kept_edges]), axis=1)
+    mismatches = np.flatnonzero((binary_edges != expected_edges).any(axis=1))
+    if len(mismatches):
+        raise ValueError(f"{len(mismatches)} edges differ, first at kept edge {mismatches[0]}")
+
+    edge_metadata = read_edge_metadata(rr_graph_file_dir)
+    for edge_idx, metadata in edge_metadata.items():
+        if edge_keep_mask[edge_idx]:
+            check_struct(edges[int(np.searchsorted(kept_edges, edge_idx))].metadata, metadata)
+    num_binary_metadata = sum(edge._has("metadata") for edge in edges)
+    num_kept_metadata = sum(bool(edge_keep_mask[edge_idx]) for edge_idx in edge_metadata)
+    if num_binary_metadata != num_kept_metadata:
+        raise ValueError(f"expected {num_kept_metadata} edges with metadata, "
+                         f"the binary rr_graph has {num_binary_metadata}")
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description="Convert an rr_graph to VPR's binary format and verify the round trip")
+    parser.add_argument("--rr_graph", required=True, help="rr_graph XML file")
+    parser.add_argument("--capnp_schema", required=True, help="rr_graph_uxsdcxx.capnp of the VTR tree")
+    parser.add_argument("--output_file", default=None, help="Output .bin file (default: next to the rr_graph)")
+
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = getArgs()
+    output_file_dir = args.output_file or os.path.splitext(args.rr_graph)[0] + ".bin"
+
+    start_time = time.perf_counter()
+    rr_graph = read_rr_graph(args.rr_graph)
+    edge_keep_mask = np.ones(rr_graph.edges.num_edges, dtype=bool)
+    write_rr_graph_binary_variants(args.rr_graph, rr_graph, {output_file_dir: edge_keep_mask}, args.capnp_schema)
+    end_time = time.perf_counter()
+    print(f"Writing {output_file_dir} is done ({end_time - start_time:.6f} seconds)!")
+
+    start_time = time.perf_counter()
+    verify_rr_graph_binary(args.rr_graph, rr_graph, edge_keep_mask, output_file_dir, args.capnp_schema)
+    end_time = time.perf_counter()
+    print(f"{output_file_dir} matches {args.rr_graph} ({end_time - start_time:.6f} seconds)!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Byte-level access to the <rr_edges> section of a memory-mapped rr_graph file.
+
+Edited rr_graphs only differ from their source in <rr_edges>, so variants are
+written by copying the bytes before and after the edges verbatim and splicing in
+the byte ranges of the kept <edge> elements, instead of re-serializing the tree.
+
+The edges themselves are regular enough to be read without an XML parser: the
+section is split into chunks that start at an <edge> tag, and the attributes of
+each chunk are matched with regular expressions, in parallel on a Pool.
+"""
+
+from __future__ import annotations
+
+import mmap
+import re
+import xml.etree.ElementTree as ET
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+
+EDGE_PATTERN = re.compile(rb"<edge\b[^>]*?(?:/>|>.*?</edge>)", re.S)
+EDGE_START_PATTERN = re.compile(rb"<edge\b")
+EDGE_ATTRIBUTE_PATTERNS = {name: re.compile(rb"\s%s=\"(\d+)\"" % name.encode())
+                           for name in ("src_node", "sink_node", "switch")}
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+EDGE_CHUNK_SIZE = 16 * 1024 * 1024
+# Small feeds keep the elements of a feed from piling up before the caller clears them
+FEED_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class EdgeOffsets:
+    """Byte layout of <rr_edges>: edge i spans boundaries[i]:boundaries[i + 1].
+
+    The span of an edge includes the whitespace that follows it, except for the
+    last edge, so copying every span reproduces the section exactly.
+    """
+
+    boundaries: np.ndarray
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.boundaries) - 1
+
+    @property
+    def edges_start(self) -> int:
+        return int(self.boundaries[0])
+
+    @property
+    def edges_end(self) -> int:
+        return int(self.boundaries[-1])
+
+
+def find_rr_edges_section(mm: mmap.mmap) -> tuple[int, int]:
+    """Return the byte range between the <rr_edges> start tag and the </rr_edges> end tag."""
+    open_tag = mm.find(b"<rr_edges")
+    if open_tag == -1:
+        raise ValueError("<rr_edges> section not found")
+    section_start = mm.find(b">", open_tag) + 1
+    section_end = mm.find(b"</rr_edges>", section_start)
+    if section_end == -1:
+        raise ValueError("</rr_edges> not found")
+    return section_start, section_end
+
+
+def index_edge_offsets(mm: mmap.mmap) -> EdgeOffsets:
+    """Record the byte offset of every <edge> element, in file order."""
+    section_start, section_end = find_rr_edges_section(mm)
+    starts = array("q")
+    last_end = section_start
+    for match in EDGE_PATTERN.finditer(mm, section_start, section_end):
+        starts.append(match.start())
+        last_end = match.end()
+    if not starts:
+        return EdgeOffsets(boundaries=np.array([section_start], dtype=np.int64))
+    starts.append(last_end)
+    return EdgeOffsets(boundaries=np.frombuffer(starts, dtype=np.int64))
+
+
+def read_edge_offsets(rr_graph_file_dir: str) -> EdgeOffsets:
+    with open(rr_graph_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return index_edge_offsets(mm)
+
+
+def iter_events_outside_rr_edges(rr_graph_file_dir: str):
+    """iterparse events of the file with the contents of <rr_edges> skipped."""
+    parser = ET.XMLPullParser(events=("start", "end"))
+    with open(rr_graph_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        section_start, section_end = find_rr_edges_section(mm)
+        for start, end in ((0, section_start), (section_end, len(mm))):
+            for chunk_start in range(start, end, FEED_CHUNK_SIZE):
+                parser.feed(mm[chunk_start:min(end, chunk_start + FEED_CHUNK_SIZE)])
+                yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def split_rr_edges_section(mm: mmap.mmap, chunk_size: int = EDGE_CHUNK_SIZE) -> List[tuple[int, int]]:
+    """Cut <rr_edges> into byte ranges of about chunk_size that each start at an <edge> tag."""
+    section_start, section_end = find_rr_edges_section(mm)
+    cuts = [section_start]
+    for position in range(section_start + chunk_size, section_end, chunk_size):
+        match = EDGE_START_PATTERN.search(mm, max(position, cuts[-1] + 1), section_end)
+        if match is None:
+            break
+        cuts.append(match.start())
+    cuts.append(section_end)
+    return [(start, end) for start, end in zip(cuts[:-1], cuts[1:]) if start < end]
+
+
+def parse_edge_chunk(thread_arg) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """src_node, sink_node and switch of the edges in one byte range of a file.
+
+    thread_arg is [rr_graph file, start, end]; the range must start at an <edge>
+    tag (or hold no edges) and end where the next one starts.
+    """
+    rr_graph_file_dir = thread_arg[0]
+    start = thread_arg[1]
+    end = thread_arg[2]
+
+    with open(rr_graph_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunk = mm[start:end]
+    num_edges = len(EDGE_START_PATTERN.findall(chunk))
+    columns = []
+    for name, pattern in EDGE_ATTRIBUTE_PATTERNS.items():
+        values = pattern.findall(chunk)
+        if len(values) != num_edges:
+            raise ValueError(f"{rr_graph_file_dir}: {num_edges} <edge> tags but {len(values)} {name} attributes "
+                             f"in bytes {start}-{end}")
+        columns.append(np.fromiter(map(int, values), dtype=np.int32, count=num_edges))
+    return tuple(columns)
+
+
+def get_edge_chunk_args(rr_graph_file_dir: str) -> List[list]:
+    """parse_edge_chunk arguments covering the <rr_edges> section of the file."""
+    with open(rr_graph_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return [[rr_graph_file_dir, start, end] for start, end in split_rr_edges_section(mm)]
+
+
+def concatenate_edge_columns(chunk_columns) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Join the parse_edge_chunk results of consecutive chunks."""
+    if not chunk_columns:
+        return tuple(np.zeros(0, dtype=np.int32) for _ in EDGE_ATTRIBUTE_PATTERNS)
+    return tuple(np.concatenate(column) for column in zip(*chunk_columns))
+
+
+def read_rr_edge_columns(rr_graph_file_dir: str, pool=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """src_node, sink_node and switch columns of every edge, in file order.
+
+    The chunks of <rr_edges> are parsed on pool when one is given, otherwise in
+    this process.
+    """
+    thread_args = get_edge_chunk_args(rr_graph_file_dir)
+    if pool is not None:
+        return concatenate_edge_columns(pool.map(parse_edge_chunk, thread_args, chunksize=1))
+    return concatenate_edge_columns([parse_edge_chunk(thread_arg) for thread_arg in thread_args])
+
+
+def _copy_range(mm: mmap.mmap, start: int, end: int, out_file) -> None:
+    for chunk_start in range(start, end, COPY_CHUNK_SIZE):
+        out_file.write(mm[chunk_start:min(end, chunk_start + COPY_CHUNK_SIZE)])
+
+
+def _kept_runs(edge_keep_mask: np.ndarray):
+    """(first, last + 1) edge index pairs of the runs of consecutive kept edges."""
+    padded = np.concatenate(([False], edge_keep_mask, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return zip(changes[0::2], changes[1::2])
+
+
+def write_rr_graph_variants(rr_graph_file_dir: str,
+                            output_edge_keep_masks: Dict[str, np.ndarray],
+                            edge_offsets: EdgeOffsets | None = None) -> EdgeOffsets:
+    """Write one copy of rr_graph_file_dir per output file, keeping only the edges set in its mask.
+
+    Everything outside <rr_edges> is copied byte for byte; inside it, each run of
+    consecutive kept edges is copied as a single slice. edge_offsets can be passed
+    in when the same source is spliced several times; the offsets used are returned.
+    """
+    with open(rr_graph_file_dir, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if edge_offsets is None:
+            edge_offsets = index_edge_offsets(mm)
+        boundaries = edge_offsets.boundaries
+
+        for output_file_dir, edge_keep_mask in output_edge_keep_masks.items():
+            if len(edge_keep_mask) != edge_offsets.num_edges:
+                raise ValueError(f"{output_file_dir}: keep mask has {len(edge_keep_mask)} entries, "
+                                 f"{rr_graph_file_dir} has {edge_offsets.num_edges} edges")
+            with open(output_file_dir, "wb") as out_file:
+                _copy_range(mm, 0, edge_offsets.edges_start, out_file)
+                for first, last in _kept_runs(edge_keep_mask):
+                    _copy_range(mm, int(boundaries[first]), int(boundaries[last]), out_file)
+                _copy_range(mm, edge_offsets.edges_end, len(mm), out_file)
+
+    return edge_offsets
@@ -0,0 +1,163 @@
+"""Share one parsed rr_graph with Pool workers through multiprocessing.shared_memory.
+
+The parent parses a graph once and copies its columns (and the byte offsets of
+its edges) into shared memory blocks; a worker attaches to the blocks by name
+and gets an RRGraph whose arrays are views of them, without copying or
+unpickling the graph. A worker then only receives the keep mask of the variant
+it writes.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass, fields
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List
+
+import numpy as np
+
+from rr_graph_mmap import EdgeOffsets, write_rr_graph_variants
+from rr_graph_table import RREdgeTable, RRGraph, RRNodeTable
+from rr_graph_timing import JobTimer
+
+
+@dataclass(frozen=True)
+class SharedArraySpec:
+    name: str
+    dtype: str
+    shape: tuple
+
+
+@dataclass(frozen=True)
+class SharedRRGraphHandle:
+    """Picklable description of a graph in shared memory, passed to the workers."""
+
+    max_x: int
+    max_y: int
+    max_layer: int
+    nodes: Dict[str, SharedArraySpec]
+    edges: Dict[str, SharedArraySpec]
+    edge_boundaries: SharedArraySpec | None
+
+
+class SharedRRGraph:
+    """Owner of the shared memory blocks of one graph; unlinks them on close.
+
+    Use as a context manager in the parent, around the Pool tasks that attach to
+    handle.
+    """
+
+    def __init__(self, rr_graph: RRGraph, edge_offsets: EdgeOffsets | None = None) -> None:
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.handle = SharedRRGraphHandle(
+            max_x=rr_graph.max_x, max_y=rr_graph.max_y, max_layer=rr_graph.max_layer,
+            nodes=self._share_table(rr_graph.nodes), edges=self._share_table(rr_graph.edges),
+            edge_boundaries=self._share(edge_offsets.boundaries) if edge_offsets is not None else None)
+
+    def _share(self, array: np.ndarray) -> SharedArraySpec:
+        # Zero-sized blocks are not allowed
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return SharedArraySpec(name=block.name, dtype=array.dtype.str, shape=array.shape)
+
+    def _share_table(self, table) -> Dict[str, SharedArraySpec]:
+        return {field.name: self._share(getattr(table, field.name)) for field in fields(table)}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self.blocks)
+
+    def close(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self) -> SharedRRGraph:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# Blocks this worker is attached to, by name. The mapping of a block has to stay
+# open while arrays use it, so blocks are closed when the next graph is attached.
+_attached_blocks: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    block = _attached_blocks.get(name)
+    if block is None:
+        block = shared_memory.SharedMemory(name=name)
+        if sys.version_info < (3, 13):
+            # Attaching registers the block with the resource tracker as if this
+            # process owned it, which would unlink it behind the parent's back
+            resource_tracker.unregister(block._name, "shared_memory")
+        _attached_blocks[name] = block
+    return block
+
+
+def _release_blocks(keep_names) -> None:
+    for name in [name for name in _attached_blocks if name not in keep_names]:
+        try:
+            _attached_blocks.pop(name).close()
+        except BufferError:
+            # An array of an earlier graph is still alive; the mapping goes with the process
+            pass
+
+
+def attach_rr_graph(handle: SharedRRGraphHandle) -> tuple[RRGraph, EdgeOffsets | None]:
+    """RRGraph (and edge offsets) backed by the shared blocks of handle; the arrays are read-only."""
+    specs = [*handle.nodes.values(), *handle.edges.values()]
+    if handle.edge_boundaries is not None:
+        specs.append(handle.edge_boundaries)
+    _release_blocks({spec.name for spec in specs})
+
+    def view(spec: SharedArraySpec) -> np.ndarray:
+        array = np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=_attach_block(spec.name).buf)
+        array.flags.writeable = False
+        return array
+
+    rr_graph = RRGraph(max_x=handle.max_x, max_y=handle.max_y, max_layer=handle.max_layer,
+                       nodes=RRNodeTable(**{name: view(spec) for name, spec in handle.nodes.items()}),
+                       edges=RREdgeTable(**{name: view(spec) for name, spec in handle.edges.items()}))
+    edge_offsets = EdgeOffsets(boundaries=view(handle.edge_boundaries)) \
+        if handle.edge_boundaries is not None else None
+    return rr_graph, edge_offsets
+
+
+def get_write_job_name(output_file_dir: str) -> str:
+    """Timing job name of the write_shared_rr_graph_variant task writing output_file_dir."""
+    return f"write_{os.path.splitext(os.path.basename(output_file_dir))[0]}"
+
+
+def write_shared_rr_graph_variant(thread_arg):
+    """Pool task writing one variant of a shared graph.
+
+    thread_arg is [handle, source rr_graph file, output file, edge keep mask,
+    output format, capnp schema, timing directory].
+    """
+    handle = thread_arg[0]
+    rr_graph_file_dir = thread_arg[1]
+    output_file_dir = thread_arg[2]
+    edge_keep_mask = thread_arg[3]
+    output_format = thread_arg[4]
+    capnp_schema = thread_arg[5]
+    timing_dir = thread_arg[6]
+
+    rr_graph, edge_offsets = attach_rr_graph(handle)
+    rr_graph_name = os.path.basename(output_file_dir)
+    timer = JobTimer(get_write_job_name(output_file_dir))
+    timer.set_graph_size(rr_graph)
+    print(f"\tStart writing {rr_graph_name} (pid {os.getpid()}, "
+          f"{np.count_nonzero(~edge_keep_mask)} edges removed)")
+    with timer.phase("write", num_edges=int(np.count_nonzero(edge_keep_mask))) as phase:
+        if output_format == "bin":
+            from rr_graph_capnp import write_rr_graph_binary_variants
+            write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph, {output_file_dir: edge_keep_mask}, capnp_schema)
+        else:
+            write_rr_graph_variants(rr_graph_file_dir, {output_file_dir: edge_keep_mask}, edge_offsets)
+    print(f"\tDone writing {rr_graph_name} ({phase.wall_time:.6f} seconds)!")
+    timer.write(timing_dir)
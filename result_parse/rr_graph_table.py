@@ -0,0 +1,355 @@
+"""Compact, array-backed view of a VPR rr_graph shared by the rr_graph scripts.
+
+Every node attribute the scripts look at is stored as one NumPy column indexed by
+node id, and every edge as one entry of the src/sink/switch int32 columns, in the
+order the edges appear in <rr_edges>. Fan-in and fan-out lookups go through
+CSR-style adjacencies built from those columns.
+"""
+
+from __future__ import annotations
+
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from rr_graph_mmap import concatenate_edge_columns, get_edge_chunk_args, iter_events_outside_rr_edges, \
+    parse_edge_chunk
+
+
+# OTHER stands for any node type not listed, so newer VPR versions still load
+NODE_TYPES = ("CHANX", "CHANY", "SOURCE", "SINK", "OPIN", "IPIN", "CHANZ", "MUX", "OTHER")
+NODE_TYPE_CODE = {node_type: code for code, node_type in enumerate(NODE_TYPES)}
+CHANX = NODE_TYPE_CODE["CHANX"]
+CHANY = NODE_TYPE_CODE["CHANY"]
+OTHER = NODE_TYPE_CODE["OTHER"]
+NO_SEGMENT = -1
+SEGMENT_NAME_LENGTH = re.compile(r"(\d+)$")
+
+
+def node_type_code(node_type: str) -> int:
+    return NODE_TYPE_CODE.get(node_type, OTHER)
+
+
+@dataclass(frozen=True)
+class RRGraphMetadata:
+    """Device size and wire segment types, from the sections before <rr_nodes>.
+
+    segment_lengths maps a segment id to its length in tiles, or to None when
+    the rr_graph does not say (no length attribute and no trailing number in
+    the segment name).
+    """
+
+    max_x: int
+    max_y: int
+    max_layer: int
+    segment_names: Dict[int, str]
+    segment_lengths: Dict[int, int | None]
+
+
+@dataclass(frozen=True)
+class RRNodeTable:
+    """Per-node columns, indexed by node id."""
+
+    xlow: np.ndarray
+    xhigh: np.ndarray
+    ylow: np.ndarray
+    yhigh: np.ndarray
+    layer: np.ndarray
+    type: np.ndarray
+    segment_id: np.ndarray
+    length: np.ndarray
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.layer)
+
+    def is_chan(self) -> np.ndarray:
+        """Boolean mask of CHANX/CHANY nodes."""
+        return (self.type == CHANX) | (self.type == CHANY)
+
+    def segment_lengths(self) -> Dict[int, int]:
+        """{segment id: length in tiles} of the segments the wire nodes use."""
+        segment_ids, first_node = np.unique(self.segment_id, return_index=True)
+        return {int(segment_id): int(self.length[node])
+                for segment_id, node in zip(segment_ids, first_node) if segment_id != NO_SEGMENT}
+
+
+@dataclass(frozen=True)
+class CSRAdjacency:
+    """Edge indices grouped by node: the edges of node n are edges[offsets[n]:offsets[n + 1]]."""
+
+    offsets: np.ndarray
+    edges: np.ndarray
+
+    def edges_of(self, node_id: int) -> np.ndarray:
+        return self.edges[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+@dataclass(frozen=True)
+class RREdgeTable:
+    """Edge columns in <rr_edges> order."""
+
+    src: np.ndarray
+    sink: np.ndarray
+    switch: np.ndarray
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.src)
+
+
+@dataclass(frozen=True)
+class RRGraph:
+    max_x: int
+    max_y: int
+    max_layer: int
+    nodes: RRNodeTable
+    edges: RREdgeTable
+
+    @property
+    def grid_shape(self) -> tuple[int, int, int]:
+        return self.max_layer + 1, self.max_x + 1, self.max_y + 1
+
+    def tile_of_nodes(self, node_ids: np.ndarray) -> np.ndarray:
+        """Flat index of the (layer, xhigh, yhigh) tile of each node in a grid of grid_shape."""
+        nodes = self.nodes
+        return np.ravel_multi_index((nodes.layer[node_ids], nodes.xhigh[node_ids], nodes.yhigh[node_ids]),
+                                    self.grid_shape)
+
+    def inter_die_edges(self) -> np.ndarray:
+        """Indices of the edges whose src and sink nodes are on different layers."""
+        layer = self.nodes.layer
+        return np.flatnonzero(layer[self.edges.src] != layer[self.edges.sink])
+
+    def out_adjacency(self) -> CSRAdjacency:
+        """Outgoing edges of every node (fan-out)."""
+        return build_csr(self.edges.src, self.nodes.num_nodes)
+
+    def in_adjacency(self) -> CSRAdjacency:
+        """Incoming edges of every node (fan-in)."""
+        return build_csr(self.edges.sink, self.nodes.num_nodes)
+
+
+def build_csr(node_of_edge: np.ndarray, num_nodes: int) -> CSRAdjacency:
+    """Group edge indices by the node in node_of_edge, keeping <rr_edges> order within a node."""
+    edges = np.argsort(node_of_edge, kind="stable").astype(np.int32)
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(node_of_edge, minlength=num_nodes), out=offsets[1:])
+    return CSRAdjacency(offsets=offsets, edges=edges)
+
+
+def rank_within_groups(group_of_item: np.ndarray, random_key: np.ndarray):
+    """Shuffle items inside their groups and return (rank of each item, size of its group).
+
+    Items are ordered by (group, random_key); an item gets rank r if it is the
+    r-th item of its group in that order. Removing the items whose rank is below
+    int(group size * rate) removes that fraction of every group.
+    """
+    order = np.lexsort((random_key, group_of_item))
+    _, group_idx, group_size = np.unique(group_of_item, return_inverse=True, return_counts=True)
+    group_start = np.concatenate(([0], np.cumsum(group_size)[:-1]))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - group_start[group_idx[order]]
+    return rank, group_size[group_idx]
+
+
+def describe_within_groups(group_of_item: np.ndarray, value: np.ndarray, quantiles=(0.5, 0.95)):
+    """Distribution of the non-negative integer value of the items of every group.
+
+    Returns (groups, group size, mean, {quantile: value}, max, histogram), where
+    histogram[g, v] counts the items of groups[g] whose value is v. Quantiles are
+    nearest-rank: the smallest value with at least that fraction of the group
+    at or below it.
+    """
+    groups, group_idx, group_size = np.unique(group_of_item, return_inverse=True, return_counts=True)
+    sorted_value = value[np.lexsort((value, group_idx))]
+    group_start = np.cumsum(group_size) - group_size
+    mean = np.bincount(group_idx, weights=value, minlength=len(groups)) / group_size
+    quantile_values = {q: sorted_value[group_start + np.maximum(np.ceil(q * group_size).astype(np.int64), 1) - 1]
+                       for q in quantiles}
+    max_value = sorted_value[group_start + group_size - 1]
+    num_values = int(value.max()) + 1 if len(value) else 1
+    histogram = np.bincount(group_idx * num_values + value,
+                            minlength=len(groups) * num_values).reshape(len(groups), num_values)
+    return groups, group_size, mean, quantile_values, max_value, histogram
+
+
+def removal_threshold(group_size: np.ndarray, rate: float) -> np.ndarray:
+    """Number of items removed from a group of group_size items at the given rate."""
+    return (group_size * rate).astype(np.int64)
+
+
+def grid_extent(grid_locs: Iterable[ET.Element]) -> tuple[int, int, int]:
+    """Largest x, y and layer of the <grid_loc> elements."""
+    max_x = 0
+    max_y = 0
+    max_layer = 0
+    for grid_loc_tag in grid_locs:
+        max_x = max(max_x, int(grid_loc_tag.get("x")))
+        max_y = max(max_y, int(grid_loc_tag.get("y")))
+        max_layer = max(max_layer, int(grid_loc_tag.get("layer", 0)))
+    return max_x, max_y, max_layer
+
+
+def segment_lengths_of(segments_tag: ET.Element) -> tuple[Dict[int, str], Dict[int, int | None]]:
+    """({segment id: name}, {segment id: length}) of a <segments> element.
+
+    The length attribute is used when the rr_graph has one; older VPR versions
+    only write the name, whose trailing number ("L4", "L16") is used instead.
+    """
+    segment_names = {}
+    segment_lengths = {}
+    for segment_tag in segments_tag.iter("segment"):
+        segment_id = int(segment_tag.get("id"))
+        name = segment_tag.get("name", "")
+        length = segment_tag.get("length")
+        if length is None:
+            name_length = SEGMENT_NAME_LENGTH.search(name)
+            length = name_length.group(1) if name_length else None
+        segment_names[segment_id] = name
+        segment_lengths[segment_id] = int(length) if length is not None else None
+    return segment_names, segment_lengths
+
+
+def read_rr_graph_metadata(rr_graph_file_dir: str) -> RRGraphMetadata:
+    """Read <segments> and <grid> with iterparse and stop at the <rr_nodes> start tag.
+
+    The nodes and edges, nearly all of the file, are never read.
+    """
+    grid = (0, 0, 0)
+    segments = ({}, {})
+    for event, elem in ET.iterparse(rr_graph_file_dir, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "rr_nodes":
+                break
+            continue
+        if elem.tag == "segments":
+            segments = segment_lengths_of(elem)
+        elif elem.tag == "grid":
+            grid = grid_extent(elem)
+            elem.clear()
+    return RRGraphMetadata(*grid, *segments)
+
+
+class _NodeColumnBuilder:
+    """Collects <node> attributes in file order and scatters them by id once all are read."""
+
+    def __init__(self, segment_lengths: Dict[int, int | None]) -> None:
+        self.segment_lengths = segment_lengths
+        self.ids: List[int] = []
+        self.columns: List[List[int]] = [[] for _ in range(7)]
+
+    def add(self, node_tag: ET.Element) -> None:
+        loc_tag = node_tag.find("loc")
+        node_type = node_type_code(node_tag.get("type"))
+        segment_id = NO_SEGMENT
+        if node_type == CHANX or node_type == CHANY:
+            segment_id = int(node_tag.find("segment").get("segment_id"))
+        self.ids.append(int(node_tag.get("id")))
+        for column, value in zip(self.columns, (
+                int(loc_tag.get("xlow")), int(loc_tag.get("xhigh")),
+                int(loc_tag.get("ylow")), int(loc_tag.get("yhigh")),
+                int(loc_tag.get("layer", 0)), node_type, segment_id)):
+            column.append(value)
+
+    def build(self) -> RRNodeTable:
+        ids = np.array(self.ids, dtype=np.int32)
+        num_nodes = int(ids.max()) + 1 if len(ids) else 0
+        dtypes = (np.int16, np.int16, np.int16, np.int16, np.int8, np.int8, np.int16)
+        columns = []
+        for values, dtype in zip(self.columns, dtypes):
+            column = np.full(num_nodes, NO_SEGMENT, dtype=dtype)
+            column[ids] = values
+            columns.append(column)
+        return RRNodeTable(*columns, length=self._wire_lengths(*columns[:4], columns[6]))
+
+    def _wire_lengths(self, xlow, xhigh, ylow, yhigh, segment_id) -> np.ndarray:
+        """Length of the segment type of every wire node.
+
+        A segment whose length the rr_graph does not give gets the longest span
+        of its wires; wires cut by the device edge are shorter than that.
+        """
+        length = np.full(len(segment_id), NO_SEGMENT, dtype=np.int16)
+        span = np.maximum(xhigh - xlow, yhigh - ylow) + 1
+        for seg_id in np.unique(segment_id[segment_id != NO_SEGMENT]):
+            of_segment = segment_id == seg_id
+            segment_length = self.segment_lengths.get(int(seg_id))
+            length[of_segment] = segment_length if segment_length is not None else span[of_segment].max()
+        return length
+
+
+def _edge_table(src: Iterable[int], sink: Iterable[int], switch: Iterable[int]) -> RREdgeTable:
+    return RREdgeTable(src=np.fromiter(src, dtype=np.int32),
+                       sink=np.fromiter(sink, dtype=np.int32),
+                       switch=np.fromiter(switch, dtype=np.int32))
+
+
+def read_rr_graph(rr_graph_file_dir: str, pool=None) -> RRGraph:
+    """Stream an rr_graph file with iterparse into an RRGraph.
+
+    Each <grid_loc>, <node> and <edge> element is dropped as soon as it has been
+    read, so the document tree is never held in memory. With a pool, the XML
+    parser skips <rr_edges>; the edges are read in chunks on the pool while this
+    process reads the nodes.
+    """
+    grid = (0, 0, 0)
+    node_builder = _NodeColumnBuilder({})
+    edge_src = []
+    edge_sink = []
+    edge_switch = []
+
+    if pool is not None:
+        edge_chunks = pool.map_async(parse_edge_chunk, get_edge_chunk_args(rr_graph_file_dir), chunksize=1)
+        events = iter_events_outside_rr_edges(rr_graph_file_dir)
+    else:
+        events = ET.iterparse(rr_graph_file_dir, events=("start", "end"))
+
+    section = None
+    for event, elem in events:
+        if event == "start":
+            if elem.tag in ("rr_nodes", "rr_edges"):
+                section = elem
+            continue
+        if elem.tag == "edge":
+            edge_src.append(int(elem.get("src_node")))
+            edge_sink.append(int(elem.get("sink_node")))
+            edge_switch.append(int(elem.get("switch")))
+            section.clear()
+        elif elem.tag == "node":
+            node_builder.add(elem)
+            section.clear()
+        elif elem.tag == "segments":
+            _, node_builder.segment_lengths = segment_lengths_of(elem)
+        elif elem.tag == "grid":
+            grid = grid_extent(elem)
+            elem.clear()
+
+    if pool is not None:
+        edges = RREdgeTable(*concatenate_edge_columns(edge_chunks.get()))
+    else:
+        edges = _edge_table(edge_src, edge_sink, edge_switch)
+    return RRGraph(*grid, nodes=node_builder.build(), edges=edges)
+
+
+def rr_graph_from_root(root_tag: ET.Element) -> RRGraph:
+    """Build an RRGraph from an already parsed ElementTree root.
+
+    Edge i of the returned table is the i-th child of <rr_edges>.
+    """
+    _, segment_lengths = segment_lengths_of(root_tag.find("segments"))
+    node_builder = _NodeColumnBuilder(segment_lengths)
+    for node_tag in root_tag.find("rr_nodes"):
+        node_builder.add(node_tag)
+
+    rr_edge_tag = root_tag.find("rr_edges")
+    return RRGraph(*grid_extent(root_tag.find("grid")),
+                   nodes=node_builder.build(),
+                   edges=_edge_table((int(edge_tag.get("src_node")) for edge_tag in rr_edge_tag),
+                                     (int(edge_tag.get("sink_node")) for edge_tag in rr_edge_tag),
+                                     (int(edge_tag.get("switch")) for edge_tag in rr_edge_tag)))
@@ -0,0 +1,121 @@
+"""Per-phase timing and memory records of the rr_graph jobs.
+
+A job times its phases (parse, build, remove, write, ...) with
+JobTimer.phase(); every phase records wall time, CPU time, the peak RSS of the
+process so far and the node and edge counts of the graph it worked on. The
+records of a job are written to <timing_dir>/<job>.json, and
+write_timing_csv() gathers the JSON files of the jobs of a run into timing.csv with an
+edges/second column to compare throughput across graph sizes and versions of
+the pipeline.
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Iterable, List
+
+
+TIMING_CSV_NAME = "timing.csv"
+
+
+@dataclass
+class PhaseRecord:
+    job: str
+    phase: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    peak_rss_mb: float = 0.0
+    num_nodes: int = 0
+    num_edges: int = 0
+
+    @property
+    def edges_per_second(self) -> float:
+        return self.num_edges / self.wall_time if self.wall_time > 0 else 0.0
+
+
+def get_peak_rss_mb() -> float:
+    """Peak RSS of this process so far; in a reused Pool worker it includes earlier jobs."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@dataclass
+class JobTimer:
+    job: str
+    num_nodes: int = 0
+    num_edges: int = 0
+    records: List[PhaseRecord] = field(default_factory=list)
+
+    def set_graph_size(self, rr_graph) -> None:
+        """Count the nodes and edges of rr_graph in the phases that follow."""
+        self.num_nodes = rr_graph.nodes.num_nodes
+        self.num_edges = rr_graph.edges.num_edges
+
+    @contextmanager
+    def phase(self, name: str, num_edges: int | None = None):
+        """Time the body of the with statement; the yielded record is filled in when it ends.
+
+        num_edges overrides the graph's edge count, e.g. for a phase that only
+        writes the kept edges.
+        """
+        record = PhaseRecord(job=self.job, phase=name)
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.perf_counter() - start_wall_time
+            record.cpu_time = time.process_time() - start_cpu_time
+            record.peak_rss_mb = get_peak_rss_mb()
+            record.num_nodes = self.num_nodes
+            record.num_edges = self.num_edges if num_edges is None else num_edges
+            self.records.append(record)
+
+    def write(self, timing_dir: str | None) -> None:
+        """Write the records to <timing_dir>/<job>.json; does nothing without a timing_dir."""
+        if timing_dir is None:
+            return
+        os.makedirs(timing_dir, exist_ok=True)
+        with open(get_timing_file(timing_dir, self.job), "w") as f:
+            json.dump([asdict(record) for record in self.records], f, indent=1)
+
+
+def get_timing_file(timing_dir: str, job: str) -> str:
+    return os.path.join(timing_dir, f"{job}.json")
+
+
+def clear_timing_records(timing_dir: str, jobs: Iterable[str]) -> None:
+    """Remove the records an earlier run left for jobs, so a job that fails now leaves none."""
+    for job in jobs:
+        if os.path.isfile(get_timing_file(timing_dir, job)):
+            os.remove(get_timing_file(timing_dir, job))
+
+
+def write_timing_csv(timing_dir: str, jobs: Iterable[str]) -> None:
+    """Gather the <job>.json records of jobs into timing_dir/timing.csv; jobs without records are skipped.
+
+    Only the jobs of the current run are passed in, so records other runs left
+    in timing_dir stay out of the CSV.
+    """
+    rows = []
+    for job in sorted(set(jobs)):
+        json_file_dir = get_timing_file(timing_dir, job)
+        if not os.path.isfile(json_file_dir):
+            continue
+        with open(json_file_dir) as f:
+            for record in json.load(f):
+                record = PhaseRecord(**record)
+                rows.append({**asdict(record), "edges_per_second": f"{record.edges_per_second:.1f}"})
+    if not rows:
+        return
+    timing_csv_dir = os.path.join(timing_dir, TIMING_CSV_NAME)
+    with open(timing_csv_dir, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Timing records are written to {timing_csv_dir}")
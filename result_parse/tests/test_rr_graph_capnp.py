@@ -0,0 +1,199 @@
+"""Round trip of rr_graph_capnp on a small synthetic rr_graph.
+
+A graph from bench_rr_graph, with <metadata> added to some nodes and edges, is
+written to .bin with all of its edges and with every other edge removed. Each
+file is read back with the field names of VPR's schema spelled out here, not
+through rr_graph_capnp's name mapping, and compared against the XML parsed with
+ElementTree.
+
+The schema is rr_graph_uxsdcxx.capnp of the VTR tree
+(https://github.com/verilog-to-routing/vtr-verilog-to-routing), in
+libs/librrgraph/src/io. Point RR_GRAPH_CAPNP_SCHEMA at it, or VTR_ROOT at the
+VTR checkout to search its libs/ for it. Without the schema or pycapnp the
+tests are skipped.
+
+    RR_GRAPH_CAPNP_SCHEMA=<file> python -m pytest result_parse/tests
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_rr_graph import SyntheticArch, write_synthetic_rr_graph  # noqa: E402
+from rr_graph_table import read_rr_graph  # noqa: E402
+
+
+# XML value: enumerant of the schema
+NODE_TYPES = {"CHANX": "chanx", "CHANY": "chany", "SOURCE": "source", "SINK": "sink", "OPIN": "opin", "IPIN": "ipin"}
+DIRECTIONS = {"INC_DIR": "incDir", "DEC_DIR": "decDir"}
+SIDES = {"TOP": "top"}
+ARCH = SyntheticArch(grid_size=3, num_layers=2, channel_width=4)
+
+
+def find_schema() -> str | None:
+    schema_file_dir = os.environ.get("RR_GRAPH_CAPNP_SCHEMA")
+    if schema_file_dir:
+        return schema_file_dir
+    vtr_root = os.environ.get("VTR_ROOT")
+    if vtr_root:
+        matches = sorted(glob.glob(os.path.join(vtr_root, "libs", "**", "rr_graph_uxsdcxx.capnp"), recursive=True))
+        if matches:
+            return matches[0]
+    return None
+
+
+def write_round_trip_rr_graph(rr_graph_file_dir: str) -> None:
+    """The synthetic rr_graph of ARCH, with <metadata> on every node id ending in 0 or 5 and every edge to a sink
+    node id ending in 7."""
+    write_synthetic_rr_graph(rr_graph_file_dir, ARCH, seed=0)
+    with open(rr_graph_file_dir, "r") as f:
+        rr_graph_text = f.read()
+    meta = '<metadata><meta name="{0}">{1}</meta></metadata>'
+    rr_graph_text = re.sub(r'(<node id="(\d*[05])" [^>]*>)',
+                           lambda m: m.group(1) + meta.format("node_tag", m.group(2)), rr_graph_text)
+    rr_graph_text = re.sub(r'<edge src_node="(\d+)" sink_node="(\d*7)" switch="(\d+)"/>',
+                           lambda m: m.group(0)[:-2] + ">" + meta.format("edge_tag", m.group(1) + "_" + m.group(2))
+                           + "</edge>", rr_graph_text)
+    with open(rr_graph_file_dir, "w") as f:
+        f.write(rr_graph_text)
+
+
+def metas_of(elem: ET.Element) -> list:
+    metadata = elem.find("metadata")
+    return [] if metadata is None else [(meta.get("name"), meta.text) for meta in metadata.findall("meta")]
+
+
+def binary_metas(struct) -> list:
+    return [(meta.name, meta.value) for meta in struct.metadata.metas] if struct._has("metadata") else []
+
+
+@pytest.fixture(scope="module")
+def schema_file_dir():
+    pytest.importorskip("capnp", reason="pycapnp is not installed")
+    schema_file_dir = find_schema()
+    if schema_file_dir is None or not os.path.isfile(schema_file_dir):
+        pytest.skip("set RR_GRAPH_CAPNP_SCHEMA or VTR_ROOT to find VTR's rr_graph_uxsdcxx.capnp")
+    return schema_file_dir
+
+
+@pytest.fixture(scope="module")
+def round_trip(schema_file_dir, tmp_path_factory):
+    """The XML root and {keep mask name: (keep mask, message read back)}."""
+    from rr_graph_capnp import load_rr_graph_schema, read_rr_graph_binary, write_rr_graph_binary_variants
+
+    tmp_dir = tmp_path_factory.mktemp("rr_graph_capnp")
+    rr_graph_file_dir = str(tmp_dir / "rr_graph_round_trip.xml")
+    write_round_trip_rr_graph(rr_graph_file_dir)
+    rr_graph = read_rr_graph(rr_graph_file_dir)
+    num_edges = rr_graph.edges.num_edges
+    edge_keep_masks = {"all": np.ones(num_edges, dtype=bool), "half": np.arange(num_edges) % 2 == 0}
+    write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph,
+                                   {str(tmp_dir / f"{name}.bin"): mask for name, mask in edge_keep_masks.items()},
+                                   schema_file_dir)
+
+    rr_graph_schema = load_rr_graph_schema(schema_file_dir)
+    messages = {name: (mask, read_rr_graph_binary(rr_graph_schema, str(tmp_dir / f"{name}.bin")))
+                for name, mask in edge_keep_masks.items()}
+    return ET.parse(rr_graph_file_dir).getroot(), messages
+
+
+@pytest.mark.parametrize("variant", ["all", "half"])
+def test_sections(round_trip, variant):
+    root, messages = round_trip
+    message = messages[variant][1]
+    assert (message.toolName, message.toolVersion, message.toolComment) == \
+        (root.get("tool_name"), root.get("tool_version"), root.get("tool_comment"))
+
+    channel = root.find("channels/channel")
+    assert message.channels.channel.chanWidthMax == int(channel.get("chan_width_max"))
+    assert [(x_list.index, x_list.info) for x_list in message.channels.xLists] == \
+        [(int(x_list.get("index")), int(x_list.get("info"))) for x_list in root.findall("channels/x_list")]
+
+    switches = root.findall("switches/switch")
+    assert len(message.switches.switches) == len(switches) == 3
+    for switch, switch_tag in zip(message.switches.switches, switches):
+        assert (switch.id, switch.name, str(switch.type)) == \
+            (int(switch_tag.get("id")), switch_tag.get("name"), switch_tag.get("type"))
+        assert switch.timing.tdel == float(switch_tag.find("timing").get("Tdel"))
+
+    segments = root.findall("segments/segment")
+    assert len(message.segments.segments) == len(segments) == 2
+    for segment, segment_tag in zip(message.segments.segments, segments):
+        assert (segment.id, segment.name, segment.length, str(segment.resType)) == \
+            (int(segment_tag.get("id")), segment_tag.get("name"), int(segment_tag.get("length")), "general")
+
+    grid_locs = root.findall("grid/grid_loc")
+    assert len(message.grid.gridLocs) == len(grid_locs) == ARCH.num_layers * ARCH.grid_size ** 2
+    for grid_loc, grid_loc_tag in zip(message.grid.gridLocs, grid_locs):
+        assert (grid_loc.layer, grid_loc.x, grid_loc.y, grid_loc.blockTypeId) == \
+            tuple(int(grid_loc_tag.get(name)) for name in ("layer", "x", "y", "block_type_id"))
+
+
+@pytest.mark.parametrize("variant", ["all", "half"])
+def test_nodes(round_trip, variant):
+    root, messages = round_trip
+    nodes = messages[variant][1].rrNodes.nodes
+    node_tags = root.findall("rr_nodes/node")
+    assert len(nodes) == len(node_tags) == ARCH.num_layers * ARCH.grid_size ** 2 * ARCH.nodes_per_tile
+    num_metadata = 0
+    for node, node_tag in zip(nodes, node_tags):
+        loc_tag = node_tag.find("loc")
+        assert (node.id, str(node.type), node.capacity) == \
+            (int(node_tag.get("id")), NODE_TYPES[node_tag.get("type")], int(node_tag.get("capacity")))
+        assert (node.loc.layer, node.loc.xlow, node.loc.ylow, node.loc.xhigh, node.loc.yhigh, node.loc.ptc) == \
+            tuple(int(loc_tag.get(name)) for name in ("layer", "xlow", "ylow", "xhigh", "yhigh", "ptc"))
+        if node_tag.get("direction") is not None:
+            assert str(node.direction) == DIRECTIONS[node_tag.get("direction")]
+            assert node.segment.segmentId == int(node_tag.find("segment").get("segment_id"))
+        if loc_tag.get("side") is not None:
+            assert str(node.loc.side) == SIDES[loc_tag.get("side")]
+        assert binary_metas(node) == metas_of(node_tag)
+        num_metadata += bool(metas_of(node_tag))
+    assert num_metadata > 0
+
+
+@pytest.mark.parametrize("variant", ["all", "half"])
+def test_edges(round_trip, variant):
+    root, messages = round_trip
+    edge_keep_mask, message = messages[variant]
+    edge_tags = [edge_tag for edge_tag, keep in zip(root.findall("rr_edges/edge"), edge_keep_mask) if keep]
+    edges = message.rrEdges.edges
+    assert len(edges) == len(edge_tags) == np.count_nonzero(edge_keep_mask)
+    num_metadata = 0
+    for edge, edge_tag in zip(edges, edge_tags):
+        assert (edge.srcNode, edge.sinkNode, edge.switchId) == \
+            tuple(int(edge_tag.get(name)) for name in ("src_node", "sink_node", "switch"))
+        assert binary_metas(edge) == metas_of(edge_tag)
+        num_metadata += bool(metas_of(edge_tag))
+    assert num_metadata > 0
+
+
+def test_verify_rr_graph_binary(schema_file_dir, tmp_path):
+    """verify_rr_graph_binary accepts the converted file and rejects one whose edge metadata was dropped."""
+    from rr_graph_capnp import (BinaryBase, build_binary_base, verify_rr_graph_binary,
+                                write_rr_graph_binary_variants)
+
+    rr_graph_file_dir = str(tmp_path / "rr_graph_round_trip.xml")
+    binary_file_dir = str(tmp_path / "rr_graph_round_trip.bin")
+    write_round_trip_rr_graph(rr_graph_file_dir)
+    rr_graph = read_rr_graph(rr_graph_file_dir)
+    edge_keep_mask = np.arange(rr_graph.edges.num_edges) % 3 != 0
+    base = build_binary_base(rr_graph_file_dir, rr_graph, schema_file_dir)
+
+    write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph, {binary_file_dir: edge_keep_mask},
+                                   schema_file_dir, base)
+    verify_rr_graph_binary(rr_graph_file_dir, rr_graph, edge_keep_mask, binary_file_dir, schema_file_dir)
+
+    write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph, {binary_file_dir: edge_keep_mask},
+                                   schema_file_dir, BinaryBase(base.message, {}))
+    with pytest.raises(ValueError):
+        verify_rr_graph_binary(rr_graph_file_dir, rr_graph, edge_keep_mask, binary_file_dir, schema_file_dir)
@@ -1,158 +1,313 @@
-import xml.etree.ElementTree as ET
-import random
 import os
 import argparse
+import csv
 from multiprocessing import Pool
-import time
-import io
-
-
-def get_grid_loc(root_tag):
-    grid_tag = root_tag.find("grid")
-    max_x = 0
-    max_y = 0
-    max_layer = 0
-    for grid_loc_tag in grid_tag:
-        loc_x = int(grid_loc_tag.get("x"))
-        loc_y = int(grid_loc_tag.get("y"))
-        loc_layer = int(grid_loc_tag.get("layer"))
-        if loc_x > max_x:
-            max_x = loc_x
-        if loc_y > max_y:
-            max_y = loc_y
-        if loc_layer > max_layer:
-            max_layer = loc_layer
-    return max_x, max_y, max_layer
-
-def does_rr_graph_exist(output_dir, circuit, edge_removal_rate, mux_removal_rate):
-    rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}_mux_{int(mux_removal_rate*100)}.xml"
+import zlib
+import numpy as np
+
+from memory_scheduler import run_with_memory_budget
+from rr_graph_mmap import read_edge_offsets, write_rr_graph_variants
+from rr_graph_shm import SharedRRGraph, get_write_job_name, write_shared_rr_graph_variant
+from rr_graph_cache import read_rr_graph_cached
+from rr_graph_timing import JobTimer, clear_timing_records, write_timing_csv
+from rr_graph_table import NODE_TYPES, describe_within_groups, rank_within_groups, removal_threshold
+
+
+# Rough peak RSS of one job per byte of its input rr_graph XML, refined while running
+RSS_PER_INPUT_BYTE = 2.5
+
+
+def get_mux_rr_graph_name(circuit, edge_removal_rate, mux_removal_rate, output_format="xml"):
+    return f"rr_graph_{circuit}_{int(edge_removal_rate*100)}_mux_{int(mux_removal_rate*100)}.{output_format}"
+
+def get_job_name(circuit, edge_removal_rate):
+    return f"wire_driver_size_{circuit}_{int(edge_removal_rate*100)}"
+
+def does_rr_graph_exist(output_dir, circuit, edge_removal_rate, mux_removal_rate, output_format="xml"):
+    rr_graph_name = get_mux_rr_graph_name(circuit, edge_removal_rate, mux_removal_rate, output_format)
     rr_graph_path = os.path.join(output_dir, rr_graph_name)
     return os.path.exists(rr_graph_path)
 
+def get_mux_removal_ranks(rr_graph, rng):
+    """Rank the edges of the inter-die driver muxes once, for every mux removal rate.
+
+    The candidates are the fan-in edges of the src nodes and the fan-out edges of
+    the sink nodes of the inter-die edges. The edges of every node's fan-in (and
+    fan-out) are shuffled once with a random key, so a rate r removes the edges
+    ranked below int(fan-in size * r) (int(fan-out size * r)). Returns a list of
+    (candidate edges, rank, group size) arrays, one entry for fan-in and one for
+    fan-out.
+    """
+    inter_die_edges = rr_graph.inter_die_edges()
+    mux_removal_ranks = []
+    for mux_nodes, node_of_edge in ((rr_graph.edges.src[inter_die_edges], rr_graph.edges.sink),
+                                    (rr_graph.edges.sink[inter_die_edges], rr_graph.edges.src)):
+        is_mux_node = np.zeros(rr_graph.nodes.num_nodes, dtype=bool)
+        is_mux_node[mux_nodes] = True
+        candidate_edges = np.flatnonzero(is_mux_node[node_of_edge])
+        rank, group_size = rank_within_groups(node_of_edge[candidate_edges], rng.random(len(candidate_edges)))
+        mux_removal_ranks.append((candidate_edges, rank, group_size))
+    return mux_removal_ranks
+
+def get_candidate_bitmap(num_edges, mux_removal_ranks):
+    """Per-edge bitmap of the edges that belong to at least one inter-die driver mux."""
+    is_candidate = np.zeros(num_edges, dtype=bool)
+    for candidate_edges, _, _ in mux_removal_ranks:
+        is_candidate[candidate_edges] = True
+    return is_candidate
+
+def get_mux_removal_bitmap(num_edges, mux_removal_ranks, mux_removal_rate):
+    """Per-edge bitmap of the edges removed at mux_removal_rate.
+
+    An edge selected by both the fan-out of its src node and the fan-in of its
+    sink node sets the same entry, so every edge is counted once.
+    """
+    is_removed = np.zeros(num_edges, dtype=bool)
+    for candidate_edges, rank, group_size in mux_removal_ranks:
+        is_removed[candidate_edges[rank < removal_threshold(group_size, mux_removal_rate)]] = True
+    return is_removed
+
+def get_mux_nodes(rr_graph):
+    """Driver mux nodes of the inter-die edges: {"fan_in": their src nodes, "fan_out": their sink nodes}."""
+    inter_die_edges = rr_graph.inter_die_edges()
+    return {"fan_in": np.unique(rr_graph.edges.src[inter_die_edges]),
+            "fan_out": np.unique(rr_graph.edges.sink[inter_die_edges])}
+
+def get_mux_degree_report(rr_graph, mux_nodes, edge_keep_mask, report_key):
+    """Fan-in and fan-out distribution of the mux nodes over the kept edges, per layer and node type.
+
+    The degree of every node is one np.bincount of the kept edges' sink (fan-in)
+    or src (fan-out) column. Returns one row per (direction, layer, node type),
+    each starting with the entries of report_key; the histogram is written as
+    "degree:count" pairs.
+    """
+    nodes = rr_graph.nodes
+    kept_edges = np.flatnonzero(edge_keep_mask)
+    degree_report = []
+    for direction, node_of_edge in (("fan_in", rr_graph.edges.sink), ("fan_out", rr_graph.edges.src)):
+        direction_nodes = mux_nodes[direction]
+        degree = np.bincount(node_of_edge[kept_edges], minlength=nodes.num_nodes)[direction_nodes]
+        group = nodes.layer[direction_nodes].astype(np.int64) * len(NODE_TYPES) + nodes.type[direction_nodes]
+        groups, group_size, mean, quantiles, max_degree, histogram = describe_within_groups(group, degree)
+        for group_idx, group_key in enumerate(groups):
+            layer, node_type = divmod(int(group_key), len(NODE_TYPES))
+            degree_report.append({**report_key,
+                                  "direction": direction,
+                                  "layer": layer,
+                                  "node_type": NODE_TYPES[node_type],
+                                  "num_nodes": int(group_size[group_idx]),
+                                  "mean": f"{mean[group_idx]:.3f}",
+                                  "p50": int(quantiles[0.5][group_idx]),
+                                  "p95": int(quantiles[0.95][group_idx]),
+                                  "max": int(max_degree[group_idx]),
+                                  "histogram": " ".join(f"{value}:{count}"
+                                                        for value, count in enumerate(histogram[group_idx]) if count)})
+    return degree_report
+
+def get_removal_summary_row(circuit, edge_removal_rate, mux_removal_rate, num_edges, num_candidates, num_removed):
+    effective_rate = num_removed / num_candidates if num_candidates else 0.0
+    return {"circuit": circuit,
+            "edge_removal_rate": edge_removal_rate,
+            "mux_removal_rate": mux_removal_rate,
+            "num_edges": num_edges,
+            "num_mux_edges": num_candidates,
+            "num_removed": num_removed,
+            "effective_mux_removal_rate": f"{effective_rate:.4f}"}
+
+def load_mux_removal_ranks(rr_graph_file_dir, original_rr_graph_name, seed, cache_dir, max_cache_bytes, timer,
+                           pool=None):
+    """Parse the rr_graph and rank its mux edges; returns (rr_graph, ranks, number of mux edges).
+
+    The edges are read on pool when one is given.
+    """
+    print(f"Start working on {original_rr_graph_name}...")
+
+    with timer.phase("parse") as phase:
+        rr_graph = read_rr_graph_cached(rr_graph_file_dir, cache_dir, max_cache_bytes, pool)
+    timer.set_graph_size(rr_graph)
+    print(f"\tParsing {original_rr_graph_name} is done ({phase.wall_time:.2f} seconds)!")
+
+    print(f"\tStart initializing auxiliary data structure for {original_rr_graph_name}..")
+    with timer.phase("build") as phase:
+        rng = np.random.default_rng([seed, zlib.crc32(original_rr_graph_name.encode())])
+        mux_removal_ranks = get_mux_removal_ranks(rr_graph, rng)
+        num_candidates = int(np.count_nonzero(get_candidate_bitmap(rr_graph.edges.num_edges, mux_removal_ranks)))
+    print(f"\tDone initializing auxiliary data structure for {original_rr_graph_name} ({phase.wall_time:.2f} seconds)!")
+
+    print(f"Original number of edges for {original_rr_graph_name}: {rr_graph.edges.num_edges} "
+          f"({num_candidates} inter-die mux edges)")
+    return rr_graph, mux_removal_ranks, num_candidates
+
 def adjust_fan_in_out(thread_arg):
     rr_graph_file_dir = thread_arg[0]
     circuit = thread_arg[1]
     edge_removal_rate = thread_arg[2]
     output_dir = thread_arg[3]
-
-    mux_removal_rates = [0.05, 0.10, 0.30, 0.50, 0.65, 0.80, 0.90, 0.95, 0.98]
+    mux_removal_rates = thread_arg[4]
+    seed = thread_arg[5]
+    output_format = thread_arg[6]
+    capnp_schema = thread_arg[7]
+    cache_dir = thread_arg[8]
+    max_cache_bytes = thread_arg[9]
+    timing_dir = thread_arg[10]
 
     original_rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}.xml"
-
-    print(f"Start working on {original_rr_graph_name}...")
-
-    start_time = time.perf_counter()
-    with io.open(rr_graph_file_dir, 'r') as f:
-        tree = ET.parse(f)
-    end_time = time.perf_counter()
-    execution_time = end_time - start_time
-    print(f"\tParsing {original_rr_graph_name} is done ({execution_time:.2f} seconds)!")
-
-    root = tree.getroot()
-    rr_node_tag = root.find("rr_nodes")
-    rr_edge_tag = root.find("rr_edges")
-
-    nodes = {}
-    max_x, max_y, max_layer = get_grid_loc(root)
-
-    print(f"\tStart initializing auxiliary data structure for {original_rr_graph_name}..")
-    start_time = time.perf_counter()
-    for node_tag in rr_node_tag:
-        node_id = int(node_tag.get("id"))
-        loc_tag = node_tag.find("loc")
-        loc_high = (int(loc_tag.get("xhigh")), int(loc_tag.get("yhigh")), int(loc_tag.get("layer")))
-        nodes[node_id] = {"high_location": loc_high,
-                          "out_edges": [],
-                          "in_edges": []}
-
-    grid_3d_edge_tag = []
-    for l in range(max_layer+1):
-        grid_3d_edge_tag.append([])
-        for x in range(max_x+1):
-            grid_3d_edge_tag[-1].append([])
-            for y in range(max_y+1):
-                grid_3d_edge_tag[-1][-1].append([])
-
-    nods_under_consideration = set()
-
-    original_edges = []
-    for edge_tag in rr_edge_tag:
-        src_node = int(edge_tag.get("src_node"))
-        sink_node = int(edge_tag.get("sink_node"))
-        original_edges.append(edge_tag)
-
-        src_x = nodes[src_node]["high_location"][0]
-        src_y = nodes[src_node]["high_location"][1]
-        src_layer = nodes[src_node]["high_location"][2]
-
-        sink_layer = nodes[sink_node]["high_location"][2]
-        if src_layer != sink_layer:
-            nods_under_consideration.add(src_node)
-            nods_under_consideration.add(sink_node)
-            grid_3d_edge_tag[src_layer][src_x][src_y].append(edge_tag)
-
-    for edge_tag in rr_edge_tag:
-        src_node = int(edge_tag.get("src_node"))
-        sink_node = int(edge_tag.get("sink_node"))
-        if src_node in nods_under_consideration or sink_node in nods_under_consideration:
-            nodes[src_node]["out_edges"].append(edge_tag)
-            nodes[sink_node]["in_edges"].append(edge_tag)
-
-    end_time = time.perf_counter()
-    execution_time = end_time - start_time
-    print(f"\tDone initializing auxiliary data structure for {original_rr_graph_name} ({execution_time:.2f} seconds)!")
-
-
-
-    print(f"Original number of edges for {original_rr_graph_name}: {len(original_edges)}")
+    timer = JobTimer(get_job_name(circuit, edge_removal_rate))
+    rr_graph, mux_removal_ranks, num_candidates = load_mux_removal_ranks(
+        rr_graph_file_dir, original_rr_graph_name, seed, cache_dir, max_cache_bytes, timer)
+    num_edges = rr_graph.edges.num_edges
+
+    removal_summary = []
+    mux_nodes = get_mux_nodes(rr_graph)
+    degree_report = get_mux_degree_report(rr_graph, mux_nodes, np.ones(num_edges, dtype=bool),
+                                          {"circuit": circuit, "edge_removal_rate": edge_removal_rate,
+                                           "mux_removal_rate": 0.0})
+    edge_offsets = None
+    binary_base = None
     for mux_removal_rate in mux_removal_rates:
-        # if does_rr_graph_exist(output_dir, circuit, edge_removal_rate, mux_removal_rate):
+        # if does_rr_graph_exist(output_dir, circuit, edge_removal_rate, mux_removal_rate, output_format):
         #     continue
-        rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}_mux_{int(mux_removal_rate*100)}.xml"
-        edges_to_remove = []
-        for l in range(max_layer+1):
-            for x in range(max_x+1):
-                for y in range(max_y+1):
-                    for edge_tag in grid_3d_edge_tag[l][x][y]:
-                        src_node = int(edge_tag.get("src_node"))
-                        sink_node = int(edge_tag.get("sink_node"))
-
-                        fan_in_edges = nodes[src_node]["in_edges"]
-                        fan_out_edges = nodes[sink_node]["out_edges"]
-                        num_elem = int(len(fan_in_edges) * mux_removal_rate)
-                        edges_to_remove.extend(random.sample(fan_in_edges, num_elem))
-                        num_elem = int(len(fan_out_edges) * mux_removal_rate)
-                        edges_to_remove.extend(random.sample(fan_out_edges, num_elem))
-
-        print(f"\tStart removing {len(edges_to_remove)} number of edges from {rr_graph_name}...")
-        start_time = time.perf_counter()
-        set_edges_to_remove = set(edges_to_remove)
-        remaining_edgs = [edge for edge in original_edges if edge not in set_edges_to_remove]
-        rr_edge_tag[:] = remaining_edgs
-        end_time = time.perf_counter()
-        execution_time = end_time - start_time
-        print(f"\tDone removing {len(edges_to_remove)} number of edges from {rr_graph_name} ({execution_time:.2f} seconds) - {len(rr_edge_tag)} edges remaining!")
-        print(f"\tStart writing {rr_graph_name}")
-        start_time = time.perf_counter()
-        # use IO buffer to write
-        with io.open(os.path.join(output_dir, rr_graph_name), 'wb') as f:
-            tree.write(f, encoding='utf-8', xml_declaration=False)
-        end_time = time.perf_counter()
-        execution_time = end_time - start_time
-        print(f"\tDone writing {rr_graph_name} ({execution_time:.2f} seconds)!")
+        rr_graph_name = get_mux_rr_graph_name(circuit, edge_removal_rate, mux_removal_rate, output_format)
+        is_removed = get_mux_removal_bitmap(num_edges, mux_removal_ranks, mux_removal_rate)
+        num_removed = int(np.count_nonzero(is_removed))
+        summary_row = get_removal_summary_row(circuit, edge_removal_rate, mux_removal_rate,
+                                              num_edges, num_candidates, num_removed)
+        removal_summary.append(summary_row)
+        degree_report += get_mux_degree_report(rr_graph, mux_nodes, ~is_removed,
+                                               {"circuit": circuit, "edge_removal_rate": edge_removal_rate,
+                                                "mux_removal_rate": mux_removal_rate})
+
+        print(f"\tStart writing {rr_graph_name} - {num_removed} unique edges removed "
+              f"(requested rate {mux_removal_rate:.2f}, effective rate {summary_row['effective_mux_removal_rate']} "
+              f"of the inter-die mux edges), {num_edges - num_removed} edges remaining")
+        output_edge_keep_masks = {os.path.join(output_dir, rr_graph_name): ~is_removed}
+        with timer.phase(f"write_mux_{int(mux_removal_rate*100)}", num_edges=num_edges - num_removed) as phase:
+            if output_format == "bin":
+                # The non-edge sections and edge metadata are converted to Cap'n Proto once and copied for every rate
+                from rr_graph_capnp import write_rr_graph_binary_variants
+                binary_base = write_rr_graph_binary_variants(rr_graph_file_dir, rr_graph, output_edge_keep_masks,
+                                                             capnp_schema, binary_base)
+            else:
+                # Everything outside <rr_edges> is copied from the input file, the edge offsets are indexed once
+                edge_offsets = write_rr_graph_variants(rr_graph_file_dir, output_edge_keep_masks, edge_offsets)
+        print(f"\tDone writing {rr_graph_name} ({phase.wall_time:.2f} seconds)!")
 
         print(f"Writing {rr_graph_name} is complete!")
 
+    timer.write(timing_dir)
+    return removal_summary, degree_report
 
+def adjust_fan_in_out_shared(pool, thread_arg):
+    """adjust_fan_in_out with the mux removal rates written in parallel on pool.
+
+    The graph is parsed and ranked in this process and placed in shared memory;
+    every pool task attaches to it and receives only the keep mask of its rate.
+    """
+    rr_graph_file_dir = thread_arg[0]
+    circuit = thread_arg[1]
+    edge_removal_rate = thread_arg[2]
+    output_dir = thread_arg[3]
+    mux_removal_rates = thread_arg[4]
+    seed = thread_arg[5]
+    output_format = thread_arg[6]
+    capnp_schema = thread_arg[7]
+    cache_dir = thread_arg[8]
+    max_cache_bytes = thread_arg[9]
+    timing_dir = thread_arg[10]
+
+    original_rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}.xml"
+    timer = JobTimer(get_job_name(circuit, edge_removal_rate))
+    rr_graph, mux_removal_ranks, num_candidates = load_mux_removal_ranks(
+        rr_graph_file_dir, original_rr_graph_name, seed, cache_dir, max_cache_bytes, timer, pool)
+    num_edges = rr_graph.edges.num_edges
+    edge_offsets = read_edge_offsets(rr_graph_file_dir) if output_format == "xml" else None
+
+    removal_summary = []
+    mux_nodes = get_mux_nodes(rr_graph)
+    degree_report = get_mux_degree_report(rr_graph, mux_nodes, np.ones(num_edges, dtype=bool),
+                                          {"circuit": circuit, "edge_removal_rate": edge_removal_rate,
+                                           "mux_removal_rate": 0.0})
+    variant_args = []
+    with SharedRRGraph(rr_graph, edge_offsets) as shared_rr_graph:
+        for mux_removal_rate in mux_removal_rates:
+            rr_graph_name = get_mux_rr_graph_name(circuit, edge_removal_rate, mux_removal_rate, output_format)
+            is_removed = get_mux_removal_bitmap(num_edges, mux_removal_ranks, mux_removal_rate)
+            removal_summary.append(get_removal_summary_row(circuit, edge_removal_rate, mux_removal_rate, num_edges,
+                                                           num_candidates, int(np.count_nonzero(is_removed))))
+            degree_report += get_mux_degree_report(rr_graph, mux_nodes, ~is_removed,
+                                                   {"circuit": circuit, "edge_removal_rate": edge_removal_rate,
+                                                    "mux_removal_rate": mux_removal_rate})
+            variant_args.append([shared_rr_graph.handle, rr_graph_file_dir, os.path.join(output_dir, rr_graph_name),
+                                 ~is_removed, output_format, capnp_schema, timing_dir])
+        num_written_edges = sum(int(np.count_nonzero(variant_arg[3])) for variant_arg in variant_args)
+        with timer.phase("write", num_edges=num_written_edges):
+            pool.map(write_shared_rr_graph_variant, variant_args, chunksize=1)
+
+    print(f"Writing the mux removal rates of {original_rr_graph_name} is complete!")
+    timer.write(timing_dir)
+    return removal_summary, degree_report
+
+def write_report_csv(output_dir, file_name, job_rows, description):
+    report_file_dir = os.path.join(output_dir, file_name)
+    rows = [row for rows_of_job in job_rows for row in rows_of_job]
+    if not rows:
+        return
+    with open(report_file_dir, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{description} is written to {report_file_dir}")
+
+def write_removal_summary(output_dir, job_results):
+    """Write mux_removal_summary.csv and mux_degree_report.csv from the (summary, degree report) of every job."""
+    write_report_csv(output_dir, "mux_removal_summary.csv",
+                     [removal_summary for removal_summary, _ in job_results], "Mux removal summary")
+    write_report_csv(output_dir, "mux_degree_report.csv",
+                     [degree_report for _, degree_report in job_results], "Mux fan-in/fan-out report")
 
 def getArgs():
     parser = argparse.ArgumentParser()
     parser.add_argument("--vtr_run_dir", required=True, help="VTR task run directory")
     parser.add_argument("--output_dir", required=True, help="Output direcotry to dump new RR Graph files")
     parser.add_argument("-j", required=True, help="Number of available threads")
+    parser.add_argument("--rr_graph_resource_dir", default="/home/ubuntu/titan_resources",
+                        help="Directory containing the rr_graph_<circuit>_<edge removal rate>.xml files")
+    parser.add_argument("--mux_removal_rates", nargs="+", type=float,
+                        default=[0.05, 0.10, 0.30, 0.50, 0.65, 0.80, 0.90, 0.95, 0.98],
+                        help="Fraction of the inter-die driver mux inputs/outputs to remove")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the mux edge ranking; the same seed reproduces the same rr_graphs (default: random)")
+    parser.add_argument("--output_format", choices=["xml", "bin"], default="xml",
+                        help="xml: rr_graph_<circuit>_<rate>_mux_<rate>.xml, bin: VPR's binary .bin rr_graph "
+                             "(requires pycapnp and --capnp_schema); the inputs are always read as XML")
+    parser.add_argument("--capnp_schema", default=None,
+                        help="rr_graph_uxsdcxx.capnp of the VTR tree (libs/librrgraph/src/io) used for --output_format bin")
+    parser.add_argument("--cache_dir", default=None,
+                        help="Cache the parsed node/edge arrays of the input rr_graphs here and reuse them while the file is unchanged")
+    parser.add_argument("--cache_max_gb", type=float, default=50,
+                        help="Size bound of --cache_dir; least recently used entries are evicted beyond it")
+    parser.add_argument("--shared_memory", action="store_true",
+                        help="Parse one rr_graph at a time in the main process (the workers read its edges), share it with them "
+                             "and write its mux removal rates in parallel")
+    parser.add_argument("--timing_dir", default=None,
+                        help="Write per-phase wall/CPU time, peak RSS and graph size of every job here "
+                             "(<job>.json, gathered into timing.csv)")
+    parser.add_argument("--mem_budget", type=float, default=None,
+                        help="Memory budget in GB: start the largest rr_graphs first and only while the estimated "
+                             "peak RSS of the running jobs fits, with at most -j jobs at once")
 
 
     args = parser.parse_args()
+    if args.shared_memory and args.mem_budget is not None:
+        parser.error("--shared_memory and --mem_budget cannot be combined")
+    if args.output_format == "bin":
+        if args.capnp_schema is None:
+            parser.error("--output_format bin requires --capnp_schema")
+        # Checked here, as the workers only import it while writing
+        try:
+            import capnp  # noqa: F401
+        except ImportError:
+            parser.error("--output_format bin requires 'pycapnp'. Install it with: pip install pycapnp")
     return args
 
 def main():
@@ -163,6 +318,9 @@ def main():
     non_existing_rr_graphs = []
 
     number_of_threads = int(args.j)
+    max_cache_bytes = int(args.cache_max_gb * 1024**3)
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % (2**32))
+    print(f"Mux edge ranking seed: {seed}")
 
     edge_removal_rates = [0.50, 0.65, 0.80]
 
@@ -171,20 +329,41 @@ def main():
         for edge_removal_rate in edge_removal_rates:
             print(f"{circuit} - Edge removal rate: {edge_removal_rate}...")
             rr_graph_name = f"rr_graph_{circuit}_{int(edge_removal_rate*100)}.xml"
-            rr_graph_dir = os.path.join("/home/ubuntu/titan_resources", f"{rr_graph_name}")
+            rr_graph_dir = os.path.join(args.rr_graph_resource_dir, f"{rr_graph_name}")
             if not os.path.isfile(rr_graph_dir):
                 non_existing_rr_graphs.append([circuit, edge_removal_rate])
             elif circuit == "directrf_stratixiv_arch_timing" or circuit == "bitcoin_miner_stratixiv_arch_timing" or circuit == "LU_Network_stratixiv_arch_timing" or \
                     circuit == "mes_noc_stratixiv_arch_timing" or circuit == "gsm_switch_stratixiv_arch_timing" or circuit == "sparcT1_chip2_stratixiv_arch_timing":
                 continue
             else:
-                thread_args.append([rr_graph_dir, circuit, edge_removal_rate, args.output_dir])
+                thread_args.append([rr_graph_dir, circuit, edge_removal_rate, args.output_dir, args.mux_removal_rates, seed,
+                                    args.output_format, args.capnp_schema, args.cache_dir, max_cache_bytes,
+                                    args.timing_dir])
 
     print(f"Non-existing RR Graphs: {non_existing_rr_graphs}")
 
-    pool = Pool(number_of_threads)
-    pool.map(adjust_fan_in_out, thread_args)
-    pool.close()
+    timing_jobs = [get_job_name(thread_arg[1], thread_arg[2]) for thread_arg in thread_args]
+    if args.shared_memory:
+        timing_jobs += [get_write_job_name(get_mux_rr_graph_name(thread_arg[1], thread_arg[2], mux_removal_rate,
+                                                                 args.output_format))
+                        for thread_arg in thread_args for mux_removal_rate in args.mux_removal_rates]
+    if args.timing_dir is not None:
+        clear_timing_records(args.timing_dir, timing_jobs)
+
+    if args.mem_budget is not None:
+        job_results = run_with_memory_budget(adjust_fan_in_out, thread_args,
+                                             [os.path.getsize(thread_arg[0]) for thread_arg in thread_args],
+                                             number_of_threads, int(args.mem_budget * 1024**3), RSS_PER_INPUT_BYTE)
+    else:
+        pool = Pool(number_of_threads)
+        if args.shared_memory:
+            job_results = [adjust_fan_in_out_shared(pool, thread_arg) for thread_arg in thread_args]
+        else:
+            job_results = pool.map(adjust_fan_in_out, thread_args)
+        pool.close()
+    write_removal_summary(args.output_dir, job_results)
+    if args.timing_dir is not None:
+        write_timing_csv(args.timing_dir, timing_jobs)
 
     print(f"Done with writing all RR Graphs!")
 
@@ -4,6 +4,7 @@ from subprocess import Popen, PIPE
 import shutil
 import argparse
 
+from runtime_history import RuntimeHistory, get_input_bytes, order_longest_first
 
 
 circuits = ["clstm_like.large", "clstm_like.medium", "dla_like.medium", "proxy.7", "clstm_like.small", "tpu_like.large.ws", "tpu_like.large.os", \
@@ -152,6 +153,10 @@ def run_circuit(thread_arg):
 	print(f"{circuit_name} is done!")
 
 
+def getNetFileSize(thread_arg):
+	return get_input_bytes(os.path.join(thread_arg[2], f"{thread_arg[3]}.net"))
+
+
 def getArgs():
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--arch_file_dir", required=True, help="Directory that contains the input files (architecture, RR graph, etc.)")
@@ -159,6 +164,7 @@ def getArgs():
 	parser.add_argument("--partial_connectivity_net_file_dir", required=True, help="Directory that contains the net file for 60 packed")
 	parser.add_argument("--vpr_dir", required=True, help="VPR Executable Directory")
 	parser.add_argument("-j", required=True, help="Number of circuits running in parallel")
+	parser.add_argument("--runtime_history", default="runtime_history.json", help="Runtime history used to start the longest circuits first")
 
 	args = parser.parse_args()
 	return args
@@ -204,10 +210,18 @@ if __name__ == "__main__":
 		thread_args.append([vpr_dir, arch_file_dir, net_file_dir, circuit, "full3D", False, circuit_path])
 		print(f"{circuit_path} is added")
 
+	history = RuntimeHistory(os.path.join(root_dir, args.runtime_history))
+	thread_args = order_longest_first(thread_args, [history.predict(f"run_artifact/{thread_arg[4]}", thread_arg[3], getNetFileSize(thread_arg))
+		for thread_arg in thread_args])
+
 	pool = Pool(number_of_threads)
-	pool.map(run_circuit, thread_args)
+	pool.map(run_circuit, thread_args, chunksize=1)
 	pool.close()
 
+	for thread_arg in thread_args:
+		history.record(f"run_artifact/{thread_arg[4]}", thread_arg[3], os.path.join(thread_arg[6], "vpr.out"), getNetFileSize(thread_arg))
+	history.save()
+
 	print("Done with all circuits!")
 
 
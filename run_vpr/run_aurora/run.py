@@ -12,15 +12,18 @@ Usage:
     python vpr_processor.py 
 """
 
-import os
 import re
-import shutil
-import subprocess
+import sys
 import argparse
 import logging
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Tuple, Optional
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from runtime_history import RuntimeHistory, get_input_bytes, order_longest_first
+from vpr_job import (MANIFEST_NAME, SKIPPED_MESSAGE, get_command_hash, get_input_digests, get_job_threads,
+                     is_run_satisfied, run_packed_jobs, run_vpr_command, with_num_workers, write_manifest)
 
 
 def setup_logging():
@@ -140,61 +143,6 @@ def update_vpr_command_arch_path(command: str) -> str:
     return " ".join(parts)
 
 
-def run_vpr_command(command: List[str], working_dir: Path) -> Tuple[bool, str]:
-    """
-    Run VPR command in the specified directory.
-    
-    Args:
-        command: VPR command to run
-        working_dir: Directory to run the command in
-        
-    Returns:
-        Tuple of (success, output/error_message)
-    """
-    try:
-        logging.info(f"Running VPR command in {working_dir}: {command}")
-        
-        # Capture output and write to files
-        stdout_file = working_dir / "vpr.out"
-        stderr_file = working_dir / "vpr.err"
-        
-        result = subprocess.run(
-            command,
-            cwd=working_dir,
-            capture_output=True,
-            text=True,
-            timeout=7200  # 1 hour timeout
-        )
-        
-        # Write captured output to files
-        with open(stdout_file, 'w') as f:
-            f.write(result.stdout)
-        
-        with open(stderr_file, 'w') as f:
-            f.write(result.stderr)
-        
-        if result.returncode == 0:
-            logging.info(f"VPR command completed successfully for {working_dir.name}")
-            logging.info(f"Output saved to: {stdout_file}")
-            logging.info(f"Warnings/Info saved to: {stderr_file}")
-            return True, "Success"
-        else:
-            error_msg = f"VPR command failed with return code {result.returncode}"
-            logging.error(error_msg)
-            logging.error(f"Full error output saved to: {stderr_file}")
-            logging.error(f"Full standard output saved to: {stdout_file}")
-            return False, error_msg
-            
-    except subprocess.TimeoutExpired:
-        error_msg = "VPR command timed out after 1 hour"
-        logging.error(error_msg)
-        return False, error_msg
-    except Exception as e:
-        error_msg = f"Error running VPR command: {e}"
-        logging.error(error_msg)
-        return False, error_msg
-
-
 def process_circuit(vpr_binary: Path,
                     circuit_name: str,
                     task_dir: Path,
@@ -203,7 +151,10 @@ def process_circuit(vpr_binary: Path,
                     device_data_dir: Path,
                     device_data_quarter: str,
                     vpr_additional_args: str,
-                    seed_number: int) -> Tuple[str, bool, str]:
+                    seed_number: int,
+                    tail_progress: bool = False,
+                    force_rerun: bool = False,
+                    num_workers: int = 1) -> Tuple[str, bool, str]:
     """
     Process a single circuit: read command, modify it, set up files, and run VPR.
     
@@ -217,6 +168,9 @@ def process_circuit(vpr_binary: Path,
         device_data_quarter: Device data quarter
         vpr_additional_args: Additional VPR command arguments
         seed_number: Seed number for the VPR command
+        tail_progress: Log VPR's progress lines while it runs
+        force_rerun: Run VPR even if the manifest records a successful run with the same command and inputs
+        num_workers: Number of threads VPR runs with
     Returns:
         Tuple of (circuit_name, success, message)
     """
@@ -296,10 +250,23 @@ def process_circuit(vpr_binary: Path,
 
         if vpr_additional_args:
             command.extend(vpr_additional_args.split())
-        
+
+        # Skip the run if a previous invocation already finished it
+        manifest_path = circuit_output_dir / MANIFEST_NAME
+        command_hash = get_command_hash(command)
+        input_digests = get_input_digests([Path(vpr_binary), blif_source, sdc_source, vpr_xml_source,
+                                           sb_maps, sb_templates])
+        if not force_rerun and is_run_satisfied(manifest_path, command_hash, input_digests):
+            logging.info(f"{circuit_name} (seed {seed_number}): {SKIPPED_MESSAGE}")
+            return circuit_name, True, SKIPPED_MESSAGE
+        manifest_path.unlink(missing_ok=True)
+
+        command = with_num_workers(command, num_workers)
+
         # Run VPR command
-        success, message = run_vpr_command(command, circuit_output_dir)
-        
+        success, message = run_vpr_command(command, circuit_output_dir, tail_progress)
+        write_manifest(manifest_path, command, command_hash, input_digests, success, message)
+
         return circuit_name, success, message
         
     except Exception as e:
@@ -331,7 +298,17 @@ def main():
                        help="Device data quarter, e.g., 2024Q3")
 
     parser.add_argument("--max_workers", type=int, default=4,
-                       help="Maximum number of parallel processes (default: 4)")
+                       help="Number of cores shared by the VPR runs when --total_cores is not given (default: 4)")
+
+    parser.add_argument("--total_cores", type=int, default=None,
+                       help="Number of cores shared by the VPR runs; "
+                            "each run gets a thread count from its predicted size")
+
+    parser.add_argument("--total_memory_gb", type=float, default=None,
+                       help="Memory shared by the VPR runs, in GB (default: no limit)")
+
+    parser.add_argument("--max_threads_per_job", type=int, default=None,
+                       help="Largest VPR thread count (--num_workers) of one run (default: all cores)")
     
     parser.add_argument("--seed_numbers", nargs='+', type=int, default=[1],
                        help="Seed numbers for the VPR command (space-separated)")
@@ -339,6 +316,16 @@ def main():
     parser.add_argument("--vpr_additional_args", type=str, default="",
                        help="Additional VPR command arguments")
 
+    parser.add_argument("--tail_progress", action="store_true",
+                       help="Log VPR's progress lines (stage headers, routing result) while it runs")
+
+    parser.add_argument("--force_rerun", action="store_true",
+                       help="Re-run circuits whose manifest records a successful run with the same command and inputs")
+
+    parser.add_argument("--runtime_history", type=str, default=None,
+                       help="Runtime history used to start the longest circuits first "
+                            "(default: runtime_history.json in the output directory)")
+
     args = parser.parse_args()
     
     # Set up logging
@@ -367,28 +354,50 @@ def main():
             return
         
         # Process circuits in parallel using separate processes
-        logging.info(f"Starting parallel processing of {len(circuits)} circuits with {args.max_workers} processes")
+        logging.info(f"Starting parallel processing of {len(circuits)} circuits "
+                     f"on {args.total_cores or args.max_workers} cores")
         
+        history = RuntimeHistory(args.runtime_history or str(output_dir / "runtime_history.json"))
+        flow = f"run_aurora {vpr_additional_args}".strip()
+        blif_bytes = {circuit: get_input_bytes(str(resource_dir / f"{circuit}_post_synth.blif"))
+                      for circuit in circuits}
+        jobs = [(circuit, seed_number) for circuit in circuits for seed_number in seed_numbers]
+        predicted_seconds = {circuit: history.predict(flow, circuit, blif_bytes[circuit]) for circuit in circuits}
+        jobs = order_longest_first(jobs, [predicted_seconds[circuit] for circuit, _ in jobs])
+
+        # Give the long circuits more VPR threads, and pack the jobs into the core and memory budget
+        total_cores = args.total_cores or args.max_workers
+        total_memory_mib = args.total_memory_gb * 1024 if args.total_memory_gb else None
+        job_threads = get_job_threads([predicted_seconds[circuit] for circuit, _ in jobs], total_cores,
+                                      args.max_threads_per_job or total_cores)
+        job_resources = []
+        for (circuit, _), threads in zip(jobs, job_threads):
+            memory_mib = history.predict_memory_mib(flow, circuit, blif_bytes[circuit])
+            if memory_mib is None:
+                memory_mib = total_memory_mib * threads / total_cores if total_memory_mib else 0.0
+            job_resources.append((threads, memory_mib))
+
         results = []
-        with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
-            # Submit all circuit processing tasks
-            future_to_circuit = {
-                executor.submit(process_circuit,
-                                vpr_binary,
-                                circuit,
-                                task_dir,
-                                output_dir,
-                                resource_dir,
-                                device_data_dir,
-                                device_data_quarter,
-                                vpr_additional_args,
-                                seed_number): circuit
-                for circuit in circuits
-                for seed_number in seed_numbers
-            }
-            
+        with ProcessPoolExecutor(max_workers=total_cores) as executor:
+            def start_job(job: int) -> Future:
+                circuit, seed_number = jobs[job]
+                logging.info(f"Starting {circuit} (seed {seed_number}) with {job_resources[job][0]} VPR threads")
+                return executor.submit(process_circuit,
+                                       vpr_binary,
+                                       circuit,
+                                       task_dir,
+                                       output_dir,
+                                       resource_dir,
+                                       device_data_dir,
+                                       device_data_quarter,
+                                       vpr_additional_args,
+                                       seed_number,
+                                       args.tail_progress,
+                                       args.force_rerun,
+                                       job_resources[job][0])
+
             # Collect results as they complete
-            for future in as_completed(future_to_circuit):
+            for job, future in run_packed_jobs(job_resources, start_job, total_cores, total_memory_mib):
                 circuit_name, success, message = future.result()
                 results.append((circuit_name, success, message))
                 
@@ -396,14 +405,22 @@ def main():
                     logging.info(f"✓ {circuit_name}: {message}")
                 else:
                     logging.error(f"✗ {circuit_name}: {message}")
+
+                if message != SKIPPED_MESSAGE:
+                    seed_number = jobs[job][1]
+                    history.record(flow, circuit_name,
+                                   str(output_dir / f"seed_{seed_number}" / circuit_name / circuit_name / "vpr.out"),
+                                   blif_bytes[circuit_name], job_resources[job][0])
+        history.save()
         
         # Summary
         successful = sum(1 for _, success, _ in results if success)
+        skipped = sum(1 for _, _, message in results if message == SKIPPED_MESSAGE)
         total = len(results)
         
         logging.info(f"\n=== PROCESSING SUMMARY ===")
         logging.info(f"Total circuits: {total}")
-        logging.info(f"Successful: {successful}")
+        logging.info(f"Successful: {successful} ({skipped} skipped as already finished)")
         logging.info(f"Failed: {total - successful}")
         
         if successful < total:
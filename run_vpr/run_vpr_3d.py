@@ -6,6 +6,8 @@ import subprocess
 import argparse
 import re
 
+from runtime_history import RuntimeHistory, get_input_bytes, order_longest_first
+
 circuits = ["clstm_like.large", "clstm_like.medium", "dla_like.medium", "proxy.7", "clstm_like.small", "tpu_like.large.ws", "tpu_like.large.os", \
 			"bnn", "dla_like.small", "dnnweaver", "deepfreeze.style3", "lstm", "proxy.5", "bwave_like.fixed.large", "conv_layer", "attention_layer", \
 			"tpu_like.small.ws", "softmax", "tdarknet_like.large", "robot_rl", "bwave_like.fixed.small", "lenet", "eltwise_layer", "reduction_layer", "conv_layer_hls", "spmv"]
@@ -142,6 +144,9 @@ def main():
     parser.add_argument("--architecture_name", help="Architecture name")
     parser.add_argument("--multi_die", help="Multi die", action="store_true")
     parser.add_argument("-j", help="Number of threads to use")
+    parser.add_argument("--runtime_history", default=None,
+                        help="Runtime history used to start the longest circuits first "
+                             "(default: runtime_history.json in the output directory)")
     args = parser.parse_args()
     number_of_threads = int(args.j)
     architecture_name = args.architecture_name
@@ -162,11 +167,20 @@ def main():
         arch_file_dir = os.path.join(args.input_dir, architecture_name)
         blif_file_dir = os.path.join(args.input_dir, f"{circuit}.pre-vpr.blif")
         thread_args.append((vpr_dir, circuit, arch_file_dir, blif_file_dir, net_file_dir, circuit_dir, multi_die))
-    
+
+    history = RuntimeHistory(args.runtime_history or os.path.join(args.output_dir, "runtime_history.json"))
+    flow = f"run_vpr_3d/{architecture_name}/{'3d' if multi_die else '2d'}"
+    thread_args = order_longest_first(thread_args, [history.predict(flow, thread_arg[1], get_input_bytes(thread_arg[3]))
+                                                    for thread_arg in thread_args])
+
     pool = Pool(number_of_threads)
-    pool.map(run_circuit, thread_args)
+    pool.map(run_circuit, thread_args, chunksize=1)
     pool.close()
 
+    for thread_arg in thread_args:
+        history.record(flow, thread_arg[1], os.path.join(thread_arg[5], "vpr.out"), get_input_bytes(thread_arg[3]))
+    history.save()
+
     print("Done with all circuits!")
 
 
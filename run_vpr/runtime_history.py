@@ -0,0 +1,126 @@
+"""Runtime history of VPR runs, used to start the longest circuits of a sweep first.
+
+The history file maps a flow (one runner and configuration) and a circuit to the
+runtime and peak memory VPR reported on its "The entire flow of VPR took" line,
+together with the size of the circuit's input file. A circuit without history
+is estimated from its input size, scaled by the median seconds (or MiB) per byte
+of the flow (or of all flows when the flow has no history yet).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import statistics
+import tempfile
+from typing import Dict, List, Sequence
+
+
+VPR_RUNTIME_PATTERN = re.compile(r"The entire flow of VPR took ([\d.eE+-]+) seconds(?: \(max_rss ([\d.]+) MiB\))?")
+# The runtime line is one of the last lines VPR prints
+VPR_OUT_TAIL_BYTES = 64 * 1024
+
+
+def read_vpr_usage(vpr_out_file: str) -> tuple[float, float | None] | None:
+    """(seconds, max_rss MiB) reported at the end of a VPR log, or None if VPR did not finish."""
+    try:
+        with open(vpr_out_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - VPR_OUT_TAIL_BYTES, 0))
+            tail = f.read().decode(errors="replace")
+    except OSError:
+        return None
+    matches = VPR_RUNTIME_PATTERN.findall(tail)
+    if not matches:
+        return None
+    seconds, max_rss_mib = matches[-1]
+    return float(seconds), float(max_rss_mib) if max_rss_mib else None
+
+
+def read_vpr_runtime(vpr_out_file: str) -> float | None:
+    """Runtime reported at the end of a VPR log, or None if VPR did not finish."""
+    usage = read_vpr_usage(vpr_out_file)
+    return usage[0] if usage is not None else None
+
+
+def get_input_bytes(*input_files: str) -> int:
+    return sum(os.path.getsize(input_file) for input_file in input_files if os.path.isfile(input_file))
+
+
+def _run_value(run: dict, key: str) -> float:
+    return run[key] * run.get("threads", 1) if key == "seconds" else run[key]
+
+
+class RuntimeHistory:
+    """{flow: {circuit: {"seconds": runtime, "threads": VPR threads, "max_rss_mib": peak memory,
+    "input_bytes": size}}} stored as JSON.
+
+    Runtimes are predicted for one thread: a run on n threads counts as n times its runtime.
+    """
+
+    def __init__(self, history_file: str) -> None:
+        self.history_file = os.path.abspath(history_file)
+        self.runs = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, dict]]:
+        try:
+            with open(self.history_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _per_byte(self, flow: str, key: str) -> float | None:
+        for runs in (self.runs.get(flow, {}).values(),
+                     [run for flow_runs in self.runs.values() for run in flow_runs.values()]):
+            ratios = [_run_value(run, key) / run["input_bytes"]
+                      for run in runs if run.get("input_bytes") and run.get(key)]
+            if ratios:
+                return statistics.median(ratios)
+        return None
+
+    def predict(self, flow: str, circuit: str, input_bytes: int) -> float:
+        """Runtime of the last run of circuit in flow, or an estimate from its input size."""
+        run = self.runs.get(flow, {}).get(circuit)
+        if run is not None:
+            return _run_value(run, "seconds")
+        seconds_per_byte = self._per_byte(flow, "seconds")
+        return input_bytes * (seconds_per_byte if seconds_per_byte is not None else 1.0)
+
+    def predict_memory_mib(self, flow: str, circuit: str, input_bytes: int) -> float | None:
+        """Peak memory of the last run of circuit in flow, an estimate from its input size, or None."""
+        run = self.runs.get(flow, {}).get(circuit)
+        if run is not None and run.get("max_rss_mib"):
+            return run["max_rss_mib"]
+        mib_per_byte = self._per_byte(flow, "max_rss_mib")
+        return input_bytes * mib_per_byte if mib_per_byte is not None else None
+
+    def record(self, flow: str, circuit: str, vpr_out_file: str, input_bytes: int, threads: int = 1) -> None:
+        """Remember the runtime and peak memory in vpr_out_file; runs that did not finish are ignored."""
+        usage = read_vpr_usage(vpr_out_file)
+        if usage is not None:
+            seconds, max_rss_mib = usage
+            self.runs.setdefault(flow, {})[circuit] = {"seconds": seconds, "threads": threads,
+                                                       "max_rss_mib": max_rss_mib, "input_bytes": input_bytes}
+
+    def save(self) -> None:
+        """Write the history, keeping the runs other processes saved in the meantime."""
+        runs = self._load()
+        for flow, flow_runs in self.runs.items():
+            runs.setdefault(flow, {}).update(flow_runs)
+        self.runs = runs
+        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        fd, tmp_history_file = tempfile.mkstemp(dir=os.path.dirname(self.history_file))
+        with os.fdopen(fd, "w") as f:
+            json.dump(runs, f, indent=1, sort_keys=True)
+        os.replace(tmp_history_file, self.history_file)
+
+
+def order_longest_first(jobs: Sequence, predicted_seconds: Sequence[float]) -> List:
+    """jobs sorted by predicted runtime, longest first; ties keep their order.
+
+    Starting the longest jobs first keeps any of them from being left running
+    alone at the end of a sweep.
+    """
+    order = sorted(range(len(jobs)), key=lambda job: predicted_seconds[job], reverse=True)
+    return [jobs[job] for job in order]
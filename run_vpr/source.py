@@ -3,6 +3,8 @@ from multiprocessing import Pool
 from subprocess import Popen, PIPE
 import shutil
 
+from runtime_history import RuntimeHistory, get_input_bytes, order_longest_first
+
 def copyFileToCurrDir(*files):
 	for f in files:
 		if os.path.isfile(f):
@@ -14,6 +16,10 @@ def copyFileToCurrDir(*files):
 def getCircuits(reference_dir):
 	return os.listdir(reference_dir)
 
+def getNetFileSize(thread_arg):
+	circuit_name = thread_arg[2]
+	return get_input_bytes(os.path.join(thread_arg[0], circuit_name, "common", circuit_name[:-5]+".net"))
+
 def run_circuit(thread_arg):
 	ref_dir = thread_arg[0]
 	working_dir = os.path.join(thread_arg[1], "common")
@@ -96,6 +102,7 @@ if __name__ == "__main__":
 	print(f"Circuits: {circuits}")
 	first_iter_pres_fac_vec = ["0.1", "0.2", "0.3", "0.4", "0.5"]
 	os.system("rm -rf pres_fac_*")
+	history = RuntimeHistory("runtime_history.json")
 
 	for first_iter_pres_fac in first_iter_pres_fac_vec:
 		os.makedirs(f"pres_fac_{first_iter_pres_fac}/stratixiv_arch.timing.xml")
@@ -110,9 +117,17 @@ if __name__ == "__main__":
 			thread_args.append([reference_dir, circuit_path, circuit, first_iter_pres_fac])
 			print(f"{circuit_path} is added")
 
+		flow = f"source/pres_fac_{first_iter_pres_fac}"
+		thread_args = order_longest_first(thread_args, [history.predict(flow, thread_arg[2], getNetFileSize(thread_arg))
+			for thread_arg in thread_args])
+
 		pool = Pool(20)
-		pool.map(run_circuit, thread_args)
+		pool.map(run_circuit, thread_args, chunksize=1)
 		pool.close()
+
+		for thread_arg in thread_args:
+			history.record(flow, thread_arg[2], os.path.join(thread_arg[1], "common", "vpr.out"), getNetFileSize(thread_arg))
+		history.save()
 		
 		print(f"Done with all circuits! first_iter_pres_fac : {first_iter_pres_fac}")
 
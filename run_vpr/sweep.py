@@ -0,0 +1,490 @@
+"""Run a sweep of VPR jobs described by a YAML or TOML spec.
+
+A spec lists the circuits, the parameter axes of the sweep and the stages run
+for every point (one circuit and one value of every axis); see the files in
+sweeps/ for examples. Every stage of every point is one job, run in its own
+working directory after the stages it depends on; points whose stage has the
+same working directory share its job, so that, say, one placement feeds the
+routing of every rr_graph variant. All jobs share one scheduler: they are
+started longest-predicted-first from the runtime history, packed into a core
+and memory budget with a VPR thread count each, and skipped when their
+manifest records a successful run with the same command and inputs.
+
+Spec keys:
+    name        Flow name of the sweep in the runtime history
+    program     Program the stages run (default: VPR, "{vpr}")
+    variables   Template variables; a null value has to be given with --set
+    circuits    Circuit names, maps of a "name" and per-circuit variables, or
+                {"from_dir": dir, "pattern": regex} for the matching entries of dir
+    axes        {axis: values}; a value is a scalar, or a map of variables holding
+                the axis itself
+    derived     {variable: {"file" or "value": template, "pattern": regex}}, set
+                to the first group of the first match
+    job_dir     Directory of a point, relative to the output directory; a stage runs
+                in it, or in its <stage> subdirectory when there are several stages,
+                unless the stage gives its own working_dir
+    stages      List of {"name", "args", "extra_args", "after", "program",
+                "working_dir", "inputs", "link", "copy", "clean", "size_from"}
+
+Every string of a spec is a template: "{name}" is replaced by the variable
+name, which is a spec variable, an axis, a derived variable, "circuit",
+"output_dir", "job_dir" or "<stage>_dir" (the working directory of a stage of
+the point).
+Arguments that render empty are dropped, and extra_args is split on whitespace.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from runtime_history import RuntimeHistory, get_input_bytes, order_longest_first
+from vpr_job import (MANIFEST_NAME, SKIPPED_MESSAGE, get_command_hash, get_input_digests, get_job_threads,
+                     is_run_satisfied, run_packed_jobs, run_vpr_command, with_num_workers, write_manifest)
+
+
+SPEC_KEYS = {"name", "program", "variables", "circuits", "axes", "derived", "job_dir", "stages"}
+STAGE_KEYS = {"name", "args", "extra_args", "after", "program", "working_dir", "inputs", "link", "copy", "clean",
+              "size_from"}
+TEMPLATE_FIELD_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+@dataclass(frozen=True)
+class SweepJob:
+    """One stage of one point of a sweep, with every template rendered."""
+
+    label: str
+    point: Tuple[Tuple[str, str], ...]
+    stage: str
+    command: Tuple[str, ...]
+    working_dir: str
+    inputs: Tuple[str, ...]
+    link: Tuple[str, ...]
+    copy: Tuple[str, ...]
+    clean: bool
+    input_bytes: int
+    dependencies: Tuple[int, ...]
+
+
+def load_spec(spec_file: str) -> dict:
+    if spec_file.endswith(".toml"):
+        import tomllib
+        with open(spec_file, "rb") as f:
+            spec = tomllib.load(f)
+    else:
+        try:
+            import yaml
+        except ImportError as e:
+            raise SystemExit("YAML sweep specs require 'pyyaml'. Install it with: pip install pyyaml") from e
+        with open(spec_file, "r") as f:
+            spec = yaml.safe_load(f)
+
+    unknown_keys = set(spec) - SPEC_KEYS
+    if unknown_keys:
+        raise ValueError(f"{spec_file}: unknown keys {sorted(unknown_keys)}")
+    if not spec.get("stages"):
+        raise ValueError(f"{spec_file}: no stages")
+    for stage in spec["stages"]:
+        unknown_keys = set(stage) - STAGE_KEYS
+        if unknown_keys:
+            raise ValueError(f"{spec_file}: unknown keys {sorted(unknown_keys)} in stage {stage.get('name')}")
+        if not re.fullmatch(r"\w+", stage.get("name", "")):
+            raise ValueError(f"{spec_file}: stage names have to be identifiers, got {stage.get('name')!r}")
+    return spec
+
+
+def is_resolved(value) -> bool:
+    return value is not None and not (isinstance(value, str) and TEMPLATE_FIELD_PATTERN.search(value))
+
+
+def render(template, variables: Dict[str, object]) -> str:
+    """template with every {name} replaced by variables[name]."""
+    def substitute(match: re.Match) -> str:
+        name = match.group(1)
+        if not is_resolved(variables.get(name)):
+            raise ValueError(f"Variable {name} of {template!r} is unknown or refers to unknown variables")
+        return str(variables[name])
+
+    return TEMPLATE_FIELD_PATTERN.sub(substitute, str(template))
+
+
+def resolve_variables(variables: Dict[str, object]) -> Dict[str, object]:
+    """Render the variables whose values refer to other variables, as far as those are set."""
+    resolved = dict(variables)
+    progress = True
+    while progress:
+        progress = False
+        for name, value in resolved.items():
+            if isinstance(value, str) and not is_resolved(value) and \
+                    all(is_resolved(resolved.get(reference)) for reference in TEMPLATE_FIELD_PATTERN.findall(value)):
+                resolved[name] = render(value, resolved)
+                progress = True
+    return resolved
+
+
+def get_circuits(spec: dict, variables: Dict[str, str]) -> List[Dict[str, object]]:
+    """Variables of every circuit, "circuit" being its name."""
+    circuits = spec.get("circuits", [])
+    if isinstance(circuits, dict):
+        circuit_dir = render(circuits["from_dir"], variables)
+        pattern = re.compile(circuits.get("pattern", ".*"))
+        return [{"circuit": name} for name in sorted(os.listdir(circuit_dir)) if pattern.fullmatch(name)]
+
+    circuit_variables = []
+    for circuit in circuits:
+        if isinstance(circuit, dict):
+            circuit = dict(circuit)
+            circuit_variables.append({"circuit": circuit.pop("name"), **circuit})
+        else:
+            circuit_variables.append({"circuit": circuit})
+    return circuit_variables
+
+
+def get_axis_points(spec: dict) -> List[Dict[str, object]]:
+    """Variables of every combination of the axis values."""
+    axes = []
+    for axis, values in spec.get("axes", {}).items():
+        axis_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if axis not in value:
+                    raise ValueError(f"Values of axis {axis} given as maps need a {axis} key")
+                axis_values.append(value)
+            else:
+                axis_values.append({axis: value})
+        axes.append(axis_values)
+    return [{name: value for axis_value in combination for name, value in axis_value.items()}
+            for combination in itertools.product(*axes)]
+
+
+def get_derived_variables(spec: dict, variables: Dict[str, str]) -> Dict[str, str]:
+    derived = {}
+    for name, rule in spec.get("derived", {}).items():
+        if "file" in rule:
+            with open(render(rule["file"], variables), "r") as f:
+                text = f.read()
+        else:
+            text = render(rule["value"], variables)
+        match = re.search(rule["pattern"], text)
+        if match is None:
+            raise ValueError(f"Pattern {rule['pattern']!r} of variable {name} not found")
+        derived[name] = match.group(1)
+    return derived
+
+
+def order_stages(stages: List[dict]) -> List[dict]:
+    """Stages sorted so that every stage comes after the stages it depends on."""
+    stage_by_name = {stage["name"]: stage for stage in stages}
+    ordered = []
+    visiting = set()
+
+    def visit(stage: dict):
+        if stage in ordered:
+            return
+        if stage["name"] in visiting:
+            raise ValueError(f"Stage {stage['name']} depends on itself")
+        visiting.add(stage["name"])
+        for dependency in stage.get("after", []):
+            if dependency not in stage_by_name:
+                raise ValueError(f"Stage {stage['name']} depends on unknown stage {dependency}")
+            visit(stage_by_name[dependency])
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def expand_sweep(spec: dict, overrides: Dict[str, str], output_dir: str) -> Tuple[List[SweepJob], List[str]]:
+    """Jobs of every stage of every point, dependencies before dependents, and the labels of broken points."""
+    variables = {**spec.get("variables", {}), **overrides, "output_dir": output_dir}
+    unset_variables = [name for name, value in variables.items() if value is None]
+    if unset_variables:
+        raise ValueError(f"Set the variables {unset_variables} with --set NAME=VALUE")
+    stages = order_stages(spec["stages"])
+    axis_names = list(spec.get("axes", {}))
+    default_job_dir = "/".join(["{circuit}"] + [f"{axis}_{{{axis}}}" for axis in axis_names])
+
+    jobs = []
+    job_of_dir = {}
+    broken_points = []
+    for circuit_variables in get_circuits(spec, resolve_variables(variables)):
+        for axis_variables in get_axis_points(spec):
+            point = {**variables, **circuit_variables, **axis_variables}
+            label = " ".join([str(point["circuit"])] + [f"{axis}={point[axis]}" for axis in axis_names])
+            try:
+                point = resolve_variables(point)
+                point.update(get_derived_variables(spec, point))
+                point = resolve_variables(point)
+
+                point["job_dir"] = render(spec.get("job_dir", default_job_dir), point)
+                for stage in stages:
+                    default_working_dir = "{job_dir}" if len(stages) == 1 else f"{{job_dir}}/{stage['name']}"
+                    working_dir = stage.get("working_dir", default_working_dir)
+                    point[f"{stage['name']}_dir"] = os.path.join(output_dir, render(working_dir, point))
+
+                job_of_stage = {}
+                point_jobs = []
+                for stage in stages:
+                    working_dir = point[f"{stage['name']}_dir"]
+                    program = render(stage.get("program", spec.get("program", "{vpr}")), point)
+                    args = [render(arg, point) for arg in stage.get("args", [])]
+                    args += render(stage.get("extra_args", ""), point).split()
+                    inputs = [program] + [render(path, point)
+                                          for key in ("inputs", "link", "copy") for path in stage.get(key, [])]
+                    inputs += [os.path.join(point[f"{dependency}_dir"], MANIFEST_NAME)
+                               for dependency in stage.get("after", [])]
+                    size_from = [render(path, point) for path in stage.get("size_from", [])] or inputs[1:]
+                    job = SweepJob(
+                        label=label, point=tuple((name, str(point[name])) for name in ["circuit"] + axis_names),
+                        stage=stage["name"], command=tuple([program] + [arg for arg in args if arg]),
+                        working_dir=working_dir, inputs=tuple(inputs),
+                        link=tuple(render(path, point) for path in stage.get("link", [])),
+                        copy=tuple(render(path, point) for path in stage.get("copy", [])),
+                        clean=bool(stage.get("clean", False)), input_bytes=get_input_bytes(*size_from),
+                        dependencies=tuple(job_of_stage[dependency] for dependency in stage.get("after", [])))
+
+                    # Points whose stage has the same working directory share its job
+                    if working_dir in job_of_dir:
+                        shared_job = (jobs + point_jobs)[job_of_dir[working_dir]]
+                        if replace(shared_job, label=label, point=job.point) != job:
+                            raise ValueError(f"Different jobs share the working directory {working_dir}; "
+                                             f"add the axes they differ in to its path")
+                        job_of_stage[stage["name"]] = job_of_dir[working_dir]
+                    else:
+                        job_of_stage[stage["name"]] = job_of_dir[working_dir] = len(jobs) + len(point_jobs)
+                        point_jobs.append(job)
+                jobs.extend(point_jobs)
+            except (OSError, ValueError) as e:
+                for working_dir in [working_dir for working_dir, job in job_of_dir.items() if job >= len(jobs)]:
+                    del job_of_dir[working_dir]
+                logging.error(f"{label}: {e}")
+                broken_points.append(label)
+
+    return jobs, broken_points
+
+
+def is_job_cached(job: SweepJob) -> bool:
+    """Whether the job's manifest records a successful run with its command and inputs."""
+    return is_run_satisfied(Path(job.working_dir) / MANIFEST_NAME, get_command_hash(list(job.command)),
+                            get_input_digests([Path(path) for path in job.inputs]))
+
+
+def prepare_working_dir(job: SweepJob):
+    working_dir = Path(job.working_dir)
+    working_dir.mkdir(parents=True, exist_ok=True)
+    if job.clean:
+        for path in working_dir.iterdir():
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+    for path in job.link:
+        link_path = working_dir / os.path.basename(path)
+        link_path.unlink(missing_ok=True)
+        link_path.symlink_to(path)
+    for path in job.copy:
+        shutil.copy(path, working_dir)
+
+
+def get_missing_inputs(jobs: List[SweepJob]) -> List[List[str]]:
+    """Inputs of every job that do not exist and are not written by a job it depends on."""
+    missing_inputs = []
+    for job in jobs:
+        dependency_manifests = {os.path.join(jobs[dependency].working_dir, MANIFEST_NAME)
+                                for dependency in job.dependencies}
+        missing_inputs.append([path for path in job.inputs
+                               if path not in dependency_manifests and not os.path.exists(path)])
+    return missing_inputs
+
+
+def run_job(job: SweepJob, num_workers: int, tail_progress: bool) -> Tuple[bool, str]:
+    """Run one job in its working directory and record it in its manifest."""
+    try:
+        missing_inputs = [path for path in job.inputs if not os.path.exists(path)]
+        if missing_inputs:
+            return False, f"Missing inputs: {missing_inputs}"
+
+        manifest_path = Path(job.working_dir) / MANIFEST_NAME
+        command = list(job.command)
+        command_hash = get_command_hash(command)
+        input_digests = get_input_digests([Path(path) for path in job.inputs])
+        prepare_working_dir(job)
+        manifest_path.unlink(missing_ok=True)
+
+        command = with_num_workers(command, num_workers)
+        success, message = run_vpr_command(command, Path(job.working_dir), tail_progress)
+        write_manifest(manifest_path, command, command_hash, input_digests, success, message)
+        return success, message
+    except Exception as e:
+        return False, f"Error running {job.label} ({job.stage}): {e}"
+
+
+def get_cached_jobs(jobs: List[SweepJob]) -> List[bool]:
+    """Whether every job can be skipped: it and all the jobs it depends on are cached."""
+    cached = []
+    for job in jobs:
+        cached.append(all(cached[dependency] for dependency in job.dependencies) and is_job_cached(job))
+    return cached
+
+
+def select_jobs(jobs: List[SweepJob], indices: List[int]) -> List[SweepJob]:
+    """jobs[indices], with their dependencies renumbered; dependencies on jobs left out are dropped."""
+    position = {job: index for index, job in enumerate(indices)}
+    return [replace(jobs[job], dependencies=tuple(position[dependency] for dependency in jobs[job].dependencies
+                                                  if dependency in position))
+            for job in indices]
+
+
+def filter_points(jobs: List[SweepJob], restrictions: List[str]) -> List[SweepJob]:
+    """Jobs of the points whose circuit or axis values are in the NAME=VALUE[,VALUE] restrictions.
+
+    The jobs these depend on are kept too, even when they were expanded for another point.
+    """
+    restrictions = [(name, values.split(",")) for name, values in
+                    (restriction.split("=", 1) for restriction in restrictions)]
+    kept = [all(dict(job.point).get(name) in values for name, values in restrictions) for job in jobs]
+    for job in reversed(range(len(jobs))):
+        if kept[job]:
+            for dependency in jobs[job].dependencies:
+                kept[dependency] = True
+    return select_jobs(jobs, [job for job in range(len(jobs)) if kept[job]])
+
+
+def get_critical_path_seconds(jobs: List[SweepJob], predicted_seconds: List[float]) -> List[float]:
+    """Predicted runtime of every job plus the longest chain of jobs depending on it."""
+    critical_path_seconds = list(predicted_seconds)
+    for job in reversed(range(len(jobs))):
+        for dependency in jobs[job].dependencies:
+            critical_path_seconds[dependency] = max(critical_path_seconds[dependency],
+                                                    predicted_seconds[dependency] + critical_path_seconds[job])
+    return critical_path_seconds
+
+
+def setup_logging(output_dir: str):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.FileHandler(os.path.join(output_dir, "sweep.log")), logging.StreamHandler()])
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description="Run a sweep of VPR jobs described by a YAML or TOML spec")
+    parser.add_argument("--spec", required=True, help="Sweep spec (.yaml, .yml or .toml)")
+    parser.add_argument("--output_dir", required=True, help="Directory the job directories are created in")
+    parser.add_argument("--set", nargs="+", action="extend", default=[], metavar="NAME=VALUE",
+                        help="Set spec variables")
+    parser.add_argument("--only", nargs="+", action="extend", default=[], metavar="AXIS=VALUE[,VALUE]",
+                        help="Run only the points with these axis (or circuit) values")
+    parser.add_argument("--total_cores", type=int, default=os.cpu_count(),
+                        help="Number of cores shared by the jobs (default: all cores)")
+    parser.add_argument("--total_memory_gb", type=float, default=None,
+                        help="Memory shared by the jobs, in GB (default: no limit)")
+    parser.add_argument("--max_threads_per_job", type=int, default=None,
+                        help="Largest VPR thread count (--num_workers) of one job (default: all cores)")
+    parser.add_argument("--runtime_history", default=None,
+                        help="Runtime history used to start the longest jobs first "
+                             "(default: runtime_history.json in the output directory)")
+    parser.add_argument("--force_rerun", action="store_true",
+                        help="Re-run jobs whose manifest records a successful run with the same command and inputs")
+    parser.add_argument("--tail_progress", action="store_true",
+                        help="Log VPR's progress lines (stage headers, routing result) while it runs")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Print the jobs, their commands and their missing inputs without running them")
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    setup_logging(output_dir)
+
+    spec = load_spec(args.spec)
+    overrides = dict(assignment.split("=", 1) for assignment in args.set)
+    jobs, broken_points = expand_sweep(spec, overrides, output_dir)
+    jobs = filter_points(jobs, args.only)
+
+    if args.dry_run:
+        missing_inputs = get_missing_inputs(jobs)
+        for job, job_missing_inputs in zip(jobs, missing_inputs):
+            print(f"{job.label} ({job.stage}) in {job.working_dir}:\n\t{' '.join(job.command)}")
+            if job_missing_inputs:
+                print(f"\tMissing inputs: {job_missing_inputs}")
+        num_missing = sum(1 for job_missing_inputs in missing_inputs if job_missing_inputs)
+        if num_missing:
+            logging.error(f"{num_missing} of {len(jobs)} jobs have missing inputs")
+        return 0 if not num_missing and not broken_points else 1
+
+    # Finished jobs are reported without being scheduled
+    results = []
+    cached = get_cached_jobs(jobs) if not args.force_rerun else [False] * len(jobs)
+    for job in (job for job, is_cached in zip(jobs, cached) if is_cached):
+        logging.info(f"✓ {job.label} ({job.stage}): {SKIPPED_MESSAGE}")
+        results.append((job, True, SKIPPED_MESSAGE))
+    to_run = select_jobs(jobs, [job for job, is_cached in enumerate(cached) if not is_cached])
+
+    # Start the jobs on the longest chains first, with VPR threads from their predicted runtime
+    history = RuntimeHistory(args.runtime_history or os.path.join(output_dir, "runtime_history.json"))
+    flow_name = spec.get("name", Path(args.spec).stem)
+    predicted_seconds = [history.predict(f"{flow_name}/{job.stage}", job.label, job.input_bytes) for job in to_run]
+    order = order_longest_first(list(range(len(to_run))), get_critical_path_seconds(to_run, predicted_seconds))
+    to_run = select_jobs(to_run, order)
+    predicted_seconds = [predicted_seconds[job] for job in order]
+
+    total_memory_mib = args.total_memory_gb * 1024 if args.total_memory_gb else None
+    job_threads = get_job_threads(predicted_seconds, args.total_cores, args.max_threads_per_job or args.total_cores)
+    job_resources = []
+    for job, threads in zip(to_run, job_threads):
+        memory_mib = history.predict_memory_mib(f"{flow_name}/{job.stage}", job.label, job.input_bytes)
+        if memory_mib is None:
+            memory_mib = total_memory_mib * threads / args.total_cores if total_memory_mib else 0.0
+        job_resources.append((threads, memory_mib))
+    logging.info(f"Running {len(to_run)} of {len(jobs)} jobs on {args.total_cores} cores")
+
+    succeeded = set()
+    with ProcessPoolExecutor(max_workers=args.total_cores) as executor:
+        def start_job(job: int) -> Future:
+            failed_dependencies = [to_run[dependency].stage for dependency in to_run[job].dependencies
+                                   if dependency not in succeeded]
+            if failed_dependencies:
+                future = Future()
+                future.set_result((False, f"Not run, stages {failed_dependencies} failed"))
+                return future
+            logging.info(f"Starting {to_run[job].label} ({to_run[job].stage}) "
+                         f"with {job_resources[job][0]} VPR threads")
+            return executor.submit(run_job, to_run[job], job_resources[job][0], args.tail_progress)
+
+        for job, future in run_packed_jobs(job_resources, start_job, args.total_cores, total_memory_mib,
+                                           [to_run[job].dependencies for job in range(len(to_run))]):
+            success, message = future.result()
+            results.append((to_run[job], success, message))
+            if success:
+                succeeded.add(job)
+                logging.info(f"✓ {to_run[job].label} ({to_run[job].stage}): {message}")
+                history.record(f"{flow_name}/{to_run[job].stage}", to_run[job].label,
+                               os.path.join(to_run[job].working_dir, "vpr.out"), to_run[job].input_bytes,
+                               job_resources[job][0])
+            else:
+                logging.error(f"✗ {to_run[job].label} ({to_run[job].stage}): {message}")
+    history.save()
+
+    successful = sum(1 for _, success, _ in results if success)
+    skipped = sum(1 for _, _, message in results if message == SKIPPED_MESSAGE)
+    logging.info(f"=== SWEEP SUMMARY ===")
+    logging.info(f"Total jobs: {len(results)}")
+    logging.info(f"Successful: {successful} ({skipped} skipped as already finished)")
+    logging.info(f"Failed: {len(results) - successful}")
+    if broken_points:
+        logging.error(f"Points whose jobs could not be set up: {broken_points}")
+    return 0 if successful == len(results) and not broken_points else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,264 @@
+"""Running one VPR job: its command, its manifest and its share of the machine.
+
+Shared by the run_aurora runner and the sweep engine (sweep.py) so that every
+sweep gets the same caching and resume behaviour. A run writes VPR's output to
+vpr.out and vpr.err in its working directory and records the command and the
+digests of its inputs in run_manifest.json; a run whose manifest matches is
+skipped. Jobs are packed into a core and memory budget, with a VPR thread
+count each.
+"""
+
+import re
+import json
+import hashlib
+import subprocess
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+VPR_TIMEOUT_SECONDS = 7200
+TAIL_POLL_SECONDS = 5
+MANIFEST_NAME = "run_manifest.json"
+SKIPPED_MESSAGE = "Skipped (finished with the same command and inputs)"
+# Stage headers and timings ("# Placement", "## Computing router lookahead map took ..."),
+# the routing result and errors
+PROGRESS_LINE_PATTERN = re.compile(r"#|Circuit successfully routed|Routing failed|Circuit is unroutable|"
+                                   r"Error|The entire flow of VPR took")
+
+
+def tail_progress_lines(tail_file, partial_line: str, circuit_name: str) -> str:
+    """
+    Log the VPR progress lines written to tail_file since the last call.
+
+    Args:
+        tail_file: vpr.out opened for reading, positioned after the lines already seen
+        partial_line: Incomplete last line of the previous call
+        circuit_name: Name used to tag the logged lines
+
+    Returns:
+        The incomplete last line read by this call
+    """
+    for line in tail_file:
+        line = partial_line + line
+        partial_line = ""
+        if not line.endswith("\n"):
+            return line
+        if PROGRESS_LINE_PATTERN.match(line):
+            logging.info(f"[{circuit_name}] {line.rstrip()}")
+    return partial_line
+
+
+def run_vpr_command(command: List[str], working_dir: Path, tail_progress: bool = False) -> Tuple[bool, str]:
+    """
+    Run VPR command in the specified directory.
+
+    VPR's stdout and stderr are written straight to vpr.out and vpr.err, so the
+    worker's memory does not grow with the amount VPR prints.
+
+    Args:
+        command: VPR command to run
+        working_dir: Directory to run the command in
+        tail_progress: Log VPR's progress lines (stage headers, routing result) while it runs
+
+    Returns:
+        Tuple of (success, output/error_message)
+    """
+    try:
+        logging.info(f"Running VPR command in {working_dir}: {command}")
+
+        stdout_file = working_dir / "vpr.out"
+        stderr_file = working_dir / "vpr.err"
+
+        with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr:
+            process = subprocess.Popen(command, cwd=working_dir, stdout=stdout, stderr=stderr)
+        try:
+            if tail_progress:
+                with open(stdout_file, 'r') as tail_file:
+                    partial_line = ""
+                    deadline = time.monotonic() + VPR_TIMEOUT_SECONDS
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        try:
+                            returncode = process.wait(timeout=min(TAIL_POLL_SECONDS, max(remaining, 0)))
+                            break
+                        except subprocess.TimeoutExpired:
+                            if remaining <= TAIL_POLL_SECONDS:
+                                raise
+                        finally:
+                            partial_line = tail_progress_lines(tail_file, partial_line, working_dir.name)
+                    if PROGRESS_LINE_PATTERN.match(partial_line):
+                        logging.info(f"[{working_dir.name}] {partial_line}")
+            else:
+                returncode = process.wait(timeout=VPR_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+
+        if returncode == 0:
+            logging.info(f"VPR command completed successfully for {working_dir.name}")
+            logging.info(f"Output saved to: {stdout_file}")
+            logging.info(f"Warnings/Info saved to: {stderr_file}")
+            return True, "Success"
+        else:
+            error_msg = f"VPR command failed with return code {returncode}"
+            logging.error(error_msg)
+            logging.error(f"Full error output saved to: {stderr_file}")
+            logging.error(f"Full standard output saved to: {stdout_file}")
+            return False, error_msg
+
+    except subprocess.TimeoutExpired:
+        error_msg = f"VPR command timed out after {VPR_TIMEOUT_SECONDS} seconds"
+        logging.error(error_msg)
+        return False, error_msg
+    except Exception as e:
+        error_msg = f"Error running VPR command: {e}"
+        logging.error(error_msg)
+        return False, error_msg
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_input_digests(input_paths: List[Path]) -> Dict[str, str]:
+    """
+    Digest the contents of the input files of a run.
+
+    Args:
+        input_paths: Files, or directories whose files (recursively) are all inputs
+
+    Returns:
+        Dict of {file path: digest}; a missing input maps to "missing"
+    """
+    digests = {}
+    for input_path in input_paths:
+        file_paths = sorted(path for path in input_path.rglob("*") if path.is_file()) \
+            if input_path.is_dir() else [input_path]
+        for file_path in file_paths:
+            try:
+                stat = file_path.stat()
+                digests[str(file_path)] = _file_digest(str(file_path), stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                digests[str(file_path)] = "missing"
+    return digests
+
+
+def get_command_hash(command: List[str]) -> str:
+    return hashlib.blake2b("\0".join(command).encode(), digest_size=20).hexdigest()
+
+
+def with_num_workers(command: List[str], num_workers: int) -> List[str]:
+    """command with VPR's --num_workers, to be run after its hash is taken.
+
+    The thread count is left out of the command hash, so a finished run is not
+    repeated for another one.
+    """
+    return command + ["--num_workers", str(num_workers)] if num_workers > 1 else command
+
+
+def is_run_satisfied(manifest_path: Path, command_hash: str, input_digests: Dict[str, str]) -> bool:
+    """Whether the manifest records a successful run of the same command on the same inputs."""
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("success") is True and manifest.get("command_hash") == command_hash \
+        and manifest.get("inputs") == input_digests
+
+
+def write_manifest(manifest_path: Path, command: List[str], command_hash: str,
+                   input_digests: Dict[str, str], success: bool, message: str):
+    """Record the command, input digests and exit status of a finished run."""
+    tmp_manifest_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_manifest_path, 'w') as f:
+        json.dump({"command": command, "command_hash": command_hash, "inputs": input_digests,
+                   "success": success, "message": message,
+                   "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=1)
+    os.replace(tmp_manifest_path, manifest_path)
+
+
+def get_job_threads(predicted_seconds: List[float], total_cores: int, max_threads_per_job: int) -> List[int]:
+    """
+    Assign every job a VPR thread count from its predicted runtime.
+
+    A job predicted to take longer than an even share of the sweep (the total
+    predicted runtime over total_cores) gets enough threads to fit in that share,
+    so large circuits run multi-threaded and small ones single-threaded.
+
+    Args:
+        predicted_seconds: Predicted single-thread runtime of every job
+        total_cores: Number of cores shared by all jobs
+        max_threads_per_job: Largest thread count of one job
+
+    Returns:
+        Thread count of every job, between 1 and min(max_threads_per_job, total_cores)
+    """
+    max_threads = max(min(max_threads_per_job, total_cores), 1)
+    share = sum(predicted_seconds) / total_cores
+    if share <= 0:
+        return [1] * len(predicted_seconds)
+    return [min(max(math.ceil(seconds / share), 1), max_threads) for seconds in predicted_seconds]
+
+
+def run_packed_jobs(job_resources: List[Tuple[int, float]],
+                    start_job: Callable[[int], Future],
+                    total_cores: int,
+                    total_memory_mib: Optional[float],
+                    dependencies: Optional[Sequence[Sequence[int]]] = None) -> Iterator[Tuple[int, Future]]:
+    """
+    Start jobs in order as their cores and memory free up, and yield them as they finish.
+
+    A job waits until its threads fit in the free cores and its memory in the free
+    memory, and the jobs behind it wait with it, so a large job is not starved by
+    smaller ones. A job larger than the budget starts once nothing else runs.
+    A job whose dependencies have not all finished is passed over until they have.
+
+    Args:
+        job_resources: (threads, memory in MiB) of every job, in start order
+        start_job: Starts the job with the given index and returns its future
+        total_cores: Number of cores shared by all jobs
+        total_memory_mib: Memory shared by all jobs, or None for no limit
+        dependencies: Indices of the jobs every job waits for (default: none)
+
+    Yields:
+        (job index, future) of every job, as it finishes
+    """
+    free_cores = total_cores
+    free_memory_mib = total_memory_mib if total_memory_mib is not None else math.inf
+    running: Dict[Future, int] = {}
+    waiting = list(range(len(job_resources)))
+    finished = set()
+    while waiting or running:
+        for job in list(waiting):
+            if dependencies is not None and not finished.issuperset(dependencies[job]):
+                continue
+            threads, memory_mib = job_resources[job]
+            if running and (threads > free_cores or memory_mib > free_memory_mib):
+                break
+            running[start_job(job)] = job
+            waiting.remove(job)
+            free_cores -= threads
+            free_memory_mib -= memory_mib
+
+        if not running:
+            raise ValueError(f"Jobs {waiting} wait for jobs that never run")
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = running.pop(future)
+            finished.add(job)
+            free_cores += job_resources[job][0]
+            free_memory_mib += job_resources[job][1]
+            yield job, future